@@ -1,55 +1,293 @@
-import boto3
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import re
+from shared import client, instrumented, phase, resource
 
-def lambda_handler(event, context):
-    # Create an EC2 client
-    ec2 = boto3.client('ec2')
+# Comma-separated regions to manage; empty means every region enabled for the account
+REGIONS = [r.strip() for r in os.environ.get('REGIONS', '').split(',') if r.strip()]
+USER_TAG = os.environ.get('USER_TAG', 'Sagar')
+CHUNK_SIZE = int(os.environ.get('CHUNK_SIZE', 50))      # instance IDs per start/stop call
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 8))     # regions scanned in parallel
+# Index of schedulable instances kept current from EventBridge events: a DynamoDB table
+# (partition key 'InstanceId') or, for local runs, a JSON file. Without either every run scans the fleet.
+INDEX_TABLE = os.environ.get('INDEX_TABLE')
+INDEX_FILE = os.environ.get('INDEX_FILE')
 
-    # Find instances with tag Action=Auto-Stop
-    stop_response = ec2.describe_instances(
-        Filters=[
-            {'Name': 'tag:Action', 'Values': ['Auto-Stop']},
-            {'Name': 'tag:USER', 'Values': ['Sagar']},
-            {'Name': 'instance-state-name', 'Values': ['running']}
-        ]
-    )
+SCHEDULE_ACTIONS = ['Auto-Stop', 'Auto-Start']
+LIVE_STATES = ['pending', 'running', 'stopping', 'stopped']
 
-    instances_to_stop = [
-        instance['InstanceId']
-        for reservation in stop_response['Reservations']
-        for instance in reservation['Instances']
-    ]
+class DynamoIndex:
+    """Instance index stored in a DynamoDB table keyed on InstanceId."""
+
+    def __init__(self, table_name):
+        self.table = resource('dynamodb').Table(table_name)
+
+    def items(self):
+        response = self.table.scan()
+        items = response['Items']
+        while 'LastEvaluatedKey' in response:
+            response = self.table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
+            items.extend(response['Items'])
+        return items
+
+    def get(self, instance_id):
+        return self.table.get_item(Key={'InstanceId': instance_id}).get('Item')
+
+    def put(self, item):
+        self.table.put_item(Item=item)
+
+    def delete(self, instance_id):
+        self.table.delete_item(Key={'InstanceId': instance_id})
+
+    def put_many(self, items):
+        # batch_writer sends BatchWriteItem calls of 25 and resends unprocessed items
+        with self.table.batch_writer() as batch:
+            for item in items:
+                batch.put_item(Item=item)
+
+    def delete_many(self, instance_ids):
+        with self.table.batch_writer() as batch:
+            for instance_id in instance_ids:
+                batch.delete_item(Key={'InstanceId': instance_id})
+
+class FileIndex:
+    """Instance index stored as a JSON file, for local runs and tests."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _save(self, data):
+        with open(self.path, 'w') as f:
+            json.dump(data, f)
+
+    def items(self):
+        return list(self._load().values())
+
+    def get(self, instance_id):
+        return self._load().get(instance_id)
+
+    def put(self, item):
+        data = self._load()
+        data[item['InstanceId']] = item
+        self._save(data)
+
+    def delete(self, instance_id):
+        data = self._load()
+        data.pop(instance_id, None)
+        self._save(data)
+
+    def put_many(self, items):
+        data = self._load()
+        data.update((item['InstanceId'], item) for item in items)
+        self._save(data)
+
+    def delete_many(self, instance_ids):
+        data = self._load()
+        for instance_id in instance_ids:
+            data.pop(instance_id, None)
+        self._save(data)
+
+def open_index():
+    if INDEX_TABLE:
+        return DynamoIndex(INDEX_TABLE)
+    if INDEX_FILE:
+        return FileIndex(INDEX_FILE)
+    return None
 
-    # Find instances with tag Action=Auto-Start
-    start_response = ec2.describe_instances(
+def enabled_regions(ec2):
+    """Regions that are opted in for this account (describe_regions omits disabled ones)."""
+    return [r['RegionName'] for r in ec2.describe_regions()['Regions']]
+
+def describe_schedulable(ec2):
+    """Yield (instance_id, action, state) for every live instance tagged for scheduling, in one paginated scan."""
+    paginator = ec2.get_paginator('describe_instances')
+    pages = paginator.paginate(
         Filters=[
-            {'Name': 'tag:Action', 'Values': ['Auto-Start']},
-            {'Name': 'tag:USER', 'Values': ['Sagar']},
-            {'Name': 'instance-state-name', 'Values': ['stopped']}
+            {'Name': 'tag:Action', 'Values': SCHEDULE_ACTIONS},
+            {'Name': 'tag:USER', 'Values': [USER_TAG]},
+            {'Name': 'instance-state-name', 'Values': LIVE_STATES}
         ]
     )
+    for page in pages:
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                tags = {t['Key']: t['Value'] for t in instance.get('Tags', [])}
+                yield instance['InstanceId'], tags['Action'], instance['State']['Name']
 
-    instances_to_start = [
-        instance['InstanceId']
-        for reservation in start_response['Reservations']
-        for instance in reservation['Instances']
-    ]
+def split_actions(instances):
+    """
+    Split (instance_id, action, state) triples into (instances_to_stop, instances_to_start).
+    An unknown state (None) is acted on, since stopping a stopped instance is a no-op.
+    """
+    instances_to_stop = []
+    instances_to_start = []
+    for instance_id, action, state in instances:
+        if action == 'Auto-Stop' and state in ('running', None):
+            instances_to_stop.append(instance_id)
+        elif action == 'Auto-Start' and state in ('stopped', None):
+            instances_to_start.append(instance_id)
+    return instances_to_stop, instances_to_start
+
+def find_instances(ec2):
+    """Split the region's tagged instances into (instances_to_stop, instances_to_start)."""
+    return split_actions(describe_schedulable(ec2))
+
+def change_state(region, action, call, instance_ids):
+    """Send instance IDs to start/stop in chunks of CHUNK_SIZE; returns (changed_ids, failures)."""
+    changed = []
+    failures = []
+    for i in range(0, len(instance_ids), CHUNK_SIZE):
+        chunk = instance_ids[i:i + CHUNK_SIZE]
+        try:
+            try:
+                call(InstanceIds=chunk)
+            except ClientError as e:
+                # One stale ID fails the whole call; drop the IDs named in the error and retry the rest
+                missing = set(re.findall(r'i-[0-9a-f]+', e.response['Error'].get('Message', '')))
+                if e.response['Error']['Code'] != 'InvalidInstanceID.NotFound' or not missing:
+                    raise
+                failures.append({'region': region, 'action': action, 'instance_ids': sorted(missing), 'error': str(e)})
+                chunk = [instance_id for instance_id in chunk if instance_id not in missing]
+                if chunk:
+                    call(InstanceIds=chunk)
+            changed.extend(chunk)
+        except ClientError as e:
+            print(f"[{region}] Failed to {action} {chunk}: {e}")
+            failures.append({'region': region, 'action': action, 'instance_ids': chunk, 'error': str(e)})
+    return changed, failures
+
+def process_region(region, planned=None):
+    """Apply the schedule in one region; planned is (to_stop, to_start) from the index, or None to scan."""
+    ec2 = client('ec2', region_name=region)
+    instances_to_stop, instances_to_start = planned or find_instances(ec2)
 
     # Stop instances
     if instances_to_stop:
-        print(f"Stopping: {instances_to_stop}")
-        ec2.stop_instances(InstanceIds=instances_to_stop)
+        print(f"[{region}] Stopping: {instances_to_stop}")
     else:
-        print("No instances to stop.")
+        print(f"[{region}] No instances to stop.")
+    stopped, stop_failures = change_state(region, 'stop', ec2.stop_instances, instances_to_stop)
 
     # Start instances
     if instances_to_start:
-        print(f"Starting: {instances_to_start}")
-        ec2.start_instances(InstanceIds=instances_to_start)
+        print(f"[{region}] Starting: {instances_to_start}")
     else:
-        print("No instances to start.")
+        print(f"[{region}] No instances to start.")
+    started, start_failures = change_state(region, 'start', ec2.start_instances, instances_to_start)
+
+    return stopped, started, stop_failures + start_failures
+
+def apply_state_change(index, event):
+    """EC2 Instance State-change Notification: record the new state, forget terminated instances."""
+    instance_id = event['detail']['instance-id']
+    state = event['detail']['state']
+    item = index.get(instance_id)
+    if item is None:
+        return  # Not schedulable; tag changes add instances to the index
+    if state in ('shutting-down', 'terminated'):
+        index.delete(instance_id)
+    else:
+        item['State'] = state
+        index.put(item)
+
+def apply_tag_change(index, event):
+    """Tag Change on Resource: add, update or drop an instance depending on its Action and USER tags."""
+    if event['detail'].get('resource-type') != 'instance':
+        return
+    tags = event['detail'].get('tags', {})
+    for arn in event.get('resources', []):
+        instance_id = arn.rsplit('/', 1)[-1]
+        if tags.get('Action') in SCHEDULE_ACTIONS and tags.get('USER') == USER_TAG:
+            item = index.get(instance_id) or {'InstanceId': instance_id, 'Region': event['region'], 'State': None}
+            item['Action'] = tags['Action']
+            index.put(item)
+        else:
+            index.delete(instance_id)
+
+def reconcile(index, regions):
+    """Rebuild the index from describe_instances in every region, repairing any missed events."""
+    def scan(region):
+        return region, list(describe_schedulable(client('ec2', region_name=region)))
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        scanned = dict(executor.map(scan, regions))
+
+    items = [
+        {'InstanceId': instance_id, 'Region': region, 'Action': action, 'State': state}
+        for region, instances in scanned.items()
+        for instance_id, action, state in instances
+    ]
+    live = {item['InstanceId'] for item in items}
+    removed = [item['InstanceId'] for item in index.items()
+               if item['Region'] in scanned and item['InstanceId'] not in live]
+    index.put_many(items)
+    index.delete_many(removed)
+    print(f"Reconciled index: {len(live)} instances, {len(removed)} stale entries removed")
+    return {'Reconciled': len(live), 'Removed': len(removed)}
+
+def plan_from_index(index):
+    """Group indexed instances by region into (to_stop, to_start), without calling describe_instances."""
+    by_region = {}
+    for item in index.items():
+        by_region.setdefault(item['Region'], []).append((item['InstanceId'], item['Action'], item.get('State')))
+    return {region: split_actions(instances) for region, instances in by_region.items()}
+
+@instrumented
+def lambda_handler(event, context):
+    index = open_index()
+    detail_type = event.get('detail-type')
+
+    # Index maintenance events from EventBridge
+    if index is not None and detail_type == 'EC2 Instance State-change Notification':
+        apply_state_change(index, event)
+        return {'Indexed': event['detail']['instance-id']}
+    if index is not None and detail_type == 'Tag Change on Resource':
+        apply_tag_change(index, event)
+        return {'Indexed': event.get('resources', [])}
+
+    if index is not None and event.get('mode') == 'reconcile':
+        return reconcile(index, REGIONS or enabled_regions(client('ec2')))
+
+    # Scheduled run: act on the index when there is one, otherwise scan the fleet
+    with phase('plan'):
+        if index is not None:
+            plans = plan_from_index(index)
+        else:
+            plans = {region: None for region in REGIONS or enabled_regions(client('ec2'))}
+
+    def scan(region):
+        try:
+            return region, process_region(region, plans[region])
+        except ClientError as e:
+            print(f"[{region}] Scan failed: {e}")
+            return region, ([], [], [{'region': region, 'action': 'describe', 'instance_ids': [], 'error': str(e)}])
+
+    stopped_instances = []
+    started_instances = []
+    failures = []
+    region_counts = {}
+
+    # Scan all regions concurrently
+    with phase('apply_schedule'), ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for region, (stopped, started, region_failures) in executor.map(scan, plans):
+            stopped_instances.extend(stopped)
+            started_instances.extend(started)
+            failures.extend(region_failures)
+            region_counts[region] = {'stopped': len(stopped), 'started': len(started), 'failed': len(region_failures)}
 
     # Print the results
     return {
-        'StoppedInstances': instances_to_stop,
-        'StartedInstances': instances_to_start
+        'StoppedInstances': stopped_instances,
+        'StartedInstances': started_instances,
+        'Regions': region_counts,
+        'Failures': failures
     }
@@ -1,57 +1,208 @@
-import boto3
+import json
+import math
 import os
+from botocore.exceptions import ClientError
 from datetime import datetime, timedelta, timezone
+from shared import Notifier, client, instrumented, phase
 
 # ENV VARS
-ELB_NAME = os.environ['ELB_NAME']           # e.g., 'app/my-app/0123456789abcdef'
+# Comma-separated load balancers to watch, e.g. 'app/my-app/0123456789abcdef'; empty watches every ALB
+ELB_NAME = os.environ.get('ELB_NAME', '')
 SNS_TOPIC_ARN = os.environ['SNS_TOPIC_ARN']
-THRESHOLD = int(os.environ.get('THRESHOLD', 10))
+THRESHOLD = int(os.environ.get('THRESHOLD', 10))              # 5xx count that alerts while a baseline is warming up
+WINDOW_MINUTES = int(os.environ.get('WINDOW_MINUTES', 5))
+INCLUDE_TARGET_GROUPS = os.environ.get('INCLUDE_TARGET_GROUPS', 'true').lower() == 'true'
+# Per-LB baselines of the 5xx error rate, kept between runs
+STATE_BUCKET = os.environ.get('STATE_BUCKET')
+STATE_KEY = os.environ.get('STATE_KEY', 'elb-5xx-monitor/baselines.json')
+BASELINE_ALPHA = float(os.environ.get('BASELINE_ALPHA', 0.05))  # Weight of the newest window in the rolling baseline
+WARMUP_SAMPLES = int(os.environ.get('WARMUP_SAMPLES', 12))
+SIGMA = float(os.environ.get('SIGMA', 4.0))                     # Alert when the rate exceeds mean + SIGMA * stddev
+MIN_ERRORS = int(os.environ.get('MIN_ERRORS', 5))               # Ignore anomalies with fewer errors than this
+MIN_RATE_PCT = float(os.environ.get('MIN_RATE_PCT', 1.0))       # ...or a lower error rate than this
 
-cloudwatch = boto3.client('cloudwatch')
-sns = boto3.client('sns')
+MAX_QUERIES = 500  # MetricDataQueries allowed per get_metric_data call
 
-def lambda_handler(event, context):
-    # Time window: last 5 minutes
-    end_time = datetime.now(timezone.utc)
-    start_time = end_time - timedelta(minutes=5)
+def discover_targets():
+    """
+    Every application load balancer (optionally limited to ELB_NAME) and, when enabled, every
+    target group attached to one. Returns a list of {'id', 'name', 'dimensions'} entries.
+    """
+    wanted = {name.strip() for name in ELB_NAME.split(',') if name.strip()}
+    load_balancers = {}
+    for page in client('elbv2').get_paginator('describe_load_balancers').paginate():
+        for lb in page['LoadBalancers']:
+            # CloudWatch names a load balancer by its ARN suffix, e.g. 'app/my-app/0123456789abcdef'
+            name = lb['LoadBalancerArn'].split(':loadbalancer/', 1)[1]
+            if lb.get('Type') == 'application' and (not wanted or name in wanted):
+                load_balancers[lb['LoadBalancerArn']] = name
+
+    targets = [
+        {'id': name, 'name': name, 'dimensions': [{'Name': 'LoadBalancer', 'Value': name}]}
+        for name in sorted(load_balancers.values())
+    ]
+    if INCLUDE_TARGET_GROUPS:
+        for page in client('elbv2').get_paginator('describe_target_groups').paginate():
+            for tg in page['TargetGroups']:
+                tg_name = 'targetgroup/' + tg['TargetGroupArn'].split(':targetgroup/', 1)[1]
+                for lb_arn in tg.get('LoadBalancerArns', []):
+                    if lb_arn in load_balancers:
+                        lb_name = load_balancers[lb_arn]
+                        targets.append({
+                            'id': f"{lb_name}|{tg_name}",
+                            'name': f"{tg_name} on {lb_name}",
+                            'dimensions': [
+                                {'Name': 'TargetGroup', 'Value': tg_name},
+                                {'Name': 'LoadBalancer', 'Value': lb_name}
+                            ]
+                        })
+    return targets
+
+def metric(query_id, name, dimensions, period):
+    return {
+        'Id': query_id,
+        'MetricStat': {
+            'Metric': {'Namespace': 'AWS/ApplicationELB', 'MetricName': name, 'Dimensions': dimensions},
+            'Period': period,
+            'Stat': 'Sum'
+        },
+        'ReturnData': False
+    }
 
-    # Query ELB 5XX count (ELB or ALB: adjust accordingly)
-    metric_dimensions = [
-        {'Name': 'LoadBalancer', 'Value': ELB_NAME}
+def target_queries(index, target, period):
+    """
+    Queries for one load balancer or target group: raw 5xx and request counts, and metric math
+    that returns the error count, request count and error rate (percent) for the window.
+    """
+    q = f"q{index}"
+    queries = [
+        metric(f"{q}t", 'HTTPCode_Target_5XX_Count', target['dimensions'], period),
+        metric(f"{q}r", 'RequestCount', target['dimensions'], period)
     ]
+    errors = f"FILL({q}t, 0)"
+    if len(target['dimensions']) == 1:
+        # 5xx responses generated by the load balancer itself are only reported per LB
+        queries.append(metric(f"{q}l", 'HTTPCode_ELB_5XX_Count', target['dimensions'], period))
+        errors += f" + FILL({q}l, 0)"
+    queries += [
+        {'Id': f"{q}e", 'Expression': errors, 'ReturnData': True},
+        {'Id': f"{q}n", 'Expression': f"FILL({q}r, 0)", 'ReturnData': True},
+        {'Id': f"{q}p", 'Expression': f"IF({q}n > 0, 100 * {q}e / {q}n, 0)", 'ReturnData': True}
+    ]
+    return queries
+
+def fetch_error_rates(targets, start_time, end_time):
+    """
+    Latest window's (errors, requests, rate %) per target id, with every target's queries packed
+    into as few get_metric_data calls as MAX_QUERIES allows.
+    """
+    period = WINDOW_MINUTES * 60
+    batches, batch = [], []
+    for index, target in enumerate(targets):
+        queries = target_queries(index, target, period)
+        if len(batch) + len(queries) > MAX_QUERIES:
+            batches.append(batch)
+            batch = []
+        batch += queries
+    if batch:
+        batches.append(batch)
+
+    values = {}
+    paginator = client('cloudwatch').get_paginator('get_metric_data')
+    for batch in batches:
+        for page in paginator.paginate(MetricDataQueries=batch, StartTime=start_time, EndTime=end_time,
+                                       ScanBy='TimestampDescending'):
+            for result in page['MetricDataResults']:
+                if result['Values'] and result['Id'] not in values:
+                    values[result['Id']] = result['Values'][0]
+
+    return {
+        target['id']: (
+            values.get(f"q{index}e", 0.0),
+            values.get(f"q{index}n", 0.0),
+            values.get(f"q{index}p", 0.0)
+        )
+        for index, target in enumerate(targets)
+    }
+
+def load_baselines():
+    """{target id: [mean rate, variance, samples]}; empty when no state is configured yet."""
+    if not STATE_BUCKET:
+        return {}
+    try:
+        return json.loads(client('s3').get_object(Bucket=STATE_BUCKET, Key=STATE_KEY)['Body'].read())
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return {}
+        raise
 
-    # For ALB: Use 'HTTPCode_Target_5XX_Count'
-    response = cloudwatch.get_metric_statistics(
-        Namespace='AWS/ApplicationELB',
-        MetricName='HTTPCode_Target_5XX_Count',
-        Dimensions=metric_dimensions,
-        StartTime=start_time,
-        EndTime=end_time,
-        Period=300,
-        Statistics=['Sum'],
-    )
+def save_baselines(baselines):
+    if STATE_BUCKET:
+        client('s3').put_object(Bucket=STATE_BUCKET, Key=STATE_KEY, Body=json.dumps(baselines, separators=(',', ':')).encode('utf-8'))
 
-    datapoints = response['Datapoints']
-    error_count = int(datapoints[0]['Sum']) if datapoints else 0
+def update_baseline(baseline, rate):
+    """Exponentially weighted mean and variance of the error rate."""
+    mean, variance, samples = baseline or (rate, 0.0, 0)
+    delta = rate - mean
+    mean += BASELINE_ALPHA * delta
+    variance = (1 - BASELINE_ALPHA) * (variance + BASELINE_ALPHA * delta * delta)
+    return [round(mean, 6), round(variance, 6), samples + 1]
 
-    print(f"[INFO] ELB 5xx errors in last 5 minutes: {error_count}")
+def is_anomaly(baseline, errors, rate):
+    """Compare the window to the target's own baseline; fall back to THRESHOLD until it has warmed up."""
+    if not baseline or baseline[2] < WARMUP_SAMPLES:
+        return errors > THRESHOLD, f"threshold {THRESHOLD} errors"
+    mean, variance, _ = baseline
+    limit = max(mean + SIGMA * math.sqrt(variance), MIN_RATE_PCT)
+    return errors >= MIN_ERRORS and rate > limit, f"baseline {mean:.2f}% (limit {limit:.2f}%)"
+
+@instrumented
+def lambda_handler(event, context):
+    # Time window: the last complete WINDOW_MINUTES
+    end_time = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    start_time = end_time - timedelta(minutes=WINDOW_MINUTES)
 
-    if error_count > THRESHOLD:
+    with phase('discover'):
+        targets = discover_targets()
+    if not targets:
+        print("[INFO] No application load balancers found.")
+        return {"statusCode": 200, "body": "No load balancers to check."}
+
+    with phase('fetch_metrics'):
+        rates = fetch_error_rates(targets, start_time, end_time)
+    baselines = load_baselines()
+    known = {target['id'] for target in targets}
+    baselines = {target_id: b for target_id, b in baselines.items() if target_id in known}
+
+    alerts = []
+    for target in targets:
+        errors, requests, rate = rates[target['id']]
+        baseline = baselines.get(target['id'])
+        anomaly, reason = is_anomaly(baseline, errors, rate)
+        print(f"[INFO] {target['name']}: {int(errors)} 5xx of {int(requests)} requests ({rate:.2f}%)")
+        if anomaly:
+            alerts.append(f"{target['name']}: {int(errors)} 5xx errors of {int(requests)} requests ({rate:.2f}%), {reason}")
+        elif requests > 0:
+            # Anomalous windows are left out so an incident does not raise its own baseline
+            baselines[target['id']] = update_baseline(baseline, rate)
+    save_baselines(baselines)
+
+    if alerts:
         message = (
-            f"ALERT: {error_count} 5xx errors detected on ELB '{ELB_NAME}' in the last 5 minutes.\n"
-            f"Threshold: {THRESHOLD}\n"
+            f"ALERT: 5xx error spikes detected on {len(alerts)} load balancer(s)/target group(s) "
+            f"in the last {WINDOW_MINUTES} minutes.\n\n" + "\n".join(alerts) + "\n\n"
             f"Time window: {start_time.strftime('%Y-%m-%d %H:%M:%S')} to {end_time.strftime('%Y-%m-%d %H:%M:%S')} UTC"
         )
-        sns.publish(
-            TopicArn=SNS_TOPIC_ARN,
-            Subject="ALERT: ELB 5xx Errors Spiked",
-            Message=message,
-        )
+        notifier = Notifier(SNS_TOPIC_ARN)
+        notifier.add("ALERT: ELB 5xx Errors Spiked", message)
+        if notifier.flush():
+            raise RuntimeError("The 5xx alert could not be published")
         print("[INFO] SNS notification sent.")
     else:
         print("[INFO] No alert triggered.")
 
     return {
         "statusCode": 200,
-        "body": f"Checked {ELB_NAME}: {error_count} 5xx errors in last 5 min."
-    }
\ No newline at end of file
+        "body": f"Checked {len(targets)} load balancers/target groups: {len(alerts)} alert(s) in last {WINDOW_MINUTES} min.",
+        "alerts": alerts
+    }
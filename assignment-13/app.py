@@ -1,35 +1,166 @@
 #https://chatgpt.com/c/684b8f16-73a0-8003-88bb-c81fa7419288
-import boto3
 import os
 import json
-import botocore
+import botocore.exceptions
+import fnmatch
+import functools
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from shared import Notifier, client, instrumented
 
 SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 16))
+# Verdicts from earlier runs, so change events only re-audit the buckets they touched
+STATE_BUCKET = os.environ.get('STATE_BUCKET')
+STATE_KEY = os.environ.get('STATE_KEY', 'public-bucket-audit/state.json')
+POLICY_CACHE_SIZE = int(os.environ.get('POLICY_CACHE_SIZE', 10000))
 
-def is_public_policy(policy):
-    """Detect if a policy allows public access."""
-    if not policy:
-        return False
-    for stmt in policy.get('Statement', []):
-        effect = stmt.get('Effect', '')
-        principal = stmt.get('Principal')
-        if effect == 'Allow' and (principal == "*" or principal == {"AWS": "*"}) and \
-           any(perm in stmt.get('Action', []) for perm in ["s3:GetObject", "s3:PutObject", "s3:*"]):
+# CloudTrail events (delivered through EventBridge) that can change whether a bucket is public
+AUDITED_EVENTS = {
+    'CreateBucket', 'PutBucketAcl', 'PutBucketPolicy', 'DeleteBucketPolicy',
+    'PutBucketPublicAccessBlock', 'DeleteBucketPublicAccessBlock', 'DeletePublicAccessBlock'
+}
+
+# Actions that expose data or control of the bucket when granted to everyone
+SENSITIVE_ACTIONS = [
+    's3:GetObject', 's3:GetObjectVersion', 's3:PutObject', 's3:DeleteObject',
+    's3:ListBucket', 's3:PutBucketAcl', 's3:PutBucketPolicy'
+]
+# Condition keys that pin a statement to a network, organization or account, so it is not public
+RESTRICTING_CONDITION_KEYS = {
+    'aws:sourcevpc', 'aws:sourcevpce', 'aws:principalorgid', 'aws:principalorgpaths',
+    'aws:principalaccount', 'aws:sourceaccount', 'aws:sourceowner', 'aws:sourcearn',
+    'aws:principalarn', 'aws:sourceip', 'aws:userid', 'aws:username'
+}
+RESTRICTING_OPERATORS = {
+    'stringequals', 'stringequalsignorecase', 'stringlike', 'arnequals', 'arnlike', 'ipaddress'
+}
+
+def as_list(value):
+    return value if isinstance(value, list) else [value]
+
+def compile_actions(patterns):
+    """Turn IAM action globs such as 's3:Get*' into one case-insensitive regex."""
+    return _compile_action_patterns(tuple(as_list(patterns)))
+
+@functools.lru_cache(maxsize=1024)
+def _compile_action_patterns(patterns):
+    # Cached: the same few Action lists recur across an account's policies, and translating
+    # globs costs more than the rest of a compilation
+    if not patterns:
+        return re.compile(r'(?!)')  # An empty Action list grants nothing; the empty pattern would match everything
+    return re.compile('|'.join(fnmatch.translate(p) for p in patterns), re.IGNORECASE)
+
+def is_everyone(principal):
+    if principal == '*':
+        return True
+    if isinstance(principal, dict):
+        return any('*' in as_list(v) for v in principal.values())
+    return False
+
+def is_restricting(condition):
+    """True if the Condition block limits the statement to a VPC, organization, account or IP range."""
+    for operator, clauses in (condition or {}).items():
+        operator = operator.lower().split(':')[-1]  # Drop ForAnyValue:/ForAllValues:
+        if operator not in RESTRICTING_OPERATORS:
+            continue  # Negated and ...IfExists operators still match requests without the key
+        for key, values in clauses.items():
+            if key.lower() not in RESTRICTING_CONDITION_KEYS:
+                continue
+            if operator == 'ipaddress' and set(as_list(values)) & {'0.0.0.0/0', '::/0'}:
+                continue
             return True
     return False
 
-def lambda_handler(event, context):
-    s3 = boto3.client('s3')
-    sns = boto3.client('sns')
-    public_buckets = []
+class CompiledStatement:
+    """A policy statement reduced to what matters for a public-access verdict."""
+
+    def __init__(self, stmt):
+        self.allow = stmt.get('Effect') == 'Allow'
+        # Allow + NotPrincipal grants everyone except the listed principals
+        self.everyone = is_everyone(stmt['Principal']) if 'Principal' in stmt else 'NotPrincipal' in stmt
+        self.negated = 'NotAction' in stmt
+        self.actions = compile_actions(stmt.get('NotAction' if self.negated else 'Action', []))
+        self.unconditional = not stmt.get('Condition')
+        self.restricted = is_restricting(stmt.get('Condition'))
+
+    def matches(self, action):
+        return bool(self.actions.match(action)) != self.negated
+
+class CompiledPolicy:
+    """A bucket policy compiled once; answers which actions it grants to anonymous principals."""
+
+    def __init__(self, policy):
+        statements = [CompiledStatement(s) for s in as_list(policy.get('Statement', []))]
+        self.grants = [s for s in statements if s.allow and s.everyone and not s.restricted]
+        self.denies = [s for s in statements if not s.allow and s.everyone and s.unconditional]
+        # Most policies grant nothing to everyone; skip matching every sensitive action for those
+        self.public_actions = [a for a in SENSITIVE_ACTIONS if self.allows_public(a)] if self.grants else []
+
+    def allows_public(self, action):
+        return any(s.matches(action) for s in self.grants) and not any(s.matches(action) for s in self.denies)
+
+_compiled_policies = OrderedDict()  # Digest of the policy text, bucket ARNs masked -> CompiledPolicy
+_compiled_policies_lock = threading.Lock()
+policy_cache_stats = {'hits': 0, 'misses': 0}
+
+def policy_cache_key(policy_str, bucket_name=None):
+    """
+    Digest of the policy text with the bucket's own ARNs masked, so buckets created from one
+    template (same statements, Resource naming each bucket) share a key without parsing the
+    JSON. S3 ARNs only appear as values that never change the verdict. NUL cannot occur in
+    JSON text, so the mask cannot collide with policy content.
+    """
+    if bucket_name:
+        policy_str = policy_str.replace(f'arn:aws:s3:::{bucket_name}', '\0')
+    return hashlib.blake2b(policy_str.encode('utf-8'), digest_size=16).digest()
+
+def compile_policy(policy_str, bucket_name=None):
+    """
+    Return the CompiledPolicy for a bucket policy as get_bucket_policy returns it. A cache hit
+    costs one string replace, one hash and a dict lookup; only a miss parses the JSON.
+    """
+    key = policy_cache_key(policy_str, bucket_name)
+    with _compiled_policies_lock:
+        compiled = _compiled_policies.get(key)
+        if compiled is not None:
+            _compiled_policies.move_to_end(key)
+            policy_cache_stats['hits'] += 1
+            return compiled
+
+    compiled = CompiledPolicy(json.loads(policy_str))
+    with _compiled_policies_lock:
+        policy_cache_stats['misses'] += 1
+        _compiled_policies[key] = compiled
+        if len(_compiled_policies) > POLICY_CACHE_SIZE:
+            _compiled_policies.popitem(last=False)
+    return compiled
 
-    # List all buckets
-    # buckets = s3.list_buckets().get('Buckets', [])
-    buckets = [{'Name': "sagar-s3-public-bucket"}]  # Example buckets for testing
-    for bucket in buckets:
-        bucket_name = bucket['Name']
+def is_public_policy(policy_str, bucket_name=None):
+    """Detect if a policy (the JSON text of a bucket policy) allows public access."""
+    if not policy_str:
+        return False
+    return bool(compile_policy(policy_str, bucket_name).public_actions)
+
+def get_public_access_block(s3, bucket_name):
+    """Return the bucket's public access block flags; a missing configuration blocks nothing."""
+    try:
+        return s3.get_public_access_block(Bucket=bucket_name)['PublicAccessBlockConfiguration']
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchPublicAccessBlockConfiguration':
+            return {}
+        raise
+
+def audit_bucket(s3, bucket_name):
+    """Return the list of public-access findings for one bucket (empty when it is private)."""
+    findings = []
+    block = get_public_access_block(s3, bucket_name)
 
-        # 1. Check bucket ACL
+    # 1. Check bucket ACL (public grants are ignored when IgnorePublicAcls is on)
+    if not block.get('IgnorePublicAcls'):
         acl = s3.get_bucket_acl(Bucket=bucket_name)
         for grant in acl.get('Grants', []):
             grantee = grant.get('Grantee', {})
@@ -39,25 +170,103 @@ def lambda_handler(event, context):
                 if 'AllUsers' in uri or 'AuthenticatedUsers' in uri:
                     permission = grant.get('Permission', '')
                     if permission in ['READ', 'WRITE', 'FULL_CONTROL']:
-                        public_buckets.append(f"{bucket_name} (ACL: {permission})")
+                        findings.append(f"{bucket_name} (ACL: {permission})")
 
-        # 2. Check bucket policy
+    # 2. Check bucket policy (a public policy has no effect when RestrictPublicBuckets is on)
+    if not block.get('RestrictPublicBuckets'):
         try:
             policy_str = s3.get_bucket_policy(Bucket=bucket_name)['Policy']
-            policy = json.loads(policy_str)
-            if is_public_policy(policy):
-                public_buckets.append(f"{bucket_name} (Policy: Public Access)")
+            if is_public_policy(policy_str, bucket_name):
+                findings.append(f"{bucket_name} (Policy: Public Access)")
         except botocore.exceptions.ClientError as e:
             pass
 
+    return findings
+
+def load_state(s3):
+    if not STATE_BUCKET:
+        return {}
+    try:
+        return json.loads(s3.get_object(Bucket=STATE_BUCKET, Key=STATE_KEY)['Body'].read())
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return {}
+        raise
+
+def save_state(s3, verdicts):
+    if STATE_BUCKET:
+        s3.put_object(Bucket=STATE_BUCKET, Key=STATE_KEY, Body=json.dumps(verdicts).encode('utf-8'))
+
+def changed_buckets(event):
+    """
+    Return (buckets to re-audit, buckets deleted) from an EventBridge CloudTrail event,
+    or an SQS batch of them. Returns None for scheduled runs, which audit the whole account.
+    """
+    if 'Records' in event:
+        events = [json.loads(record['body']) for record in event['Records']]
+    elif 'detail' in event and 'eventName' in event.get('detail', {}):
+        events = [event]
+    else:
+        return None
+
+    touched, deleted = set(), set()
+    for e in events:
+        detail = e['detail']
+        bucket_name = (detail.get('requestParameters') or {}).get('bucketName')
+        if not bucket_name or detail.get('errorCode'):
+            continue
+        if detail['eventName'] == 'DeleteBucket':
+            deleted.add(bucket_name)
+            touched.discard(bucket_name)
+        elif detail['eventName'] in AUDITED_EVENTS:
+            touched.add(bucket_name)
+            deleted.discard(bucket_name)
+    return touched, deleted
+
+@instrumented
+def lambda_handler(event, context):
+    s3 = client('s3', max_pool_connections=MAX_WORKERS)
+
+    verdicts = load_state(s3)
+    changes = changed_buckets(event)
+    if changes is None:
+        # Full audit: every bucket in the account
+        bucket_names = [b['Name'] for b in s3.list_buckets().get('Buckets', [])]
+        verdicts = {}
+    else:
+        bucket_names, deleted = changes
+        for bucket_name in deleted:
+            verdicts.pop(bucket_name, None)
+        print(f"Re-auditing {len(bucket_names)} bucket(s) touched by change events")
+
+    def audit(bucket_name):
+        try:
+            return bucket_name, audit_bucket(s3, bucket_name)
+        except botocore.exceptions.ClientError as e:
+            print(f"Error auditing {bucket_name}: {e}")
+            return bucket_name, None
+
+    public_buckets = []
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for bucket_name, findings in executor.map(audit, sorted(bucket_names)):
+            if findings is None:
+                continue
+            verdicts[bucket_name] = findings
+            public_buckets.extend(findings)
+
+    save_state(s3, verdicts)
+
     # Notify if public buckets found
     if public_buckets:
         message = "Public S3 Buckets detected:\n" + "\n".join(public_buckets)
-        sns.publish(
-            TopicArn=SNS_TOPIC_ARN,
-            Subject="Alert: Public S3 Bucket Detected",
-            Message=message
-        )
+        notifier = Notifier(SNS_TOPIC_ARN)
+        notifier.add("Alert: Public S3 Bucket Detected", message)
+        if notifier.flush():
+            raise RuntimeError("The public bucket alert could not be published")
     else:
         print("No public buckets detected.")
-    return {"public_buckets": public_buckets}
+    return {
+        "public_buckets": public_buckets,
+        "audited_buckets": len(bucket_names),
+        "known_public_buckets": sorted(name for name, findings in verdicts.items() if findings)
+    }
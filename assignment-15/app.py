@@ -1,30 +1,136 @@
-import boto3
+from botocore.exceptions import ClientError
 from datetime import datetime, timezone, timedelta
+import json
 import os
+from shared import ResultSink, client, instrumented, list_and_mutate
 
 # You can use environment variables for these
 BUCKET_NAME = os.environ.get('BUCKET_NAME','sagar-s3-logs-bucket')
-LOG_PREFIX = os.environ.get('LOG_PREFIX', 'logs/') 
+LOG_PREFIX = os.environ.get('LOG_PREFIX', 'logs/')
 DAYS_THRESHOLD = int(os.environ.get('DAYS_THRESHOLD', 90))
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 8))  # deletes in flight while listing continues
 
+# Checkpoint settings: where progress is stored and how much time to leave before the deadline
+STATE_BUCKET = os.environ.get('STATE_BUCKET', BUCKET_NAME)
+STATE_KEY = os.environ.get('STATE_KEY', '.log-cleaner/state.json')
+SAFETY_MARGIN_MS = int(os.environ.get('SAFETY_MARGIN_MS', 60000))
+REINVOKE = os.environ.get('REINVOKE', 'true').lower() == 'true'
+MAX_CHAINED_RUNS = int(os.environ.get('MAX_CHAINED_RUNS', 20))
+# Each run streams the keys it deleted to a gzipped NDJSON report instead of logging every key
+REPORT_BUCKET = os.environ.get('REPORT_BUCKET', STATE_BUCKET)
+REPORT_PREFIX = os.environ.get('REPORT_PREFIX', '.log-cleaner/reports/')
+
+def load_state(s3):
+    """Return the saved checkpoint, or None when the previous run finished."""
+    try:
+        body = s3.get_object(Bucket=STATE_BUCKET, Key=STATE_KEY)['Body'].read()
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+    return json.loads(body)
+
+def save_state(s3, state):
+    s3.put_object(
+        Bucket=STATE_BUCKET,
+        Key=STATE_KEY,
+        Body=json.dumps(state).encode('utf-8'),
+        ContentType='application/json'
+    )
+
+def clear_state(s3):
+    s3.delete_object(Bucket=STATE_BUCKET, Key=STATE_KEY)
+
+def out_of_time(context):
+    """True when fewer than SAFETY_MARGIN_MS remain in this invocation."""
+    return context is not None and context.get_remaining_time_in_millis() < SAFETY_MARGIN_MS
+
+async def delete_log(s3, objects):
+    """Delete one expired log object; the pipeline runs MAX_WORKERS of these at once."""
+    await s3.delete_object(Bucket=BUCKET_NAME, Key=objects[0]['Key'])
+
+@instrumented
 def lambda_handler(event, context):
-    s3 = boto3.client('s3')
-    now = datetime.now(timezone.utc)
-    cutoff = now - timedelta(days=DAYS_THRESHOLD)
-    deleted_files = []
-
-    paginator = s3.get_paginator('list_objects_v2')
-    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=LOG_PREFIX):
-        for obj in page.get('Contents', []):
-            key = obj['Key']
-            last_modified = obj['LastModified']
-
-            if last_modified < cutoff:
-                s3.delete_object(Bucket=BUCKET_NAME, Key=key)
-                deleted_files.append(key)
-                print(f"Deleted {key} last modified at {last_modified}")
-                
+    s3 = client('s3')
+    state = load_state(s3)
+
+    if state:
+        print(f"Resuming from checkpoint: {state['deleted_count']} deleted, {state['scanned_count']} scanned so far")
+        state['runs'] += 1
+        if 'continuation_token' in state:
+            # Checkpoints from before the pipeline hold a list_objects_v2 continuation token, which
+            # cannot be turned into a key: list the prefix again (the logs already deleted are gone)
+            del state['continuation_token']
+            state['start_after'] = None
+    else:
+        # The cutoff is fixed when a cleanup starts so every chained run applies the same rule
+        cutoff = datetime.now(timezone.utc) - timedelta(days=DAYS_THRESHOLD)
+        state = {
+            'cutoff': cutoff.isoformat(),
+            'start_after': None,
+            'deleted_count': 0,
+            'scanned_count': 0,
+            'runs': 1
+        }
+    cutoff = datetime.fromisoformat(state['cutoff'])
+
+    report = ResultSink(REPORT_BUCKET, REPORT_PREFIX)
+
+    def deleted(objects, result):
+        state['deleted_count'] += 1
+        report.add('deleted', objects[0]['Key'], last_modified=objects[0]['LastModified'].isoformat())
+
+    # Listing stops between pages once time runs short; queued deletes finish before it returns
+    try:
+        totals = list_and_mutate(
+            BUCKET_NAME,
+            delete_log,
+            select=lambda obj: obj['LastModified'] < cutoff,
+            prefix=LOG_PREFIX,
+            start_after=state.get('start_after'),
+            workers=MAX_WORKERS,
+            should_stop=lambda: out_of_time(context),
+            on_result=deleted
+        )
+    except Exception:
+        report.abort()
+        raise
+    summary = report.close()
+    if summary['report']:
+        print(f"Run {state['runs']} deleted {report.counts['deleted']} log files, listed in {summary['report']}")
+
+    state['scanned_count'] += totals['scanned']
+    state['start_after'] = totals['start_after']
+    if state['start_after']:
+        return checkpoint(s3, state, context, summary)
+
+    if state['runs'] > 1:
+        clear_state(s3)
+
     return {
         'statusCode': 200,
-        'body': f"Deleted {len(deleted_files)} log files."
-    }
\ No newline at end of file
+        'body': f"Deleted {state['deleted_count']} log files.",
+        **summary
+    }
+
+def checkpoint(s3, state, context, summary):
+    """Save progress and either chain into a new invocation or exit for the next scheduled run."""
+    save_state(s3, state)
+    print(f"Checkpoint saved to s3://{STATE_BUCKET}/{STATE_KEY} after run {state['runs']}")
+
+    reinvoked = False
+    if REINVOKE and state['runs'] < MAX_CHAINED_RUNS:
+        client('lambda').invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType='Event',
+            Payload=json.dumps({'resume': True}).encode('utf-8')
+        )
+        reinvoked = True
+        print("Re-invoked to continue cleanup.")
+
+    return {
+        'statusCode': 202,
+        'body': f"Deleted {state['deleted_count']} log files so far; "
+                f"{'continuing in a new invocation' if reinvoked else 'will resume on the next run'}.",
+        **summary
+    }
@@ -1,5 +1,9 @@
-import boto3
+import json
 import os
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from shared import client, instrumented
 
 # CONFIGURATION
 INSTANCE_TYPE = os.environ.get('INSTANCE_TYPE','t2.micro')
@@ -9,47 +13,56 @@ SECURITY_GROUP_IDS = SECURITY_GROUP_IDS_VALUE.split(',') if SECURITY_GROUP_IDS_V
 SUBNET_ID = os.environ.get('SUBNET_ID','subnet-xxxxxxxx')
 VOLUME_TAG_KEY = os.environ.get('VOLUME_TAG_KEY','Backup')
 VOLUME_TAG_VALUE = os.environ.get('VOLUME_TAG_VALUE','True')
-AVAILABILITY_ZONE = os.environ.get('AVAILABILITY_ZONE','ap-south-1a')
 IMAGE_ID = os.environ.get('IMAGE_ID', 'ami-0fc5d935ebf8bc3bc')  # Dummy AMI for networking
 
-ec2 = boto3.client('ec2')
+# 'latest' restores the newest snapshot; 'fleet' restores the newest snapshot of every source volume
+RESTORE_MODE = os.environ.get('RESTORE_MODE', 'latest')
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 10))
+# Fleet restores are tracked in a state record; each invocation checks progress once and a later
+# one checks again, so no invocation sits waiting for instances to boot
+STATE_BUCKET = os.environ.get('STATE_BUCKET')
+STATE_KEY = os.environ.get('STATE_KEY', 'snapshot-restore/state.json')
+# With a role EventBridge Scheduler can assume to invoke this function, every check that finds the
+# restore unfinished schedules the next one POLL_SECONDS later; without it, a recurring rule must
+# send {"mode": "fleet", "resume": true}
+SCHEDULER_ROLE_ARN = os.environ.get('SCHEDULER_ROLE_ARN')
+POLL_SECONDS = int(os.environ.get('POLL_SECONDS', 60))
+REINVOKE = os.environ.get('REINVOKE', 'true').lower() == 'true'
+MAX_CHAINED_RUNS = int(os.environ.get('MAX_CHAINED_RUNS', 20))
 
-def lambda_handler(event, context):
-    # Step 1: Find the latest snapshot with specific tags
-    snapshots = ec2.describe_snapshots(
+ROOT_DEVICE = '/dev/xvda'  # Device the snapshot is restored to
+DESCRIBE_CHUNK = 500  # IDs per describe_instances / describe_volumes call
+FAILED_STATES = {'shutting-down', 'terminated', 'stopping', 'stopped'}
+
+def find_snapshots():
+    """Completed snapshots carrying the backup tags, from one paginated describe_snapshots pass."""
+    paginator = client('ec2').get_paginator('describe_snapshots')
+    pages = paginator.paginate(
         Filters=[
             {'Name': 'tag:' + VOLUME_TAG_KEY, 'Values': [VOLUME_TAG_VALUE]},
-            {'Name': 'tag:USER', 'Values': ['Sagar']}
+            {'Name': 'tag:USER', 'Values': ['Sagar']},
+            {'Name': 'status', 'Values': ['completed']}
         ],
-        OwnerIds=['self']
-    )['Snapshots']
-    
-    if not snapshots:
-        raise Exception("No snapshots found with the given tag")
-
-    latest_snapshot = max(snapshots, key=lambda x: x['StartTime'])
-    print(f"Latest snapshot found: {latest_snapshot}")
-    # Step 2: Create a volume from the latest snapshot
-    volume_response = ec2.create_volume(
-        SnapshotId=latest_snapshot['SnapshotId'],
-        AvailabilityZone=AVAILABILITY_ZONE,
-        VolumeType='gp3',
-        TagSpecifications=[
-            {
-                'ResourceType': 'volume',
-                'Tags': [{'Key': 'RestoredFrom', 'Value': latest_snapshot['SnapshotId']}]
-            }
-        ]
+        OwnerIds=['self'],
+        PaginationConfig={'PageSize': 1000}
     )
-    volume_id = volume_response['VolumeId']
-    print(f"Created volume {volume_id} from snapshot")
+    return [snapshot for page in pages for snapshot in page['Snapshots']]
 
-    # Wait for volume to become available
-    waiter = ec2.get_waiter('volume_available')
-    waiter.wait(VolumeIds=[volume_id])
+def latest_per_volume(snapshots):
+    """The newest snapshot of every source volume."""
+    latest = {}
+    for snapshot in snapshots:
+        current = latest.get(snapshot['VolumeId'])
+        if current is None or snapshot['StartTime'] > current['StartTime']:
+            latest[snapshot['VolumeId']] = snapshot
+    return latest
 
-    # Step 3: Launch a new EC2 instance with this volume as the root
-    instance_response = ec2.run_instances(
+def launch_from_snapshot(snapshot, client_token=None, extra_tags=()):
+    """Launch an instance whose root volume is built from the snapshot; returns the instance ID."""
+    params = {}
+    if client_token:
+        params['ClientToken'] = client_token  # Makes a retried launch return the same instance
+    instance_response = client('ec2').run_instances(
         ImageId=IMAGE_ID,  # Use a dummy AMI for networking; will detach its root.
         InstanceType=INSTANCE_TYPE,
         KeyName=KEY_NAME,
@@ -65,29 +78,222 @@ def lambda_handler(event, context):
         ],
         BlockDeviceMappings=[
             {
-                'DeviceName': '/dev/xvda',
+                'DeviceName': ROOT_DEVICE,
                 'Ebs': {
-                    'VolumeSize': latest_snapshot['VolumeSize'],
+                    'VolumeSize': snapshot['VolumeSize'],
                     'VolumeType': 'gp3',
                     'DeleteOnTermination': True,
-                    'SnapshotId': latest_snapshot['SnapshotId']
+                    'SnapshotId': snapshot['SnapshotId']
                 }
             }
         ],
         TagSpecifications=[
             {
                 'ResourceType': 'instance',
-                'Tags': [{'Key': 'Name', 'Value': 'RestoredFromSnapshot'},{'Key': 'USER', 'Value': 'Sagar'}]
+                'Tags': [
+                    {'Key': 'Name', 'Value': 'RestoredFromSnapshot'},
+                    {'Key': 'USER', 'Value': 'Sagar'},
+                    {'Key': 'RestoredFrom', 'Value': snapshot['SnapshotId']},
+                    *({'Key': k, 'Value': v} for k, v in extra_tags)
+                ]
             }
-        ]
+        ],
+        **params
     )
+    return instance_response['Instances'][0]['InstanceId']
+
+def load_state():
+    try:
+        return json.loads(client('s3').get_object(Bucket=STATE_BUCKET, Key=STATE_KEY)['Body'].read())
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+
+def save_state(state):
+    client('s3').put_object(Bucket=STATE_BUCKET, Key=STATE_KEY, Body=json.dumps(state).encode('utf-8'),
+                            ContentType='application/json')
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+def seconds_since(iso):
+    return round((datetime.now(timezone.utc) - datetime.fromisoformat(iso)).total_seconds(), 1)
+
+def start_fleet_restore():
+    """Launch one instance per source volume, all at once, and return the new state record."""
+    latest = latest_per_volume(find_snapshots())
+    if not latest:
+        raise Exception("No snapshots found with the given tag")
+
+    run_id = datetime.now(timezone.utc).strftime('restore-%Y%m%dT%H%M%S')
+    state = {'run_id': run_id, 'started': now_iso(), 'runs': 1, 'complete': False, 'restores': {}}
+
+    def launch(snapshot):
+        restore = {
+            'source_volume': snapshot['VolumeId'],
+            'snapshot_time': snapshot['StartTime'].isoformat(),
+            'launched_at': now_iso(),
+            'status': 'launching'
+        }
+        try:
+            restore['instance_id'] = launch_from_snapshot(
+                snapshot,
+                client_token=f"{run_id}-{snapshot['SnapshotId']}",
+                extra_tags=[('RestoreRun', run_id), ('SourceVolume', snapshot['VolumeId'])]
+            )
+        except Exception as e:
+            restore.update(status='failed', error=str(e))
+        return snapshot['SnapshotId'], restore
+
+    print(f"Restoring {len(latest)} volume(s) from their latest snapshots")
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for snapshot_id, restore in executor.map(launch, latest.values()):
+            state['restores'][snapshot_id] = restore
+            if restore['status'] == 'failed':
+                print(f"Launch from {snapshot_id} failed: {restore['error']}")
+            else:
+                print(f"Launched {restore['instance_id']} from {snapshot_id}")
+    return state
+
+def poll(state):
+    """
+    Update every unfinished restore with one batched describe_instances and describe_volumes
+    pass. A restore is ready once its instance is running and the restored volume is attached.
+    """
+    waiting = {r['instance_id']: r for r in state['restores'].values() if r['status'] not in ('ready', 'failed')}
+    if not waiting:
+        return
+
+    root_volumes = {}
+    instance_ids = sorted(waiting)
+    paginator = client('ec2').get_paginator('describe_instances')
+    for i in range(0, len(instance_ids), DESCRIBE_CHUNK):
+        chunk = instance_ids[i:i + DESCRIBE_CHUNK]
+        # A filter tolerates instances that are not visible yet, where InstanceIds would fail the call
+        for page in paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': chunk}]):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    restore = waiting[instance['InstanceId']]
+                    state_name = instance['State']['Name']
+                    restore['status'] = state_name
+                    if state_name in FAILED_STATES:
+                        restore['status'] = 'failed'
+                        restore['error'] = instance.get('StateReason', {}).get('Message', state_name)
+                        continue
+                    for mapping in instance.get('BlockDeviceMappings', []):
+                        if mapping['DeviceName'] == ROOT_DEVICE and 'Ebs' in mapping:
+                            restore['volume_id'] = mapping['Ebs']['VolumeId']
+                            if state_name == 'running':
+                                root_volumes[mapping['Ebs']['VolumeId']] = restore
+
+    volume_ids = sorted(root_volumes)
+    for i in range(0, len(volume_ids), DESCRIBE_CHUNK):
+        chunk = volume_ids[i:i + DESCRIBE_CHUNK]
+        for page in client('ec2').get_paginator('describe_volumes').paginate(Filters=[{'Name': 'volume-id', 'Values': chunk}]):
+            for volume in page['Volumes']:
+                attached = any(a['State'] == 'attached' for a in volume.get('Attachments', []))
+                if volume['State'] == 'in-use' and attached:
+                    restore = root_volumes[volume['VolumeId']]
+                    restore['status'] = 'ready'
+                    restore['ready_at'] = now_iso()
+                    restore['seconds_to_ready'] = seconds_since(restore['launched_at'])
+
+def progress(state):
+    """Per-instance progress and timing for the response."""
+    restores = [
+        {
+            'snapshot_id': snapshot_id,
+            'source_volume': r['source_volume'],
+            'instance_id': r.get('instance_id'),
+            'volume_id': r.get('volume_id'),
+            'status': r['status'],
+            'seconds': r.get('seconds_to_ready', seconds_since(r['launched_at'])),
+            **({'error': r['error']} if 'error' in r else {})
+        }
+        for snapshot_id, r in sorted(state['restores'].items())
+    ]
+    counts = {}
+    for r in restores:
+        counts[r['status']] = counts.get(r['status'], 0) + 1
+    return {
+        'status': 'Success' if state['complete'] else 'InProgress',
+        'run_id': state['run_id'],
+        'elapsed_seconds': seconds_since(state['started']),
+        'counts': counts,
+        'restores': restores
+    }
+
+def schedule_next_check(state, context):
+    """One-time EventBridge Scheduler schedule that invokes this function again in POLL_SECONDS."""
+    at = datetime.now(timezone.utc) + timedelta(seconds=POLL_SECONDS)
+    try:
+        client('scheduler').create_schedule(
+            Name=f"{state['run_id']}-check-{state['runs']}",
+            ScheduleExpression=f"at({at:%Y-%m-%dT%H:%M:%S})",
+            ScheduleExpressionTimezone='UTC',
+            FlexibleTimeWindow={'Mode': 'OFF'},
+            Target={
+                'Arn': context.invoked_function_arn,
+                'RoleArn': SCHEDULER_ROLE_ARN,
+                'Input': json.dumps({'mode': 'fleet', 'resume': True})
+            },
+            ActionAfterCompletion='DELETE'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConflictException':
+            raise
+        # A retry of this invocation; its check is already scheduled
+
+def fleet_restore(event, context):
+    if not STATE_BUCKET:
+        # Without a state record every invocation (a retry, the next schedule) would launch another fleet
+        raise ValueError("Fleet restore needs STATE_BUCKET to track the restore between invocations")
+    state = load_state()
+    if state and not state['complete']:
+        state['runs'] += 1
+        print(f"Resuming restore {state['run_id']} (run {state['runs']})")
+    elif (event or {}).get('resume'):
+        # A progress check with nothing left to track; only an explicit request starts a fleet
+        print("No fleet restore in progress.")
+        return {'status': 'Idle'}
+    else:
+        state = start_fleet_restore()
+        save_state(state)
+
+    poll(state)
+    state['complete'] = all(r['status'] in ('ready', 'failed') for r in state['restores'].values())
+    save_state(state)
+    result = progress(state)
+    print(f"Restore {state['run_id']}: {result['counts']}")
+
+    if not state['complete'] and REINVOKE and SCHEDULER_ROLE_ARN and context is not None \
+            and state['runs'] < MAX_CHAINED_RUNS:
+        schedule_next_check(state, context)
+        print(f"Next progress check scheduled in {POLL_SECONDS} seconds.")
+    return result
+
+@instrumented
+def lambda_handler(event, context):
+    if (event or {}).get('mode', RESTORE_MODE) == 'fleet':
+        return fleet_restore(event, context)
+
+    # Step 1: Find the latest snapshot with specific tags
+    snapshots = find_snapshots()
+
+    if not snapshots:
+        raise Exception("No snapshots found with the given tag")
+
+    latest_snapshot = max(snapshots, key=lambda x: x['StartTime'])
+    print(f"Latest snapshot found: {latest_snapshot}")
 
-    instance_id = instance_response['Instances'][0]['InstanceId']
+    # Step 2: Launch a new EC2 instance with the snapshot as the root volume.
+    # run_instances builds the root disk from the SnapshotId, so no separate volume is created or waited on.
+    instance_id = launch_from_snapshot(latest_snapshot)
     print(f"Launched EC2 instance {instance_id} from snapshot")
 
     return {
         'status': 'Success',
         'instance_id': instance_id,
-        'snapshot_id': latest_snapshot['SnapshotId'],
-        'volume_id': volume_id
+        'snapshot_id': latest_snapshot['SnapshotId']
     }
@@ -1,45 +1,132 @@
-import boto3
+import json
 import os
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from shared import Notifier, client, instrumented
 
-TARGET_GROUP_ARN = os.environ.get("TARGET_GROUP_ARN")
+# Comma-separated target group ARNs to check; empty checks every target group in the region
+TARGET_GROUP_ARN = os.environ.get("TARGET_GROUP_ARN", "")
 SNS_TOPIC_ARN = os.environ.get("SNS_TOPIC_ARN")
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", 8))
+# Last known state of every target, so only changes are alerted on. Transition alerts are OFF
+# without it: every run alerts on every unhealthy target, and recoveries are never reported
+STATE_BUCKET = os.environ.get("STATE_BUCKET")
+STATE_KEY = os.environ.get("STATE_KEY", "target-health/state.json")
 
-elbv2 = boto3.client('elbv2')
-sns = boto3.client('sns')
+# States that raise an alert; 'initial', 'draining' and 'unused' are expected during deployments
+PROBLEM_STATES = {'unhealthy', 'unavailable'}
 
-def lambda_handler(event, context):
-    try:
-        response = elbv2.describe_target_health(TargetGroupArn=TARGET_GROUP_ARN)
-        target_health_descriptions = response['TargetHealthDescriptions']
-
-        unhealthy_targets = [
-            t for t in target_health_descriptions 
-            if t['TargetHealth']['State'] != 'healthy'
-        ]
-
-        if unhealthy_targets:
-            msg_lines = [
-                f"Unhealthy targets detected in Target Group:",
-                f"Target Group ARN: {TARGET_GROUP_ARN}",
-                ""
-            ]
-            for t in unhealthy_targets:
-                target = t['Target']
-                health = t['TargetHealth']
-                msg_lines.append(
-                    f"Target ID: {target['Id']}, Port: {target['Port']}, "
-                    f"State: {health['State']}, Reason: {health.get('Reason','')}, "
-                    f"Description: {health.get('Description','')}"
-                )
-            message = "\n".join(msg_lines)
-
-            sns.publish(
-                TopicArn=SNS_TOPIC_ARN,
-                Subject="ALERT: Unhealthy targets in ALB Target Group",
-                Message=message
-            )
-        else:
-            print("All targets are healthy.")
+def target_groups():
+    """ARNs from TARGET_GROUP_ARN, or every target group found by a paginated describe_target_groups."""
+    configured = [arn.strip() for arn in TARGET_GROUP_ARN.split(',') if arn.strip()]
+    if configured:
+        return configured
+    paginator = client('elbv2', max_pool_connections=MAX_WORKERS).get_paginator('describe_target_groups')
+    return [tg['TargetGroupArn'] for page in paginator.paginate() for tg in page['TargetGroups']]
 
+def check_target_group(arn):
+    """Return (arn, {'id:port': (state, reason, description)}, error)."""
+    try:
+        response = client('elbv2', max_pool_connections=MAX_WORKERS).describe_target_health(TargetGroupArn=arn)
     except Exception as e:
-        print(f"Error: {e}")
+        return arn, None, str(e)
+    targets = {
+        f"{t['Target']['Id']}:{t['Target'].get('Port', '')}": (
+            t['TargetHealth']['State'],
+            t['TargetHealth'].get('Reason', ''),
+            t['TargetHealth'].get('Description', '')
+        )
+        for t in response['TargetHealthDescriptions']
+    }
+    return arn, targets, None
+
+def load_state():
+    """{target group ARN: {'id:port': state}}; empty on the first run or without STATE_BUCKET."""
+    if not STATE_BUCKET:
+        return {}
+    try:
+        return json.loads(client('s3').get_object(Bucket=STATE_BUCKET, Key=STATE_KEY)['Body'].read())
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return {}
+        raise
+
+def save_state(state):
+    if STATE_BUCKET:
+        client('s3').put_object(Bucket=STATE_BUCKET, Key=STATE_KEY, Body=json.dumps(state, separators=(',', ':')).encode('utf-8'))
+
+def transitions(previous, current):
+    """
+    Targets that became a problem (from healthy, a transitional state, or unseen) and
+    targets that recovered to healthy from a problem state.
+    """
+    failed, recovered = [], []
+    for target, (state, reason, description) in sorted(current.items()):
+        before = previous.get(target)
+        if state in PROBLEM_STATES and before not in PROBLEM_STATES:
+            failed.append(f"Target: {target}, State: {state}, Reason: {reason}, Description: {description}")
+        elif state == 'healthy' and before in PROBLEM_STATES:
+            recovered.append(f"Target: {target}, State: healthy (was {before})")
+    return failed, recovered
+
+@instrumented
+def lambda_handler(event, context):
+    if not STATE_BUCKET:
+        print("STATE_BUCKET is not set: transition alerts are off, every unhealthy target is alerted on this run.")
+    arns = target_groups()
+    previous = load_state()
+    state = {}
+    errors = {}
+    failed_lines, recovered_lines = [], []
+    unhealthy = 0
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for arn, targets, error in executor.map(check_target_group, arns):
+            if error:
+                print(f"Error checking {arn}: {error}")
+                errors[arn] = error
+                if arn in previous:
+                    state[arn] = previous[arn]  # Keep the last known state until the group can be read again
+                continue
+            state[arn] = {target: health[0] for target, health in targets.items()}
+            unhealthy += sum(1 for health in targets.values() if health[0] in PROBLEM_STATES)
+            failed, recovered = transitions(previous.get(arn, {}), targets)
+            if failed:
+                failed_lines += [f"Target Group ARN: {arn}"] + failed + [""]
+            if recovered:
+                recovered_lines += [f"Target Group ARN: {arn}"] + recovered + [""]
+
+    if failed_lines or recovered_lines:
+        msg_lines = []
+        if failed_lines:
+            msg_lines += ["Unhealthy targets detected:", ""] + failed_lines
+            if not STATE_BUCKET:
+                msg_lines += ["(STATE_BUCKET is not set, so these targets are reported on every run until they recover.)"]
+        if recovered_lines:
+            msg_lines += ["Targets recovered:", ""] + recovered_lines
+        notifier = Notifier(SNS_TOPIC_ARN)
+        notifier.add(
+            "ALERT: Unhealthy targets in ALB Target Group" if failed_lines
+            else "RESOLVED: ALB Target Group targets healthy again",
+            "\n".join(msg_lines)
+        )
+        if notifier.flush():
+            raise RuntimeError("The target health alert could not be published")
+        print("SNS alert sent.")
+    elif unhealthy:
+        print(f"{unhealthy} target(s) still unhealthy; already alerted.")
+    else:
+        print("All targets are healthy.")
+
+    # Saved after publishing so a failed publish is retried on the next run
+    save_state(state)
+
+    if errors:
+        raise RuntimeError(f"Could not check {len(errors)} of {len(arns)} target group(s): {errors}")
+
+    return {
+        "target_groups": len(arns),
+        "unhealthy_targets": unhealthy,
+        "alerts_sent": bool(failed_lines or recovered_lines),
+        "transition_alerts": bool(STATE_BUCKET)
+    }
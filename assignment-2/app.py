@@ -1,40 +1,77 @@
-import boto3
 from datetime import datetime, timezone, timedelta
 import os
+from shared import ResultSink, instrumented, list_and_mutate
 
 BUCKET_NAME = os.environ.get('BUCKET_NAME', 'sagar-s3-cleanup-bucket')
 DAYS_TO_KEEP = int(os.environ.get('DAYS_TO_KEEP', 30))
+DELETE_BATCH_SIZE = min(int(os.environ.get('DELETE_BATCH_SIZE', 1000)), 1000)  # DeleteObjects accepts at most 1000 keys
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 8))
+# Deleted keys and per-key errors are streamed to a gzipped NDJSON report instead of the response.
+# Not written unless set: a report in BUCKET_NAME would be deleted by a later run, so use another bucket
+REPORT_BUCKET = os.environ.get('REPORT_BUCKET')
+REPORT_PREFIX = os.environ.get('REPORT_PREFIX', 'reports/s3-cleanup/')
 
-s3 = boto3.client('s3')
+async def delete_batch(s3, objects):
+    """
+        Delete up to 1000 listed objects with a single DeleteObjects call.
+        Returns (deleted_keys, errors) where errors use the same shape as the handler's error list.
+    """
+    keys = [obj['Key'] for obj in objects]
+    try:
+        response = await s3.delete_objects(
+            Bucket=BUCKET_NAME,
+            Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+        )
+    except Exception as e:
+        # The whole request failed, so every key in the batch is still there
+        return [], [{'key': key, 'error': str(e)} for key in keys]
 
+    # Quiet mode only reports the keys that could not be deleted
+    failed = {
+        err['Key']: f"{err.get('Code', 'Error')}: {err.get('Message', '')}"
+        for err in response.get('Errors', [])
+    }
+    deleted = [key for key in keys if key not in failed]
+    errors = [{'key': key, 'error': error} for key, error in failed.items()]
+    return deleted, errors
+
+@instrumented
 def lambda_handler(event, context):
     """
         Lambda function to delete files older than DAYS_TO_KEEP days from the S3 bucket.
+        Listing feeds expired keys into DeleteObjects batches that MAX_WORKERS consumers send
+        while the next pages are still being listed.
     """
     now = datetime.now(timezone.utc)
     cutoff = now - timedelta(days=DAYS_TO_KEEP)
-    deleted_files = []
-    errors = []
+    report = ResultSink(REPORT_BUCKET, REPORT_PREFIX)
+
+    def collect(objects, result):
+        deleted, failed = result
+        for key in deleted:
+            report.add('deleted', key)
+        for error in failed:
+            report.add('error', error['key'], error=error['error'])
 
-    paginator = s3.get_paginator('list_objects_v2')
+    try:
+        list_and_mutate(
+            BUCKET_NAME,
+            delete_batch,
+            select=lambda obj: obj['LastModified'] < cutoff,
+            batch_size=DELETE_BATCH_SIZE,
+            workers=MAX_WORKERS,
+            on_result=collect
+        )
+    except Exception:
+        report.abort()
+        raise
 
-    for page in paginator.paginate(Bucket=BUCKET_NAME):
-        for obj in page.get('Contents', []):
-            key = obj['Key']
-            last_modified = obj['LastModified']
-            if last_modified < cutoff:
-                try:
-                    # Attempt to delete the object
-                    s3.delete_object(Bucket=BUCKET_NAME, Key=key)
-                    deleted_files.append(key)
-                except Exception as e:
-                    # Collect error info for result/reporting
-                    errors.append({'key': key, 'error': str(e)})
+    error_count = report.counts.get('error', 0)
     return {
-        'statusCode': 200 if not errors else 207,
+        'statusCode': 200 if not error_count else 207,
         'body': {
-            'deleted_files': deleted_files,
-            'deleted_count': len(deleted_files),
-            'errors': errors
+            'deleted_count': report.counts.get('deleted', 0),
+            'error_count': error_count,
+            **report.close()
         }
-    }
\ No newline at end of file
+    }
@@ -1,13 +1,69 @@
-import boto3
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import time
+from shared import client, instrumented
 
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 16))
+CACHE_TTL_SECONDS = int(os.environ.get('CACHE_TTL_SECONDS', 24 * 3600))
+# Optional S3 object that keeps the cache between cold starts; without it the cache only lives in warm containers
+STATE_BUCKET = os.environ.get('STATE_BUCKET')
+STATE_KEY = os.environ.get('STATE_KEY', 'encryption-scan/cache.json')
+
+# bucket name -> {'region': ..., 'encrypted': bool, 'checked_at': epoch seconds}
+_cache = {}
+
+def region_client(region):
+    """One S3 client per region, so requests go straight to the bucket's endpoint without redirects."""
+    return client('s3', region_name=region, max_pool_connections=MAX_WORKERS)
+
+def load_cache(s3):
+    if not STATE_BUCKET:
+        return
+    try:
+        body = s3.get_object(Bucket=STATE_BUCKET, Key=STATE_KEY)['Body'].read()
+        _cache.update(json.loads(body))
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            print(f"⚠️  Could not load cache: {e}")
+
+def save_cache(s3):
+    if not STATE_BUCKET:
+        return
+    try:
+        s3.put_object(Bucket=STATE_BUCKET, Key=STATE_KEY, Body=json.dumps(_cache).encode('utf-8'))
+    except ClientError as e:
+        print(f"⚠️  Could not save cache: {e}")
+
+def bucket_region(s3, bucket):
+    """Resolve the bucket's region; get_bucket_location reports us-east-1 as None and eu-west-1 as 'EU'."""
+    location = s3.get_bucket_location(Bucket=bucket['Name']).get('LocationConstraint')
+    return {None: 'us-east-1', '': 'us-east-1', 'EU': 'eu-west-1'}.get(location, location)
+
+def check_bucket(bucket_name, region):
+    """Return (encrypted, error): True/False for encrypted/unencrypted, or None and the error if the check itself failed."""
+    try:
+        region_client(region).get_bucket_encryption(Bucket=bucket_name)
+        return True, None
+    except ClientError as e:
+        error_code = e.response['Error']['Code']
+        if error_code == 'ServerSideEncryptionConfigurationNotFoundError':
+            return False, None
+        print(f"⚠️  Error checking {bucket_name}: {e}")
+        return None, e
+
+@instrumented
 def lambda_handler(event, context):
     """
     AWS Lambda function to detect S3 buckets without default server-side encryption.
-    Returns a list of unencrypted bucket names.
+    Buckets are checked concurrently through region-pinned clients, and results are cached
+    for CACHE_TTL_SECONDS so scheduled runs only re-check new or expired buckets.
+    Returns the unencrypted bucket names, and under 'errors' the buckets that could not be
+    located or checked, so they are not mistaken for encrypted ones.
     """
-    s3 = boto3.client('s3')
-    unencrypted_buckets = []
+    s3 = region_client(os.environ.get('AWS_REGION', 'us-east-1'))
+    load_cache(s3)
 
     # List all buckets in the account
     try:
@@ -15,25 +71,59 @@ def lambda_handler(event, context):
         buckets_to_check = response.get('Buckets', [])
     except ClientError as e:
         print(f"❌ Error listing buckets: {e}")
-        return {"unencrypted_buckets": []}
-
-    for bucket in buckets_to_check:
-        bucket_name = bucket['Name']
-        try:
-            s3.get_bucket_encryption(Bucket=bucket_name)
-        except ClientError as e:
-            error_code = e.response['Error']['Code']
-            if error_code == 'ServerSideEncryptionConfigurationNotFoundError':
-                unencrypted_buckets.append(bucket_name)
+        return {"unencrypted_buckets": [], "errors": [{'bucket': None, 'operation': 'ListBuckets', 'error': str(e)}]}
+
+    now = time.time()
+    names = {b['Name'] for b in buckets_to_check}
+    for name in list(_cache):
+        if name not in names:
+            del _cache[name]  # Bucket was deleted
+
+    stale = [
+        b for b in buckets_to_check
+        if b['Name'] not in _cache or now - _cache[b['Name']]['checked_at'] > CACHE_TTL_SECONDS
+    ]
+    print(f"Checking {len(stale)} of {len(buckets_to_check)} buckets ({len(buckets_to_check) - len(stale)} cached)")
+    errors = []
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        # ListBuckets includes BucketRegion on current APIs; fall back to GetBucketLocation otherwise
+        def resolve(bucket):
+            known = bucket.get('BucketRegion') or _cache.get(bucket['Name'], {}).get('region')
+            try:
+                return known or bucket_region(s3, bucket), None
+            except ClientError as e:
+                print(f"⚠️  Error locating {bucket['Name']}: {e}")
+                return None, e
+
+        located = []
+        for bucket, (region, error) in zip(stale, executor.map(resolve, stale)):
+            if region:
+                located.append((bucket['Name'], region))
+            else:
+                errors.append({'bucket': bucket['Name'], 'operation': 'GetBucketLocation', 'error': str(error)})
+        results = executor.map(lambda item: check_bucket(*item), located)
+
+        for (name, region), (encrypted, error) in zip(located, results):
+            if encrypted is not None:
+                _cache[name] = {'region': region, 'encrypted': encrypted, 'checked_at': now}
             else:
-                print(f"⚠️  Error checking {bucket_name}: {e}")
+                errors.append({'bucket': name, 'operation': 'GetBucketEncryption', 'error': str(error)})
+
+    save_cache(s3)
+
+    unencrypted_buckets = sorted(
+        name for name in names if name in _cache and not _cache[name]['encrypted']
+    )
 
     if unencrypted_buckets:
         print("\n🔒 Unencrypted Buckets Detected:")
         for b in unencrypted_buckets:
             print(f"❌ {b}")
-    else:
+    elif not errors:
         print("\n✅ All buckets have server-side encryption enabled.")
+    if errors:
+        print(f"\n⚠️  {len(errors)} buckets could not be checked: {sorted(e['bucket'] for e in errors)}")
 
-        # Return for integration/automation
-        return {"unencrypted_buckets": unencrypted_buckets}
+    # Return for integration/automation
+    return {"unencrypted_buckets": unencrypted_buckets, "errors": errors}
@@ -1,68 +1,149 @@
-import boto3
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
+from shared import client, instrumented, phase
 
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 10))
+
+def env_list(name, default=''):
+    return [v.strip() for v in os.environ.get(name, default).split(',') if v.strip()]
+
+def find_volumes(ec2, tag_key, tag_value):
+    """Volume IDs carrying the given tag."""
+    paginator = ec2.get_paginator('describe_volumes')
+    pages = paginator.paginate(Filters=[{'Name': f'tag:{tag_key}', 'Values': [tag_value]}])
+    return [v['VolumeId'] for page in pages for v in page['Volumes']]
+
+def find_instances(ec2, tag_key, tag_value):
+    """Map of instance ID -> attached volume IDs for instances carrying the given tag."""
+    paginator = ec2.get_paginator('describe_instances')
+    pages = paginator.paginate(Filters=[
+        {'Name': f'tag:{tag_key}', 'Values': [tag_value]},
+        {'Name': 'instance-state-name', 'Values': ['pending', 'running', 'stopping', 'stopped']}
+    ])
+    return {
+        instance['InstanceId']: [
+            m['Ebs']['VolumeId'] for m in instance.get('BlockDeviceMappings', []) if 'Ebs' in m
+        ]
+        for page in pages
+        for reservation in page['Reservations']
+        for instance in reservation['Instances']
+    }
+
+def snapshot_instance(ec2, instance_id, timestamp):
+    """Crash-consistent snapshots of every volume on an instance in one create_snapshots call."""
+    response = ec2.create_snapshots(
+        InstanceSpecification={'InstanceId': instance_id, 'ExcludeBootVolume': False},
+        Description=f"Automated backup of {instance_id} @ {timestamp}",
+        CopyTagsFromSource='volume'
+    )
+    return [s['SnapshotId'] for s in response['Snapshots']]
+
+def snapshot_volume(ec2, volume_id, timestamp):
+    snap = ec2.create_snapshot(VolumeId=volume_id, Description=f"Automated backup of {volume_id} @ {timestamp}")
+    return [snap['SnapshotId']]
+
+@instrumented
 def lambda_handler(event, context):
-    ec2 = boto3.client('ec2')
-    
-    # Environment variables (required: EBS_VOLUME_ID, RETENTION_DAYS)
-    volume_id = os.environ.get('EBS_VOLUME_ID', "vol-012af92482dff76bd")
+    ec2 = client('ec2')
+
+    # Environment variables: choose volumes by ID, by volume tag, or by instance tag (RETENTION_DAYS applies to all)
+    volume_tag_key = os.environ.get('VOLUME_TAG_KEY')
+    volume_tag_value = os.environ.get('VOLUME_TAG_VALUE', 'True')
+    instance_tag_key = os.environ.get('INSTANCE_TAG_KEY')
+    instance_tag_value = os.environ.get('INSTANCE_TAG_VALUE', 'True')
+    default_volume = '' if volume_tag_key or instance_tag_key else "vol-012af92482dff76bd"
+    volume_ids = set(env_list('EBS_VOLUME_ID', default_volume))
     retention_days = int(os.environ.get('RETENTION_DAYS', '0'))  # Default 30 days
 
-    if not volume_id:
-        raise ValueError("Missing required environment variable: EBS_VOLUME_ID")
+    if volume_tag_key:
+        volume_ids.update(find_volumes(ec2, volume_tag_key, volume_tag_value))
+    instances = find_instances(ec2, instance_tag_key, instance_tag_value) if instance_tag_key else {}
+    # Volumes on selected instances are covered by the instance's multi-volume snapshot
+    for attached in instances.values():
+        volume_ids.difference_update(attached)
+    managed_volumes = volume_ids.union(*instances.values())
+
+    if not managed_volumes:
+        raise ValueError("No volumes selected: set EBS_VOLUME_ID, VOLUME_TAG_KEY or INSTANCE_TAG_KEY")
+
+    # 1. Create Snapshots
+    timestamp = datetime.now(timezone.utc).isoformat()
+    created_snaps = []
+    failed = []
+    unprotected = set()  # Volumes whose new snapshot failed keep their old ones
+
+    def create(target):
+        kind, resource_id = target
+        try:
+            if kind == 'instance':
+                return resource_id, snapshot_instance(ec2, resource_id, timestamp), None
+            return resource_id, snapshot_volume(ec2, resource_id, timestamp), None
+        except Exception as e:
+            return resource_id, [], str(e)
 
-    # 1. Create Snapshot
-    try:
-        desc = f"Automated backup of {volume_id} @ {datetime.now(timezone.utc).isoformat()}"
-        snap = ec2.create_snapshot(VolumeId=volume_id, Description=desc)
-        created_snap_id = snap['SnapshotId']
-        print(f"✅ Created snapshot: {created_snap_id}")
-    except Exception as e:
-        print(f"❌ Snapshot creation failed: {e}")
-        raise
+    targets = [('instance', i) for i in sorted(instances)] + [('volume', v) for v in sorted(volume_ids)]
+    with phase('create_snapshots'), ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for resource_id, snap_ids, error in executor.map(create, targets):
+            if error:
+                print(f"❌ Snapshot creation failed for {resource_id}: {error}")
+                failed.append({'resource': resource_id, 'error': error})
+                unprotected.update(instances.get(resource_id, [resource_id]))
+            else:
+                print(f"✅ Created snapshot(s) for {resource_id}: {snap_ids}")
+                created_snaps.extend(snap_ids)
 
     # 2. Delete Old Snapshots
     cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    with phase('list_snapshots'):
+        snaps_by_volume = get_completed_snapshots(ec2, managed_volumes - unprotected)
+    expired = [
+        snapshot['SnapshotId']
+        for snaps in snaps_by_volume.values()
+        for snapshot in snaps
+        if snapshot['StartTime'] < cutoff and snapshot['SnapshotId'] not in created_snaps
+    ]
+
+    def delete(snap_id):
+        try:
+            ec2.delete_snapshot(SnapshotId=snap_id)
+            return snap_id, None
+        except Exception as delete_err:
+            return snap_id, str(delete_err)
+
     deleted_snaps = []
-    try:
-        snaps = get_completed_snapshots(ec2, volume_id)
-
-        for snapshot in snaps:
-            snap_id = snapshot['SnapshotId']
-            start_time = snapshot['StartTime']
-            if start_time < cutoff:
-                try:
-                    ec2.delete_snapshot(SnapshotId=snap_id)
-                    deleted_snaps.append(snap_id)
-                    print(f"🗑️ Deleted old snapshot: {snap_id}")
-                except Exception as delete_err:
-                    print(f"❌ Failed to delete snapshot {snap_id}: {delete_err}")
-
-        if not deleted_snaps:
-            print("✅ No old snapshots to delete.")
-
-    except Exception as e:
-        print(f"❌ Snapshot cleanup failed: {e}")
-        raise
+    with phase('delete_snapshots'), ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for snap_id, error in executor.map(delete, expired):
+            if error:
+                print(f"❌ Failed to delete snapshot {snap_id}: {error}")
+                failed.append({'resource': snap_id, 'error': error})
+            else:
+                print(f"🗑️ Deleted old snapshot: {snap_id}")
+                deleted_snaps.append(snap_id)
+
+    if not deleted_snaps:
+        print("✅ No old snapshots to delete.")
 
     return {
-        "created_snapshot": created_snap_id,
-        "deleted_snapshots": deleted_snaps
+        "created_snapshots": created_snaps,
+        "deleted_snapshots": deleted_snaps,
+        "failed": failed
     }
 
-def get_completed_snapshots(ec2, volume_id):
-    """Return all completed snapshots for a given EBS volume, owned by this account."""
-    try:
-        response = ec2.describe_snapshots(
-            Filters=[
-                {'Name': 'volume-id', 'Values': [volume_id]},
-                {'Name': 'status', 'Values': ['completed']}
-            ],
-            OwnerIds=['self']
-        )
-        snapshots = response.get('Snapshots', [])
-        
-        return snapshots
-    except Exception as e:
-        return []
\ No newline at end of file
+def get_completed_snapshots(ec2, volume_ids):
+    """
+    Return completed snapshots owned by this account, grouped by volume, for the given volumes.
+    The account's snapshots are paged through once instead of querying each volume.
+    """
+    snapshots = {volume_id: [] for volume_id in volume_ids}
+    paginator = ec2.get_paginator('describe_snapshots')
+    pages = paginator.paginate(
+        Filters=[{'Name': 'status', 'Values': ['completed']}],
+        OwnerIds=['self'],
+        PaginationConfig={'PageSize': 1000}
+    )
+    for page in pages:
+        for snapshot in page['Snapshots']:
+            if snapshot['VolumeId'] in snapshots:
+                snapshots[snapshot['VolumeId']].append(snapshot)
+    return snapshots
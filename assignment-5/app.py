@@ -1,6 +1,12 @@
-import boto3
+import json
 import os
 from datetime import datetime, timezone
+from shared import client, instrumented
+
+TAG_KEY = os.environ.get('TAG_KEY', 'USER')
+TAG_VALUE = os.environ.get('TAG_VALUE', 'Sagar')
+DESCRIBE_CHUNK = 200    # Filter values allowed per describe_instances filter
+TAG_CHUNK = 500         # Resource IDs per create_tags call
 
 def get_instance_ids(event):
     """
@@ -13,24 +19,114 @@ def get_instance_ids(event):
         return [i['instance-id'] for i in detail['instances']]
     return []
 
-def has_user_tag(ec2, instance_id):
+def has_user_tag(tags):
     """
     Check if the instance already has the specified USER tag.
     """
-    response = ec2.describe_instances(InstanceIds=[instance_id])
-    tags = response['Reservations'][0]['Instances'][0].get('Tags', [])
-    tag_key = os.environ.get('TAG_KEY', 'USER')
-    tag_value = os.environ.get('TAG_VALUE', 'Sagar')
-
     for tag in tags:
-        if tag['Key'] == tag_key and tag['Value'] == tag_value:
+        if tag['Key'] == TAG_KEY and tag['Value'] == TAG_VALUE:
             return True
     return False
 
+def describe_tags(ec2, instance_ids):
+    """
+    Return {instance_id: tags} for many instances with a few describe_instances calls.
+    An instance-id filter is used instead of InstanceIds so one unknown ID does not fail the whole call.
+    """
+    tags = {}
+    paginator = ec2.get_paginator('describe_instances')
+    for i in range(0, len(instance_ids), DESCRIBE_CHUNK):
+        chunk = instance_ids[i:i + DESCRIBE_CHUNK]
+        for page in paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': chunk}]):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    tags[instance['InstanceId']] = instance.get('Tags', [])
+    return tags
+
+def launch_tags(event):
+    """Tags to add for instances launched by this event; LaunchDate comes from the event time."""
+    launched = event.get('time')
+    launch_date = launched[:10] if launched else datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    return (
+        ('LaunchDate', launch_date),
+        ('Environment', 'Development')
+    )
+
+def tag_events(ec2, events):
+    """
+    Tag the instances from many launch events with batched API calls.
+    events maps a message ID to its EventBridge event; returns (tagged, skipped, failed_message_ids).
+    """
+    instances_by_message = {message_id: get_instance_ids(e) for message_id, e in events.items()}
+    all_ids = sorted({i for ids in instances_by_message.values() for i in ids})
+    failed = set()
+
+    print(f"Checking and tagging {len(all_ids)} instance(s) from {len(events)} event(s)")
+    try:
+        current_tags = describe_tags(ec2, all_ids)
+    except Exception as e:
+        print(f"[ERROR] describe_instances failed: {e}")
+        return [], [], set(events)
+
+    # Instances that need the same tag set are tagged together
+    groups = {}
+    owners = {}
+    skipped_instances = []
+    for message_id, instance_ids in instances_by_message.items():
+        for instance_id in instance_ids:
+            owners.setdefault(instance_id, set()).add(message_id)
+            if instance_id not in current_tags:
+                # Not visible yet (eventual consistency); retry the message later
+                print(f"[RETRY] Instance {instance_id} not found yet.")
+                failed.add(message_id)
+            elif not has_user_tag(current_tags[instance_id]):
+                print(f"[SKIP] Instance {instance_id} does not have the {TAG_KEY} tag.")
+                skipped_instances.append(instance_id)
+            else:
+                groups.setdefault(launch_tags(events[message_id]), set()).add(instance_id)
+
+    tagged_instances = []
+    for tag_set, instance_ids in groups.items():
+        instance_ids = sorted(instance_ids)
+        tags = [{'Key': k, 'Value': v} for k, v in tag_set]
+        for i in range(0, len(instance_ids), TAG_CHUNK):
+            chunk = instance_ids[i:i + TAG_CHUNK]
+            try:
+                ec2.create_tags(Resources=chunk, Tags=tags)
+                print(f"[TAGGED] {len(chunk)} instance(s) tagged with {dict(tag_set)}.")
+                tagged_instances.extend(chunk)
+            except Exception as e:
+                print(f"[ERROR] create_tags failed for {chunk}: {e}")
+                for instance_id in chunk:
+                    failed.update(owners[instance_id])
+
+    return tagged_instances, skipped_instances, failed
+
+@instrumented
 def lambda_handler(event, context):
-    ec2 = boto3.client('ec2')
+    ec2 = client('ec2')
+
+    # SQS batch of EventBridge launch events: report per-message failures so only those are retried
+    if 'Records' in event:
+        events = {}
+        failed = set()
+        for record in event['Records']:
+            try:
+                events[record['messageId']] = json.loads(record['body'])
+            except (KeyError, ValueError) as e:
+                print(f"[ERROR] Unreadable message {record.get('messageId')}: {e}")
+                failed.add(record['messageId'])
+
+        tagged_instances, skipped_instances, tag_failures = tag_events(ec2, events)
+        failed |= tag_failures
+        return {
+            "batchItemFailures": [{"itemIdentifier": message_id} for message_id in sorted(failed)],
+            "tagged": tagged_instances,
+            "skipped": skipped_instances
+        }
+
     instance_ids = get_instance_ids(event)
-    
+
     if not instance_ids:
         print("No instance IDs found.")
         return {
@@ -40,25 +136,9 @@ def lambda_handler(event, context):
             }
         }
 
-    print(f"Checking and tagging instances: {instance_ids}")
-    tagged_instances = []
-    skipped_instances = []
-
-    for instance_id in instance_ids:
-        if not has_user_tag(ec2, instance_id):
-            print(f"[SKIP] Instance {instance_id} already has USER tag.")
-            skipped_instances.append(instance_id)
-            continue
-
-        # Add tags
-        tags = [
-            {'Key': 'LaunchDate', 'Value': datetime.now(timezone.utc).strftime('%Y-%m-%d')},
-            {'Key': 'Environment', 'Value': 'Development'}
-        ]
-
-        ec2.create_tags(Resources=[instance_id], Tags=tags)
-        print(f"[TAGGED] Instance {instance_id} tagged.")
-        tagged_instances.append(instance_id)
+    tagged_instances, skipped_instances, failed = tag_events(ec2, {'event': event})
+    if failed:
+        raise RuntimeError(f"Tagging failed for instances {instance_ids}")
 
     return {
         "statusCode": 200,
@@ -67,4 +147,4 @@ def lambda_handler(event, context):
             "tagged": tagged_instances,
             "skipped": skipped_instances
         }
-    }
\ No newline at end of file
+    }
@@ -1,48 +1,195 @@
-import boto3
+import calendar
+import io
 import os
-from datetime import datetime, timedelta
+from botocore.exceptions import ClientError
+from datetime import datetime, timedelta, timezone
+from shared import Notifier, client, instrumented, lazy_import
+
+np = lazy_import('numpy')  # Loaded on first use, keeping it out of the import phase of a cold start
 
 # Set your billing threshold and SNS topic ARN
 BILLING_THRESHOLD = float(os.environ.get("BILLING_THRESHOLD", "50.0"))
 SNS_TOPIC_ARN = os.environ.get("SNS_TOPIC_ARN")
+BILLING_REGION = os.environ.get("BILLING_REGION", "ap-south-1")
+# Daily history is kept as a compressed NumPy archive in S3, so each run only fetches new datapoints
+STATE_BUCKET = os.environ.get("STATE_BUCKET")
+STATE_KEY = os.environ.get("STATE_KEY", "billing-monitor/history.npz")
+HISTORY_DAYS = int(os.environ.get("HISTORY_DAYS", "400"))
+# Alert when the latest daily increase is this many times the recent median daily increase
+RATE_MULTIPLIER = float(os.environ.get("RATE_MULTIPLIER", "3.0"))
+
+DAY = 86400
+TOTAL = "Total"
+
+def load_history():
+    """Return (days, names, values): epoch days (n,), series names (k,), and MTD charges (k, n) with NaN gaps."""
+    empty = (np.empty(0, dtype=np.int64), [], np.empty((0, 0)))
+    if not STATE_BUCKET:
+        return empty
+    try:
+        body = client('s3').get_object(Bucket=STATE_BUCKET, Key=STATE_KEY)['Body'].read()
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return empty
+        raise
+    with np.load(io.BytesIO(body), allow_pickle=False) as data:
+        return data['days'], [str(name) for name in data['names']], data['values']
+
+def save_history(days, names, values):
+    if not STATE_BUCKET:
+        return
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, days=days, names=np.array(names), values=values)
+    client('s3').put_object(Bucket=STATE_BUCKET, Key=STATE_KEY, Body=buffer.getvalue())
+
+def fetch_charges(start, end):
+    """
+    Daily maximum EstimatedCharges for the account total and every ServiceName, in one
+    get_metric_data request (paginated). Returns {series name: (epoch days, values)}.
+    """
+    queries = [
+        {
+            'Id': 'total',
+            'Label': TOTAL,
+            'MetricStat': {
+                'Metric': {
+                    'Namespace': 'AWS/Billing',
+                    'MetricName': 'EstimatedCharges',
+                    'Dimensions': [{'Name': 'Currency', 'Value': 'USD'}]
+                },
+                'Period': DAY,
+                'Stat': 'Maximum'
+            }
+        },
+        {
+            'Id': 'services',
+            'Label': "${PROP('Dim.ServiceName')}",
+            'Expression': "SEARCH('{AWS/Billing,Currency,ServiceName} MetricName=\"EstimatedCharges\" Currency=\"USD\"', 'Maximum', 86400)"
+        }
+    ]
+    series = {}
+    paginator = client('cloudwatch', region_name=BILLING_REGION).get_paginator('get_metric_data')
+    for page in paginator.paginate(MetricDataQueries=queries, StartTime=start, EndTime=end, ScanBy='TimestampAscending'):
+        for result in page['MetricDataResults']:
+            days, values = series.setdefault(result['Label'], ([], []))
+            days.extend(int(ts.timestamp()) // DAY for ts in result['Timestamps'])
+            values.extend(result['Values'])
+    return {name: (np.array(d, dtype=np.int64), np.array(v, dtype=float)) for name, (d, v) in series.items()}
+
+def merge_history(days, names, values, fetched):
+    """Merge fetched datapoints into the day grid; newer values overwrite the stored partial day."""
+    names = names + [name for name in fetched if name not in names]
+    all_days = np.concatenate([days] + [d for d, _ in fetched.values()])
+    if not all_days.size:
+        return days, names, values
+    first, last = max(all_days.min(), all_days.max() - HISTORY_DAYS + 1), all_days.max()
+    grid_days = np.arange(first, last + 1, dtype=np.int64)
+
+    grid = np.full((len(names), grid_days.size), np.nan)
+    keep = days >= first
+    grid[:values.shape[0], days[keep] - first] = values[:, keep]
+    for name, (d, v) in fetched.items():
+        keep = d >= first
+        grid[names.index(name), d[keep] - first] = v[keep]
+    return grid_days, names, grid
 
-cloudwatch = boto3.client('cloudwatch', region_name='ap-south-1')
-sns = boto3.client('sns')
+def month_to_date(days, values, month_start_day):
+    """
+    This month's columns with gaps filled: missing leading days are 0 (nothing charged yet)
+    and later gaps repeat the previous day, since the metric is cumulative month-to-date.
+    """
+    columns = days >= month_start_day
+    mtd = values[:, columns]
+    if not mtd.size:
+        return days[columns], mtd
+    positions = np.where(np.isnan(mtd), 0, np.arange(mtd.shape[1]))
+    np.maximum.accumulate(positions, axis=1, out=positions)
+    mtd = np.take_along_axis(mtd, positions, axis=1)
+    return days[columns], np.nan_to_num(mtd, nan=0.0)
 
+def forecast(days, values, now):
+    """
+    Vectorized month-end projection for every series at once: a least-squares line through
+    this month's month-to-date charges, evaluated on the last day of the month.
+    Returns (current, projected) arrays of shape (k,).
+    """
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    month_start_day = int(month_start.timestamp()) // DAY
+    days_in_month = calendar.monthrange(now.year, now.month)[1]
+
+    mtd_days, mtd = month_to_date(days, values, month_start_day)
+    if not mtd.size:
+        zeros = np.zeros(values.shape[0])
+        return zeros, zeros
+    current = mtd[:, -1]
+    if mtd_days.size < 2:
+        return current, current
+    slope, intercept = np.polyfit(mtd_days - month_start_day, mtd.T, 1)
+    projected = intercept + slope * (days_in_month - 1)
+    return current, np.maximum(projected, current)
+
+def daily_spike(total):
+    """Return (latest daily increase, recent median increase) for the total series."""
+    increases = np.diff(total[~np.isnan(total)])
+    increases = increases[increases >= 0]  # Drops the reset on the first of each month
+    if increases.size < 3:
+        return (float(increases[-1]) if increases.size else 0.0), None
+    return float(increases[-1]), float(np.median(increases[-15:-1]))
+
+@instrumented
 def lambda_handler(event, context):
     try:
-        response = cloudwatch.get_metric_statistics(
-            Namespace='AWS/Billing',
-            MetricName='EstimatedCharges',
-            Dimensions=[{'Name': 'Currency', 'Value': 'USD'}],
-            StartTime=datetime.utcnow() - timedelta(days=1),
-            EndTime=datetime.utcnow(),
-            Period=86400,
-            Statistics=['Maximum']
-        )
+        now = datetime.now(timezone.utc)
+        days, names, values = load_history()
 
-        datapoints = response['Datapoints']
-        if not datapoints:
+        # Only fetch from the last stored day (its value may have grown since) onwards
+        if days.size:
+            start_day = int(days[-1])
+        else:
+            start_day = int((now - timedelta(days=35)).timestamp()) // DAY
+        fetched = fetch_charges(datetime.fromtimestamp(start_day * DAY, timezone.utc), now)
+        days, names, values = merge_history(days, names, values, fetched)
+        save_history(days, names, values)
+
+        if TOTAL not in names:
             print("No billing data available yet.")
             return
 
-        latest_point = sorted(datapoints, key=lambda x: x['Timestamp'])[-1]
-        cost = latest_point['Maximum']
+        current, projected = forecast(days, values, now)
+        total = names.index(TOTAL)
+        cost, projected_cost = float(current[total]), float(projected[total])
+        latest_increase, typical_increase = daily_spike(values[total])
+        spike = typical_increase is not None and latest_increase > RATE_MULTIPLIER * max(typical_increase, 0.01)
 
-        print(f"Current estimated charges: ${cost:.2f}")
+        print(f"Current estimated charges: ${cost:.2f}, projected month-end: ${projected_cost:.2f}")
+
+        services = sorted(
+            ((name, float(c), float(p)) for name, c, p in zip(names, current, projected) if name != TOTAL),
+            key=lambda s: s[2], reverse=True
+        )
 
-        if cost > BILLING_THRESHOLD:
-            message = f"⚠️ AWS Billing Alert:\nYour estimated charges are ${cost:.2f}, which exceeds your threshold of ${BILLING_THRESHOLD:.2f}."
-            sns.publish(
-                TopicArn=SNS_TOPIC_ARN,
-                Subject="🚨 AWS Billing Alert",
-                Message=message
-            )
+        if cost > BILLING_THRESHOLD or projected_cost > BILLING_THRESHOLD or spike:
+            lines = [
+                "⚠️ AWS Billing Alert:",
+                f"Your estimated charges are ${cost:.2f} and are projected to reach ${projected_cost:.2f} by month end "
+                f"(threshold ${BILLING_THRESHOLD:.2f})."
+            ]
+            if spike:
+                lines.append(
+                    f"Spend grew ${latest_increase:.2f} in the last day, over {RATE_MULTIPLIER:g}x the typical ${typical_increase:.2f}."
+                )
+            if services:
+                lines.append("\nTop services by projected month-end charges:")
+                lines += [f"  {name}: ${c:.2f} now, ${p:.2f} projected" for name, c, p in services[:5]]
+            notifier = Notifier(SNS_TOPIC_ARN)
+            notifier.add("🚨 AWS Billing Alert", "\n".join(lines))
+            if notifier.flush():
+                raise RuntimeError("The billing alert could not be published")
             print("SNS alert sent.")
-            return {"status": "alert_sent", "cost": cost}
+            return {"status": "alert_sent", "cost": cost, "projected_cost": projected_cost, "spike": spike}
         else:
             print("Billing is within the threshold.")
-            return {"status": "within_threshold", "cost": cost}
+            return {"status": "within_threshold", "cost": cost, "projected_cost": projected_cost, "spike": spike}
 
     except Exception as e:
         print(f"Error: {str(e)}")
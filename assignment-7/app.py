@@ -1,35 +1,102 @@
-import boto3
 import os
 import json
+from decimal import Decimal
+from shared import Notifier, instrumented
 
 SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')
-sns = boto3.client('sns')
+_deserializer = None
 
+def ddb_to_dict(image):
+    """Convert a DynamoDB typed image ({'S': ...}, {'M': ...}, {'L': ...}, {'N': ...}) to plain Python values."""
+    global _deserializer
+    if _deserializer is None:
+        # Imported on first use: importing boto3 is most of this handler's cold start
+        from boto3.dynamodb.types import TypeDeserializer
+        _deserializer = TypeDeserializer()
+    return {k: _deserializer.deserialize(v) for k, v in image.items()}
+
+def to_json(value):
+    """json.dumps default: numbers come back as Decimal and sets as set."""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8', 'replace')
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def diff_images(old, new):
+    """Only the attributes whose value changed, as {name: {'old': ..., 'new': ...}}."""
+    return {
+        name: {'old': old.get(name), 'new': new.get(name)}
+        for name in sorted(old.keys() | new.keys())
+        if old.get(name) != new.get(name)
+    }
+
+def coalesce(records):
+    """
+    Group MODIFY records by item key, keeping the first OldImage and the last NewImage so
+    several writes to one item in a batch become one net change. A REMOVE or INSERT of the
+    key ends its group, so changes on either side of a delete are never diffed together.
+    Returns ([change], failed sequence numbers).
+    """
+    changes = []
+    open_changes = {}  # Item key -> its change still being coalesced
+    failed = []
+    for record in records:
+        try:
+            stream = record['dynamodb']
+            if record.get('eventName') not in ('MODIFY', 'REMOVE', 'INSERT'):
+                continue
+            keys = ddb_to_dict(stream['Keys'])
+            key = json.dumps(keys, sort_keys=True, default=to_json)
+            if record['eventName'] != 'MODIFY':
+                open_changes.pop(key, None)
+                continue
+            change = open_changes.get(key)
+            if change is None:
+                change = open_changes[key] = {
+                    'keys': keys,
+                    'old': ddb_to_dict(stream.get('OldImage', {})),
+                    'new_image': stream.get('NewImage', {}),
+                    'sequence_number': stream['SequenceNumber']
+                }
+                changes.append(change)
+            else:
+                change['new_image'] = stream.get('NewImage', {})
+        except Exception as e:
+            sequence_number = (record.get('dynamodb') or {}).get('SequenceNumber')
+            print(f"Could not read record {sequence_number}: {e}")
+            failed.append(sequence_number)
+    return changes, failed
+
+@instrumented
 def lambda_handler(event, context):
-    for record in event.get('Records', []):
-        if record['eventName'] == 'MODIFY':
-            old_image = record['dynamodb'].get('OldImage', {})
-            new_image = record['dynamodb'].get('NewImage', {})
-            
-            # Convert DynamoDB types to JSON
-            def ddb_to_dict(image):
-                return {k: list(v.values())[0] for k, v in image.items()}
-            
-            old = ddb_to_dict(old_image)
-            new = ddb_to_dict(new_image)
+    changes, failed = coalesce(event.get('Records', []))
+    # Alerts are sent together at the end: identical ones once, and past the cap as one digest.
+    # A retried batch repeats the alerts already sent for it, so recently sent ones are skipped
+    notifier = Notifier(SNS_TOPIC_ARN, dedup=True)
+
+    for change in changes:
+        try:
+            new = ddb_to_dict(change['new_image'])
+            changed = diff_images(change['old'], new)
+            if not changed:
+                continue  # Later writes in the batch restored the original values
 
             message = (
                 f"DynamoDB item updated:\n\n"
-                f"Old values: {json.dumps(old, indent=2)}\n\n"
-                f"New values: {json.dumps(new, indent=2)}"
-            )
-
-            # Publish to SNS
-            sns.publish(
-                TopicArn=SNS_TOPIC_ARN,
-                Subject="DynamoDB Item Updated",
-                Message=message
+                f"Key: {json.dumps(change['keys'], default=to_json)}\n\n"
+                f"Changed attributes: {json.dumps(changed, indent=2, default=to_json)}"
             )
+            notifier.add("DynamoDB Item Updated", message, ref=change['sequence_number'])
+        except Exception as e:
+            print(f"Failed to process change for {change['keys']}: {e}")
+            failed.append(change['sequence_number'])
+    failed += notifier.flush()
 
-            print(f"Alert sent:\n{message}")
-    return {"status": "done"}
\ No newline at end of file
+    # Lambda retries the stream from the earliest failed record onwards
+    return {
+        "status": "done",
+        "batchItemFailures": [{"itemIdentifier": seq} for seq in failed if seq]
+    }
@@ -1,34 +1,244 @@
-import boto3
+import hashlib
+import json
 import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus
+from shared import MultipartWriter, client, instrumented
+from shared.throttle import THROTTLE_CODES
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-comprehend = boto3.client('comprehend')
+# 'auto' detects the dominant language of every review; set e.g. 'en' to skip detection
+LANGUAGE_CODE = os.environ.get('LANGUAGE_CODE', 'auto')
+CACHE_SIZE = int(os.environ.get('CACHE_SIZE', 10000))
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 4))
+OUTPUT_PREFIX = os.environ.get('OUTPUT_PREFIX', 'sentiment/')
+BATCH_SIZE = 25   # Most documents batch_detect_sentiment accepts per call
+S3_CHUNK = 1000   # Reviews read from a JSONL file before they are analyzed
+MAX_TEXT_BYTES = 5000  # Largest document Comprehend accepts, in UTF-8 bytes
+# Languages batch_detect_sentiment supports
+SENTIMENT_LANGUAGES = {'en', 'es', 'fr', 'de', 'it', 'pt', 'ar', 'hi', 'ja', 'ko', 'zh', 'zh-TW'}
 
+# Results by normalized-text hash; module level, so it survives warm invocations
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def cache_key(text):
+    """Hash of the review with case and whitespace differences removed, so near-duplicates share a result."""
+    normalized = re.sub(r'\s+', ' ', text).strip().casefold()
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+def cache_get(key):
+    with _cache_lock:
+        result = _cache.get(key)
+        if result is not None:
+            _cache.move_to_end(key)
+        return result
+
+def cache_put(key, result):
+    with _cache_lock:
+        _cache[key] = result
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+def detect_languages(texts):
+    """Dominant language per text with one batch call; failed items map to an error dict."""
+    if LANGUAGE_CODE != 'auto':
+        return [LANGUAGE_CODE] * len(texts)
+    response = client('comprehend').batch_detect_dominant_language(TextList=texts)
+    languages = [None] * len(texts)
+    for item in response['ResultList']:
+        languages[item['Index']] = item['Languages'][0]['LanguageCode'] if item['Languages'] else None
+    for item in response['ErrorList']:
+        languages[item['Index']] = {'error': item['ErrorCode'], 'message': item['ErrorMessage']}
+    return languages
+
+def analyze_chunk(texts):
+    """Sentiment for up to BATCH_SIZE texts: one language call, then one sentiment call per language found."""
+    results = [None] * len(texts)
+    by_language = {}
+    for i, language in enumerate(detect_languages(texts)):
+        if isinstance(language, dict):
+            results[i] = language
+        elif language not in SENTIMENT_LANGUAGES:
+            results[i] = {'error': 'UnsupportedLanguage', 'message': f"Language {language!r} is not supported"}
+        else:
+            by_language.setdefault(language, []).append(i)
+
+    for language, indexes in by_language.items():
+        response = client('comprehend').batch_detect_sentiment(
+            TextList=[texts[i] for i in indexes], LanguageCode=language
+        )
+        for item in response['ResultList']:
+            results[indexes[item['Index']]] = {
+                'sentiment': item['Sentiment'],
+                'sentiment_score': item['SentimentScore'],
+                'language': language
+            }
+        for item in response['ErrorList']:
+            results[indexes[item['Index']]] = {'error': item['ErrorCode'], 'message': item['ErrorMessage']}
+    return results
+
+def invalid_text(text):
+    """Why Comprehend would reject a text (and with it the whole batch call), or None."""
+    if text is not None and not isinstance(text, str):
+        return {'error': 'InvalidReview', 'message': f"The review is a {type(text).__name__}, not text"}
+    if not text or not text.strip():
+        return {'error': 'EmptyText', 'message': "The review is empty"}
+    if len(text.encode('utf-8')) > MAX_TEXT_BYTES:
+        return {'error': 'TextSizeLimitExceeded', 'message': f"The review is over {MAX_TEXT_BYTES} bytes"}
+    return None
+
+def retryable(error):
+    """Throttling, a 5xx or a dropped connection; any other failure would repeat on every retry."""
+    from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+    if isinstance(error, (ConnectionError, HTTPClientError)):
+        return True
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code')
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return code in THROTTLE_CODES or status >= 500
+    return False
+
+def analyze(texts):
+    """
+    Sentiment for many texts, in input order. Cached and duplicate texts are analyzed once;
+    the rest go to Comprehend in concurrent batches of BATCH_SIZE. Non-text, empty or oversized reviews
+    get an error of their own instead of failing their batch. A batch call that failed on
+    throttling or a server error marks its items with 'retryable': True.
+    """
+    invalid = [invalid_text(text) for text in texts]
+    keys = [cache_key(text) if error is None else None for text, error in zip(texts, invalid)]
+    pending = OrderedDict()
+    for key, text, error in zip(keys, texts, invalid):
+        if error is None and key not in pending and cache_get(key) is None:
+            pending[key] = text
+
+    fresh = {}
+    items = list(pending.items())
+    chunks = [items[i:i + BATCH_SIZE] for i in range(0, len(items), BATCH_SIZE)]
+
+    def run(chunk):
+        try:
+            return chunk, analyze_chunk([text for _, text in chunk])
+        except Exception as e:
+            logger.error(f"Comprehend batch failed: {e}")
+            return chunk, [{'error': type(e).__name__, 'message': str(e), 'retryable': retryable(e)}] * len(chunk)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for chunk, results in executor.map(run, chunks):
+            for (key, _), result in zip(chunk, results):
+                fresh[key] = result
+                if 'error' not in result:
+                    cache_put(key, result)
+
+    logger.info(
+        f"Analyzed {len(texts)} reviews: {len(pending)} sent to Comprehend, {sum(map(bool, invalid))} invalid, "
+        f"the rest from cache"
+    )
+    return [error or fresh.get(key) or cache_get(key) for key, error in zip(keys, invalid)]
+
+def review_of(body):
+    """An SQS message body is either a JSON object with a 'review' field or the review text itself."""
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return body
+    return payload.get('review', '') if isinstance(payload, dict) else body
+
+def handle_sqs(records):
+    texts = [review_of(record['body']) for record in records]
+    results = analyze(texts)
+    failures = []
+    for record, text, result in zip(records, texts, results):
+        if result.get('retryable'):
+            failures.append({'itemIdentifier': record['messageId']})
+        elif 'error' in result:
+            logger.error(f"Review in message {record['messageId']} failed: {result['error']} {result.get('message', '')}")
+        else:
+            logger.info(f"Message {record['messageId']}: {result['sentiment']}")
+    return {'batchItemFailures': failures, 'processed': len(records)}
+
+def handle_s3(bucket, key):
+    """
+    Analyze a JSONL file of {'review': ...} objects and write one result line per input line.
+    Results are uploaded chunk by chunk as they are analyzed, so the file never sits in memory.
+    """
+    if OUTPUT_PREFIX and key.startswith(OUTPUT_PREFIX):
+        # Our own output landing in the same bucket; analyzing it would trigger another run
+        logger.info(f"Skipping s3://{bucket}/{key}: it is under OUTPUT_PREFIX")
+        return {'input': f's3://{bucket}/{key}', 'skipped': 'output file'}
+
+    body = client('s3').get_object(Bucket=bucket, Key=key)['Body']
+    output_key = OUTPUT_PREFIX + key.rsplit('/', 1)[-1]
+    writer = MultipartWriter(client('s3'), bucket, output_key, ContentType='application/x-ndjson')
+    counts = {}
+
+    def flush(lines):
+        results = analyze([line.get('review', '') for line in lines])
+        out = [json.dumps({**line, **result}) + '\n' for line, result in zip(lines, results)]
+        writer.write(''.join(out).encode('utf-8'))
+        for result in results:
+            label = result.get('sentiment', 'ERROR')
+            counts[label] = counts.get(label, 0) + 1
+
+    try:
+        lines = []
+        for raw in body.iter_lines():
+            if raw.strip():
+                lines.append(json.loads(raw))
+            if len(lines) == S3_CHUNK:
+                flush(lines)
+                lines = []
+        if lines:
+            flush(lines)
+        written = writer.close()
+    except Exception:
+        writer.abort()
+        raise
+    output = f's3://{bucket}/{output_key}' if written else None
+    return {'input': f's3://{bucket}/{key}', 'output': output, 'sentiments': counts}
+
+@instrumented
 def lambda_handler(event, context):
+    # Batch entry points: an SQS batch of reviews, or a JSONL file in S3
+    records = event.get('Records', [])
+    if records and records[0].get('eventSource') == 'aws:sqs':
+        return handle_sqs(records)
+    if records and records[0].get('eventSource') == 'aws:s3':
+        # Event notifications URL-encode the key (a space arrives as '+')
+        return [handle_s3(r['s3']['bucket']['name'], unquote_plus(r['s3']['object']['key'])) for r in records]
+    if 'bucket' in event and 'key' in event:
+        return handle_s3(event['bucket'], event['key'])
+
     # 1. Extract the review text from the event
     review_text = event.get('review', '')
     if not review_text:
         logger.error("No review found in the event payload.")
         return {"error": "No review provided."}
-    
+
     # 2. Analyze sentiment using Comprehend
-    response = comprehend.detect_sentiment(
-        Text=review_text,
-        LanguageCode='en'  # Change if working with another language
-    )
-    
-    sentiment = response['Sentiment']
-    sentiment_score = response['SentimentScore']
-    
+    result = analyze([review_text])[0]
+    if 'error' in result:
+        logger.error(f"Sentiment analysis failed: {result['error']} {result.get('message', '')}")
+        return {"error": result['error'], "review": review_text}
+
+    sentiment = result['sentiment']
+    sentiment_score = result['sentiment_score']
+
     # 3. Log the sentiment result
     logger.info(f"Review: {review_text}")
     logger.info(f"Sentiment: {sentiment}")
     logger.info(f"Sentiment Score: {sentiment_score}")
-    
+
     return {
         "review": review_text,
         "sentiment": sentiment,
-        "sentiment_score": sentiment_score
+        "sentiment_score": sentiment_score,
+        "language": result['language']
     }
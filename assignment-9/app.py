@@ -1,33 +1,434 @@
-import boto3
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime, timezone, timedelta
+from urllib.parse import quote_plus, unquote_plus, urlencode
+import asyncio
+import csv
+import gzip
+import io
+import json
 import os
+import time
+import uuid
+from shared import MultipartWriter, ResultSink, client, instrumented, list_and_mutate
 
 BUCKET_NAME = os.environ.get('BUCKET_NAME', 'sagar-archive-demo-bucket')
 AGE_DAYS = int(os.environ.get('AGE_DAY', 160)) # 6 months ≈ 180 days
 GLACIER_CLASS = os.environ.get('GLACIER_CLASS', 'GLACIER')
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 8))             # objects transitioned in parallel
+PART_WORKERS = int(os.environ.get('PART_WORKERS', 8))           # parts copied in parallel for large objects
+MULTIPART_THRESHOLD = int(os.environ.get('MULTIPART_THRESHOLD_MB', 1024)) * 1024 * 1024
+PART_SIZE = int(os.environ.get('PART_SIZE_MB', 512)) * 1024 * 1024
 
+# Inventory mode: read the daily S3 Inventory instead of listing, and hand the copies to S3 Batch Operations
+ARCHIVE_MODE = os.environ.get('ARCHIVE_MODE', 'list')          # 'list' or 'inventory'
+INVENTORY_BUCKET = os.environ.get('INVENTORY_BUCKET')
+INVENTORY_PREFIX = os.environ.get('INVENTORY_PREFIX', '')      # e.g. 'inventory/<source-bucket>/<config-id>/'
+MANIFEST_BUCKET = os.environ.get('MANIFEST_BUCKET', INVENTORY_BUCKET)
+MANIFEST_PREFIX = os.environ.get('MANIFEST_PREFIX', 'glacier-archiver/')
+BATCH_ROLE_ARN = os.environ.get('BATCH_ROLE_ARN')
+# Per-object results (archived or error) are streamed to a gzipped NDJSON report instead of the response
+REPORT_BUCKET = os.environ.get('REPORT_BUCKET', BUCKET_NAME)
+REPORT_PREFIX = os.environ.get('REPORT_PREFIX', 'glacier-archiver/results/')
+
+MIN_PART_SIZE = 5 * 1024 * 1024   # S3 minimum for every part except the last
+MAX_PARTS = 10000                  # S3 maximum parts per upload
+MAX_COPY_SIZE = 5 * 1024 ** 3      # Largest object CopyObject (and so Batch Operations) can copy
+MANIFEST_PART_SIZE = 8 * 1024 * 1024
+ARCHIVED_CLASSES = ['GLACIER', 'DEEP_ARCHIVE']
+INVENTORY_FIELDS = ['Bucket', 'Key', 'VersionId', 'IsLatest', 'IsDeleteMarker', 'Size', 'LastModifiedDate', 'StorageClass']
+
+# Metadata and encryption settings that CopyObject keeps with MetadataDirective='COPY' but a multipart
+# upload has to be told about
+COPIED_HEADERS = [
+    'ContentType', 'CacheControl', 'ContentDisposition', 'ContentEncoding', 'ContentLanguage', 'Expires',
+    'WebsiteRedirectLocation', 'Metadata', 'ServerSideEncryption', 'SSEKMSKeyId', 'BucketKeyEnabled'
+]
+# Object ACL permissions and the create_multipart_upload arguments that grant them
+ACL_GRANT_ARGUMENTS = {
+    'FULL_CONTROL': 'GrantFullControl', 'READ': 'GrantRead', 'READ_ACP': 'GrantReadACP', 'WRITE_ACP': 'GrantWriteACP'
+}
+
+def copy_request(key):
+    """CopyObject arguments that transition an object below MULTIPART_THRESHOLD in place."""
+    return {
+        'Bucket': BUCKET_NAME,
+        'Key': key,
+        'CopySource': {'Bucket': BUCKET_NAME, 'Key': key},
+        'StorageClass': GLACIER_CLASS,
+        'MetadataDirective': 'COPY'
+    }
+
+def copy_object(s3, key):
+    """Transition an object below MULTIPART_THRESHOLD with a single CopyObject request."""
+    s3.copy_object(**copy_request(key))
+
+def part_ranges(size):
+    """Yield (part_number, byte_range) pairs covering an object of the given size."""
+    part_size = max(PART_SIZE, MIN_PART_SIZE, -(-size // MAX_PARTS))
+    for number, start in enumerate(range(0, size, part_size), start=1):
+        end = min(start + part_size, size) - 1
+        yield number, f'bytes={start}-{end}'
+
+def object_tagging(s3, key):
+    """The object's tags as the URL-encoded Tagging argument, or {} when it has none."""
+    tags = s3.get_object_tagging(Bucket=BUCKET_NAME, Key=key)['TagSet']
+    return {'Tagging': urlencode([(tag['Key'], tag['Value']) for tag in tags])} if tags else {}
+
+def object_grants(s3, key):
+    """
+    Grant* arguments that reproduce the object's ACL, or {} when only its owner has access
+    (the default, and all there is on buckets with ACLs disabled).
+    """
+    acl = s3.get_object_acl(Bucket=BUCKET_NAME, Key=key)
+    grants = {}
+    for grant in acl['Grants']:
+        grantee = grant['Grantee']
+        if grantee['Type'] == 'CanonicalUser':
+            value = f'id="{grantee["ID"]}"'
+        elif grantee['Type'] == 'Group':
+            value = f'uri="{grantee["URI"]}"'
+        else:
+            value = f'emailAddress="{grantee["EmailAddress"]}"'
+        argument = ACL_GRANT_ARGUMENTS.get(grant['Permission'])
+        if argument:
+            grants.setdefault(argument, []).append(value)
+    if grants == {'GrantFullControl': [f'id="{acl["Owner"]["ID"]}"']}:
+        return {}
+    return {argument: ', '.join(values) for argument, values in grants.items()}
+
+def multipart_copy(s3, part_executor, key, size):
+    """
+    Transition a large object with UploadPartCopy, copying its parts in parallel.
+    Required for objects over 5 GB, which CopyObject rejects. Metadata, encryption settings,
+    tags and ACL grants are carried over explicitly, since a multipart upload starts blank.
+    """
+    head = s3.head_object(Bucket=BUCKET_NAME, Key=key)
+    extra = {name: head[name] for name in COPIED_HEADERS if head.get(name)}
+    extra.update(object_tagging(s3, key))
+    extra.update(object_grants(s3, key))
+    upload_id = s3.create_multipart_upload(
+        Bucket=BUCKET_NAME, Key=key, StorageClass=GLACIER_CLASS, **extra
+    )['UploadId']
+
+    def copy_part(number, byte_range):
+        response = s3.upload_part_copy(
+            Bucket=BUCKET_NAME,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=number,
+            CopySource={'Bucket': BUCKET_NAME, 'Key': key},
+            CopySourceRange=byte_range,
+            CopySourceIfMatch=head['ETag']  # Fail instead of mixing versions if the object changes mid-copy
+        )
+        return {'PartNumber': number, 'ETag': response['CopyPartResult']['ETag']}
+
+    try:
+        futures = [part_executor.submit(copy_part, n, r) for n, r in part_ranges(size)]
+        parts = sorted((f.result() for f in futures), key=lambda p: p['PartNumber'])
+        s3.complete_multipart_upload(
+            Bucket=BUCKET_NAME, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts}
+        )
+    except Exception:
+        s3.abort_multipart_upload(Bucket=BUCKET_NAME, Key=key, UploadId=upload_id)
+        raise
+
+def archive_objects(s3, objects, report):
+    """
+    Transition (key, size) pairs to GLACIER_CLASS on a bounded thread pool.
+    Each outcome is added to report; returns the number of bytes archived.
+    """
+    archived_bytes = 0
+
+    def transition(key, size):
+        try:
+            if size > MULTIPART_THRESHOLD:
+                multipart_copy(s3, part_executor, key, size)
+            else:
+                copy_object(s3, key)
+            return key, size, None
+        except Exception as e:
+            return key, size, str(e)
+
+    def collect(done):
+        nonlocal archived_bytes
+        for future in done:
+            key, size, error = future.result()
+            if error:
+                report.add('error', key, error=error)
+            else:
+                report.add('archived', key, size=size)
+                archived_bytes += size
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor, \
+            ThreadPoolExecutor(max_workers=PART_WORKERS) as part_executor:
+        pending = set()
+        for key, size in objects:
+            # Bound the number of queued copies so listing cannot run far ahead of the workers
+            if len(pending) >= MAX_WORKERS * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(executor.submit(transition, key, size))
+
+        collect(wait(pending).done)
+
+    return archived_bytes
+
+def is_own_report(key):
+    """True for this function's run reports, which land in BUCKET_NAME unless REPORT_BUCKET is set."""
+    return REPORT_BUCKET == BUCKET_NAME and key.startswith(REPORT_PREFIX)
+
+def is_candidate(obj, cutoff_date):
+    """True for a list_objects_v2 entry older than the cutoff, not already in Glacier and not one of our reports."""
+    return obj['LastModified'] < cutoff_date and obj.get('StorageClass', 'STANDARD') not in ARCHIVED_CLASSES \
+        and not is_own_report(obj['Key'])
+
+def archive_listed(s3, cutoff_date, report):
+    """
+    List the bucket and transition candidates while later pages are still being listed.
+    Copies go through the async pipeline; objects over MULTIPART_THRESHOLD run multipart_copy
+    on a thread so their parts are still copied in parallel. Each outcome is added to report;
+    returns the number of bytes archived.
+    """
+    archived_bytes = 0
+
+    with ThreadPoolExecutor(max_workers=PART_WORKERS) as part_executor:
+        async def transition(async_s3, objects):
+            key, size = objects[0]['Key'], objects[0]['Size']
+            try:
+                if size > MULTIPART_THRESHOLD:
+                    await asyncio.to_thread(multipart_copy, s3, part_executor, key, size)
+                else:
+                    await async_s3.copy_object(**copy_request(key))
+            except Exception as e:
+                return str(e)
+            return None
+
+        def collect(objects, error):
+            nonlocal archived_bytes
+            if error:
+                report.add('error', objects[0]['Key'], error=error)
+            else:
+                report.add('archived', objects[0]['Key'], size=objects[0]['Size'])
+                archived_bytes += objects[0]['Size']
+
+        list_and_mutate(
+            BUCKET_NAME,
+            transition,
+            select=lambda obj: is_candidate(obj, cutoff_date),
+            workers=MAX_WORKERS,
+            on_result=collect
+        )
+
+    return archived_bytes
+
+class S3RangeReader(io.RawIOBase):
+    """Seekable read-only view of an S3 object backed by ranged GETs, for formats that need random access."""
+
+    def __init__(self, s3, bucket, key, size):
+        self.s3, self.bucket, self.key, self.size = s3, bucket, key, size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence]
+        self.position = base + offset
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size:
+            return 0
+        end = min(self.position + len(buffer), self.size) - 1
+        data = self.s3.get_object(
+            Bucket=self.bucket, Key=self.key, Range=f'bytes={self.position}-{end}'
+        )['Body'].read()
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+def latest_inventory_manifest(s3):
+    """Return the key of the newest manifest.json under INVENTORY_PREFIX."""
+    response = s3.list_objects_v2(Bucket=INVENTORY_BUCKET, Prefix=INVENTORY_PREFIX, Delimiter='/')
+    # Delivery folders are named by timestamp (YYYY-MM-DDTHH-MMZ/), so the newest sorts last
+    folders = sorted(
+        p['Prefix'] for p in response.get('CommonPrefixes', [])
+        if p['Prefix'][len(INVENTORY_PREFIX):][:1].isdigit()
+    )
+    if not folders:
+        raise ValueError(f"No inventory deliveries found under s3://{INVENTORY_BUCKET}/{INVENTORY_PREFIX}")
+    return folders[-1] + 'manifest.json'
+
+def read_inventory_rows(s3, manifest):
+    """
+    Stream every row of the inventory data files listed in a manifest as a dict keyed by field name.
+    CSV files are gunzipped on the fly; Parquet files are read a row group at a time (requires pyarrow).
+    """
+    # CSV manifests list their columns in fileSchema; Parquet ones carry a schema definition instead
+    fields = [f.strip() for f in manifest.get('fileSchema', '').split(',')]
+    file_format = manifest['fileFormat'].upper()
+
+    for data_file in manifest['files']:
+        if file_format == 'CSV':
+            body = s3.get_object(Bucket=INVENTORY_BUCKET, Key=data_file['key'])['Body']
+            with io.TextIOWrapper(gzip.GzipFile(fileobj=body), encoding='utf-8', newline='') as text:
+                for row in csv.reader(text):
+                    record = dict(zip(fields, row))
+                    # CSV inventories URL-encode keys; keep the raw form for the Batch Operations manifest
+                    record['EncodedKey'] = record['Key']
+                    record['Key'] = unquote_plus(record['Key'])
+                    yield record
+        elif file_format == 'PARQUET':
+            import pyarrow.parquet as pq
+
+            reader = io.BufferedReader(
+                S3RangeReader(s3, INVENTORY_BUCKET, data_file['key'], data_file['size']),
+                buffer_size=MANIFEST_PART_SIZE
+            )
+            for batch in pq.ParquetFile(reader).iter_batches():
+                for record in batch.to_pylist():
+                    # Parquet columns are lower_snake_case (last_modified_date); map them to the CSV field names
+                    record = {name.replace('_', ''): value for name, value in record.items()}
+                    record = {field: record.get(field.lower()) for field in INVENTORY_FIELDS}
+                    record['EncodedKey'] = quote_plus(record['Key'], safe='/')
+                    yield record
+        else:
+            raise ValueError(f"Unsupported inventory format: {manifest['fileFormat']}")
+
+def parse_last_modified(value):
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def inventory_candidates(rows, cutoff_date):
+    """Filter inventory rows down to current object versions that should move to Glacier."""
+    for row in rows:
+        if str(row.get('IsDeleteMarker', 'false')).lower() == 'true':
+            continue
+        if str(row.get('IsLatest', 'true')).lower() == 'false':
+            continue
+        if (row.get('StorageClass') or 'STANDARD') in ARCHIVED_CLASSES:
+            continue
+        if is_own_report(row['Key']):
+            continue
+        if parse_last_modified(row['LastModifiedDate']) < cutoff_date:
+            yield row
+
+class ManifestWriter(MultipartWriter):
+    """Write a Batch Operations CSV manifest to S3 as a multipart upload, so it never sits in memory."""
+
+    def __init__(self, s3, bucket, key):
+        super().__init__(s3, bucket, key, part_size=MANIFEST_PART_SIZE, ContentType='text/csv')
+        self.rows = 0
+
+    def add(self, bucket, encoded_key):
+        self.write(f'{bucket},{encoded_key}\n'.encode('utf-8'))
+        self.rows += 1
+
+def submit_batch_job(manifest_key, etag, account_id):
+    """Create one S3 Batch Operations job that copies every manifest entry into GLACIER_CLASS."""
+    s3control = client('s3control')
+    response = s3control.create_job(
+        AccountId=account_id,
+        ConfirmationRequired=False,
+        Operation={
+            'S3PutObjectCopy': {
+                'TargetResource': f'arn:aws:s3:::{BUCKET_NAME}',
+                'StorageClass': GLACIER_CLASS,
+                'MetadataDirective': 'COPY'
+            }
+        },
+        Manifest={
+            'Spec': {'Format': 'S3BatchOperations_CSV_20180820', 'Fields': ['Bucket', 'Key']},
+            'Location': {'ObjectArn': f'arn:aws:s3:::{MANIFEST_BUCKET}/{manifest_key}', 'ETag': etag}
+        },
+        Report={
+            'Bucket': f'arn:aws:s3:::{MANIFEST_BUCKET}',
+            'Prefix': MANIFEST_PREFIX + 'reports',
+            'Format': 'Report_CSV_20180820',
+            'Enabled': True,
+            'ReportScope': 'FailedTasksOnly'
+        },
+        Priority=10,
+        RoleArn=BATCH_ROLE_ARN,
+        ClientRequestToken=str(uuid.uuid4()),
+        Description=f'Archive {BUCKET_NAME} objects to {GLACIER_CLASS}'
+    )
+    return response['JobId']
+
+def archive_from_inventory(s3, event, context, cutoff_date, report):
+    """
+    Build a Batch Operations manifest from the latest S3 Inventory and submit a single copy job.
+    Objects over 5 GB, which Batch Operations cannot copy, are transitioned here with multipart copy.
+    """
+    manifest_key = event.get('inventory_manifest') or latest_inventory_manifest(s3)
+    manifest = json.loads(s3.get_object(Bucket=INVENTORY_BUCKET, Key=manifest_key)['Body'].read())
+    print(f"Reading inventory s3://{INVENTORY_BUCKET}/{manifest_key} ({len(manifest['files'])} data files)")
+
+    job_manifest_key = f"{MANIFEST_PREFIX}manifests/{datetime.now(timezone.utc):%Y-%m-%dT%H-%M-%SZ}.csv"
+    writer = ManifestWriter(s3, MANIFEST_BUCKET, job_manifest_key)
+    large_objects = []
+    candidate_bytes = 0
+    try:
+        for row in inventory_candidates(read_inventory_rows(s3, manifest), cutoff_date):
+            size = int(row.get('Size') or 0)
+            candidate_bytes += size
+            if size > MAX_COPY_SIZE:
+                large_objects.append((row['Key'], size))
+            else:
+                writer.add(row['Bucket'], row['EncodedKey'])
+        etag = writer.close()
+    except Exception:
+        writer.abort()
+        raise
+
+    job_id = None
+    if etag:
+        account_id = context.invoked_function_arn.split(':')[4] if context \
+            else client('sts').get_caller_identity()['Account']
+        job_id = submit_batch_job(job_manifest_key, etag, account_id)
+        print(f"Submitted Batch Operations job {job_id} for {writer.rows} objects")
+
+    archived_bytes = archive_objects(s3, large_objects, report)
+    return {
+        'batch_job_id': job_id,
+        'batch_manifest': f's3://{MANIFEST_BUCKET}/{job_manifest_key}' if etag else None,
+        'batch_object_count': writer.rows,
+        'candidate_bytes': candidate_bytes,
+        'archived_bytes': archived_bytes
+    }
+
+@instrumented
 def lambda_handler(event, context):
-    s3 = boto3.client('s3')
+    s3 = client('s3', max_pool_connections=MAX_WORKERS + PART_WORKERS)
     now = datetime.now(timezone.utc)
     cutoff_date = now - timedelta(days=AGE_DAYS)
-    archived = []
-
-    paginator = s3.get_paginator('list_objects_v2')
-    for page in paginator.paginate(Bucket=BUCKET_NAME):
-        for obj in page.get('Contents', []):
-            key = obj['Key']
-            last_modified = obj['LastModified']
-            storage_class = obj.get('StorageClass', 'STANDARD')
-
-            # If object is older than cutoff and not already Glacier
-            if last_modified < cutoff_date and storage_class not in ['GLACIER', 'DEEP_ARCHIVE']:
-                s3.copy_object(
-                    Bucket=BUCKET_NAME,
-                    Key=key,
-                    CopySource={'Bucket': BUCKET_NAME, 'Key': key},
-                    StorageClass=GLACIER_CLASS,
-                    MetadataDirective='COPY'
-                )
-                archived.append(key)
-
-    return {'archived_files': archived}
+    started = time.monotonic()
+    report = ResultSink(REPORT_BUCKET, REPORT_PREFIX)
+
+    try:
+        if event.get('mode', ARCHIVE_MODE) == 'inventory':
+            result = archive_from_inventory(s3, event, context, cutoff_date, report)
+        else:
+            archived_bytes = archive_listed(s3, cutoff_date, report)
+            elapsed = time.monotonic() - started
+            result = {
+                'archived_bytes': archived_bytes,
+                'bytes_per_second': round(archived_bytes / elapsed) if elapsed else 0
+            }
+    except Exception:
+        report.abort()
+        raise
+
+    return {
+        'archived_count': report.counts.get('archived', 0),
+        'error_count': report.counts.get('error', 0),
+        **result,
+        **report.close()
+    }
@@ -0,0 +1,160 @@
+"""
+Startup benchmark for every handler: import time, first-invocation latency and warm latency.
+
+Each handler is measured in fresh interpreters, the way Lambda starts a new execution
+environment. Import time is measured without moto loaded, so it reflects only what the
+handler itself imports; invocations run against a local AWS stand-in (moto) with an empty
+event, so they mostly measure client construction and the first API round trips. Handlers
+that act on a bucket or on snapshots get a few of them seeded first (SEEDS), so their first
+call does its real work instead of failing fast on a missing resource.
+To compare two revisions, check the older one out with `git worktree add` and pass it as --root.
+
+    pip install boto3 moto numpy
+    python benchmarks/cold_start.py --repeat 5
+    python benchmarks/cold_start.py --root /tmp/before --json before.json
+"""
+import argparse
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import textwrap
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+ENV = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:123456789012:bench',
+    'REINVOKE': 'false',
+}
+
+# Setup run inside the moto mock before the handler is imported: creates what the handler acts on
+# and sets the environment variables pointing at it
+SEED_OBJECTS = """
+import os, boto3
+s3 = boto3.client('s3')
+s3.create_bucket(Bucket='cold-start')
+for i in range(20):
+    s3.put_object(Bucket='cold-start', Key=f'{prefix}{{i:03d}}.log', Body=b'x')
+os.environ.update(BUCKET_NAME='cold-start', {age_setting}='-1')
+"""
+
+SEEDS = {
+    'assignment-2': SEED_OBJECTS.format(prefix='', age_setting='DAYS_TO_KEEP'),
+    'assignment-9': SEED_OBJECTS.format(prefix='', age_setting='AGE_DAY'),
+    'assignment-15': SEED_OBJECTS.format(prefix='logs/', age_setting='DAYS_THRESHOLD'),
+    'assignment-17': """
+import os, boto3
+ec2 = boto3.client('ec2')
+vpc_id = ec2.create_vpc(CidrBlock='10.0.0.0/16')['Vpc']['VpcId']
+subnet_id = ec2.create_subnet(VpcId=vpc_id, CidrBlock='10.0.0.0/24')['Subnet']['SubnetId']
+ec2.create_key_pair(KeyName='sagar-key')
+volume_id = ec2.create_volume(Size=8, AvailabilityZone='us-east-1a')['VolumeId']
+ec2.create_snapshot(VolumeId=volume_id, TagSpecifications=[
+    {'ResourceType': 'snapshot', 'Tags': [{'Key': 'Backup', 'Value': 'True'}, {'Key': 'USER', 'Value': 'Sagar'}]}
+])
+os.environ.update(SUBNET_ID=subnet_id, IMAGE_ID=ec2.describe_images()['Images'][0]['ImageId'])
+""",
+}
+
+IMPORT_PROBE = """
+import sys, time
+sys.path[:0] = [{handler_dir!r}, {root!r}]
+start = time.perf_counter()
+import app
+print((time.perf_counter() - start) * 1000)
+"""
+
+INVOKE_PROBE = """
+import sys, time, json
+from moto import mock_aws
+sys.path[:0] = [{handler_dir!r}, {root!r}]
+
+class Context:
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:123456789012:function:bench'
+    def get_remaining_time_in_millis(self):
+        return 900000
+
+def invoke(handler):
+    start = time.perf_counter()
+    try:
+        handler({{}}, Context())
+        error = None
+    except Exception as e:
+        error = type(e).__name__
+    return (time.perf_counter() - start) * 1000, error
+
+with mock_aws():
+{seed}
+    import app
+    first, error = invoke(app.lambda_handler)
+    warm, _ = invoke(app.lambda_handler)
+print(json.dumps({{'first_ms': first, 'warm_ms': warm, 'error': error}}))
+"""
+
+
+def run(code, timeout):
+    env = dict(os.environ, **ENV)
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=env, timeout=timeout)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed')
+    return result.stdout.strip().splitlines()[-1]
+
+
+def measure(root, handler_dir, repeat, timeout):
+    params = {'handler_dir': str(handler_dir), 'root': str(root)}
+    seed = textwrap.indent(SEEDS.get(handler_dir.name, 'pass').strip(), '    ')
+    imports, firsts, warms, error = [], [], [], None
+    for _ in range(repeat):
+        imports.append(float(run(IMPORT_PROBE.format(**params), timeout)))
+        invoked = json.loads(run(INVOKE_PROBE.format(seed=seed, **params), timeout))
+        firsts.append(invoked['first_ms'])
+        warms.append(invoked['warm_ms'])
+        error = invoked['error']
+    return {
+        'import_ms': round(statistics.median(imports), 1),
+        'first_call_ms': round(statistics.median(firsts), 1),
+        'warm_call_ms': round(statistics.median(warms), 1),
+        'handler_error': error,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--root', type=pathlib.Path, default=ROOT, help='Repository checkout to measure')
+    parser.add_argument('--repeat', type=int, default=3, help='Fresh interpreters per handler (median is reported)')
+    parser.add_argument('--only', nargs='*', help='Assignment directories to measure, e.g. assignment-2')
+    parser.add_argument('--timeout', type=int, default=300)
+    parser.add_argument('--json', type=pathlib.Path, help='Also write the results to this file')
+    args = parser.parse_args()
+
+    root = args.root.resolve()
+    handlers = sorted(
+        (path.parent for path in root.glob('assignment-*/app.py')),
+        key=lambda path: int(path.name.split('-')[1])
+    )
+    if args.only:
+        handlers = [path for path in handlers if path.name in args.only]
+
+    results = {}
+    print(f"{'handler':<15} {'import ms':>10} {'first call ms':>14} {'warm call ms':>13}  handler error")
+    for handler_dir in handlers:
+        try:
+            results[handler_dir.name] = measure(root, handler_dir, args.repeat, args.timeout)
+        except (RuntimeError, subprocess.TimeoutExpired) as e:
+            print(f"{handler_dir.name:<15} failed: {e}")
+            continue
+        r = results[handler_dir.name]
+        print(f"{handler_dir.name:<15} {r['import_ms']:>10.1f} {r['first_call_ms']:>14.1f} "
+              f"{r['warm_call_ms']:>13.1f}  {r['handler_error'] or ''}")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
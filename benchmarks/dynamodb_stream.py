@@ -0,0 +1,144 @@
+"""
+Benchmark for the assignment-7 DynamoDB stream alerter: replays a synthetic stream batch.
+
+Builds a batch of MODIFY records (nested M/L/N/SS attributes, several writes per item)
+and compares the original one-alert-per-record handler with the current one, which
+coalesces, diffs and batches its alerts. SNS runs against a local stand-in (moto) and both
+the API calls and the messages they carry are counted.
+
+    pip install boto3 "moto[sns]"
+    python benchmarks/dynamodb_stream.py --records 10000 --items 500
+"""
+import argparse
+import importlib.util
+import json
+import os
+import pathlib
+import random
+import sys
+import time
+
+import boto3
+from moto import mock_aws
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))  # Handlers import the shared package from the repository root
+import shared  # noqa: E402
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+
+def item_image(item_id, version, rng):
+    return {
+        'pk': {'S': f'item-{item_id}'},
+        'price': {'N': str(rng.randint(1, 500))},
+        'stock': {'N': str(version)},
+        'tags': {'SS': ['a', 'b', f'v{version % 3}']},
+        'dimensions': {'M': {'w': {'N': '10'}, 'h': {'N': '20'}, 'unit': {'S': 'cm'}}},
+        'history': {'L': [{'N': str(v)} for v in range(version % 5)]},
+        'description': {'S': 'x' * 200},
+    }
+
+
+def build_batch(records, items, seed=11):
+    rng = random.Random(seed)
+    versions = [0] * items
+    batch = []
+    for seq in range(records):
+        item_id = rng.randrange(items)
+        old = item_image(item_id, versions[item_id], random.Random(item_id))
+        versions[item_id] += 1
+        new = item_image(item_id, versions[item_id], random.Random(item_id))
+        batch.append({
+            'eventName': 'MODIFY',
+            'dynamodb': {
+                'Keys': {'pk': {'S': f'item-{item_id}'}},
+                'OldImage': old,
+                'NewImage': new,
+                'SequenceNumber': f'{seq:021d}',
+            },
+        })
+    return {'Records': batch}
+
+
+def legacy_handler(sns, topic_arn):
+    """The handler before this change: one full-image alert per record."""
+    def handler(event, context):
+        for record in event.get('Records', []):
+            if record['eventName'] == 'MODIFY':
+                old_image = record['dynamodb'].get('OldImage', {})
+                new_image = record['dynamodb'].get('NewImage', {})
+
+                def ddb_to_dict(image):
+                    return {k: list(v.values())[0] for k, v in image.items()}
+
+                old = ddb_to_dict(old_image)
+                new = ddb_to_dict(new_image)
+                message = (
+                    f"DynamoDB item updated:\n\n"
+                    f"Old values: {json.dumps(old, indent=2)}\n\n"
+                    f"New values: {json.dumps(new, indent=2)}"
+                )
+                sns.publish(TopicArn=topic_arn, Subject="DynamoDB Item Updated", Message=message)
+        return {"status": "done"}
+    return handler
+
+
+def load_app():
+    spec = importlib.util.spec_from_file_location('stream_app', ROOT / 'assignment-7' / 'app.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def count_publishes(client):
+    counter = {'publish': 0, 'messages': 0}
+
+    def count(params, **kwargs):
+        counter['publish'] += 1
+        counter['messages'] += 1
+    def count_batch(params, **kwargs):
+        counter['publish'] += 1
+        counter['messages'] += len([k for k in params['body'] if k.endswith('.Message')])
+    client.meta.events.register('before-call.sns.Publish', count)
+    client.meta.events.register('before-call.sns.PublishBatch', count_batch)
+    return counter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--items', type=int, default=500)
+    args = parser.parse_args()
+
+    event = build_batch(args.records, args.items)
+
+    with mock_aws():
+        topic_arn = boto3.client('sns').create_topic(Name='bench-stream')['TopicArn']
+        os.environ['SNS_TOPIC_ARN'] = topic_arn
+        app = load_app()
+        app.print = lambda *a, **k: None  # Keep per-alert logging out of the timing
+
+        legacy_sns = boto3.client('sns')
+        legacy_counter = count_publishes(legacy_sns)
+        start = time.perf_counter()
+        legacy_handler(legacy_sns, topic_arn)(event, None)
+        legacy_time = time.perf_counter() - start
+
+        counter = count_publishes(shared.client('sns'))
+        start = time.perf_counter()
+        result = app.lambda_handler(event, None)
+        new_time = time.perf_counter() - start
+
+    print(f"records:          {args.records} over {args.items} items")
+    print(f"legacy handler:   {legacy_time:7.2f} s, {legacy_counter['publish']} API calls, "
+          f"{legacy_counter['messages']} messages")
+    print(f"current handler:  {new_time:7.2f} s, {counter['publish']} API calls, {counter['messages']} messages, "
+          f"{len(result['batchItemFailures'])} failures")
+    print(f"records/s:        {args.records / legacy_time:,.0f} -> {args.records / new_time:,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,469 @@
+"""
+Offline benchmark suite: drives every handler against synthetic AWS state at chosen sizes.
+
+Each (handler, size) pair runs in a fresh interpreter: a local AWS stand-in (moto) is filled
+with synthetic state (objects, instances, snapshots, target groups, stream records, ...),
+the handler is imported with matching environment variables and invoked once with a fake
+Lambda context. Wall time, peak RSS during the invocation and AWS API calls by operation
+are recorded and written to a JSON report; pass an earlier report to --compare to see what
+changed between versions, and --root to measure another checkout.
+
+moto does not emulate CloudWatch metric math (SEARCH, FILL, IF) or Comprehend's batch APIs,
+so assignment-6, assignment-8 and assignment-10 get those calls from a botocore Stubber on the
+shared client the handler will use, with synthetic responses queued for every call it makes;
+their other calls (S3 state, SNS, ELB discovery) still go to moto.
+
+    pip install boto3 moto numpy
+    python benchmarks/harness.py --sizes 1000 10000 --output report.json
+    python benchmarks/harness.py --only assignment-2 assignment-15 --sizes 100000 --compare report.json
+"""
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import pathlib
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+BASE_ENV = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'REINVOKE': 'false',
+}
+
+SCENARIOS = {}
+
+
+def scenario(handler, default_size, description):
+    """Register setup(size) -> (env, event) for a handler; setup runs inside the moto mock."""
+    def register(setup):
+        SCENARIOS[handler] = {'setup': setup, 'default_size': default_size, 'description': description}
+        return setup
+    return register
+
+
+def boto3_client(service):
+    import boto3
+    return boto3.client(service, region_name='us-east-1')
+
+
+def fill_bucket(s3, bucket, count, prefix=''):
+    s3.create_bucket(Bucket=bucket)
+    for i in range(count):
+        s3.put_object(Bucket=bucket, Key=f'{prefix}{i:09d}.log', Body=b'x')
+
+
+def stub_responses(service, operation, responses, region_name=None):
+    """
+    Queue canned responses on the shared client the handler will get from shared.client(), for
+    calls moto cannot answer. Returns the active Stubber.
+    """
+    from botocore.stub import Stubber
+    from shared import client
+    stubber = Stubber(client(service, region_name=region_name))
+    for response in responses:
+        stubber.add_response(operation, response)
+    stubber.activate()
+    return stubber
+
+
+def sns_topic():
+    return boto3_client('sns').create_topic(Name='bench-alerts')['TopicArn']
+
+
+def launch(ec2, count, tags):
+    """Launch count instances (in chunks) with the given tags; returns their IDs."""
+    image_id = ec2.describe_images()['Images'][0]['ImageId']
+    instance_ids = []
+    for i in range(0, count, 500):
+        response = ec2.run_instances(
+            ImageId=image_id, MinCount=min(500, count - i), MaxCount=min(500, count - i),
+            TagSpecifications=[{'ResourceType': 'instance', 'Tags': [{'Key': k, 'Value': v} for k, v in tags.items()]}]
+        )
+        instance_ids += [instance['InstanceId'] for instance in response['Instances']]
+    return instance_ids
+
+
+@scenario('assignment-1', 200, 'instances tagged Auto-Stop/Auto-Start')
+def setup_scheduler(size):
+    ec2 = boto3_client('ec2')
+    launch(ec2, size - size // 2, {'Action': 'Auto-Stop', 'USER': 'Sagar'})
+    to_start = launch(ec2, size // 2, {'Action': 'Auto-Start', 'USER': 'Sagar'})
+    for i in range(0, len(to_start), 500):
+        ec2.stop_instances(InstanceIds=to_start[i:i + 500])
+    return {'REGIONS': 'us-east-1'}, {}
+
+
+@scenario('assignment-2', 1000, 'expired objects in one bucket')
+def setup_cleanup(size):
+    s3 = boto3_client('s3')
+    fill_bucket(s3, 'bench-cleanup', size)
+    s3.create_bucket(Bucket='bench-cleanup-reports')
+    return {'BUCKET_NAME': 'bench-cleanup', 'DAYS_TO_KEEP': '-1', 'REPORT_BUCKET': 'bench-cleanup-reports'}, {}
+
+
+@scenario('assignment-3', 100, 'buckets, half of them with default encryption')
+def setup_encryption_scan(size):
+    s3 = boto3_client('s3')
+    for i in range(size):
+        s3.create_bucket(Bucket=f'bench-enc-{i:06d}')
+        if i % 2:
+            s3.put_bucket_encryption(
+                Bucket=f'bench-enc-{i:06d}',
+                ServerSideEncryptionConfiguration={'Rules': [{'ApplyServerSideEncryptionByDefault': {'SSEAlgorithm': 'AES256'}}]}
+            )
+    return {}, {}
+
+
+@scenario('assignment-4', 100, 'tagged volumes with two old snapshots each')
+def setup_snapshots(size):
+    ec2 = boto3_client('ec2')
+    for _ in range(size):
+        volume_id = ec2.create_volume(
+            Size=8, AvailabilityZone='us-east-1a',
+            TagSpecifications=[{'ResourceType': 'volume', 'Tags': [{'Key': 'Backup', 'Value': 'True'}]}]
+        )['VolumeId']
+        for _ in range(2):
+            ec2.create_snapshot(VolumeId=volume_id)
+    return {'VOLUME_TAG_KEY': 'Backup', 'RETENTION_DAYS': '0'}, {}
+
+
+@scenario('assignment-5', 200, 'SQS batch of launch events for USER-tagged instances')
+def setup_tagger(size):
+    instance_ids = launch(boto3_client('ec2'), size, {'USER': 'Sagar'})
+    records = [
+        {
+            'messageId': f'msg-{i}',
+            'body': json.dumps({
+                'time': '2026-01-01T00:00:00Z',
+                'detail': {'instance-id': instance_id, 'state': 'running'}
+            })
+        }
+        for i, instance_id in enumerate(instance_ids)
+    ]
+    return {}, {'Records': records}
+
+
+@scenario('assignment-6', 50, 'services with 35 days of EstimatedCharges (CloudWatch stubbed)')
+def setup_billing(size):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    days = [(now - datetime.timedelta(days=d)).replace(hour=0, minute=0, second=0, microsecond=0)
+            for d in range(35, -1, -1)]
+
+    def result(query_id, label, rate):
+        # EstimatedCharges is month-to-date, so it restarts on the first of each month
+        return {'Id': query_id, 'Label': label, 'StatusCode': 'Complete',
+                'Timestamps': days, 'Values': [rate * day.day for day in days]}
+
+    results = [result('total', 'Total', 0.5 * size)]
+    results += [result('services', f'Service{i:04d}', 0.5) for i in range(size)]
+    stub_responses('cloudwatch', 'get_metric_data', [{'MetricDataResults': results}], region_name='us-east-1')
+    boto3_client('s3').create_bucket(Bucket='bench-billing-state')
+    env = {
+        'SNS_TOPIC_ARN': sns_topic(), 'BILLING_REGION': 'us-east-1',
+        'STATE_BUCKET': 'bench-billing-state', 'BILLING_THRESHOLD': '1'
+    }
+    return env, {}
+
+
+@scenario('assignment-7', 2000, 'DynamoDB stream records over size/10 items')
+def setup_stream(size):
+    sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+    from dynamodb_stream import build_batch
+    return {'SNS_TOPIC_ARN': sns_topic()}, build_batch(size, max(1, size // 10))
+
+
+@scenario('assignment-8', 1000, 'SQS batch of reviews, half of them repeats (Comprehend stubbed)')
+def setup_sentiment(size):
+    # A whole number of 25-text batches, so every stubbed response fits whichever batch gets it
+    unique = max(25, size // 2 // 25 * 25)
+    batch = {
+        'ResultList': [
+            {'Index': i, 'Sentiment': 'POSITIVE',
+             'SentimentScore': {'Positive': 0.9, 'Negative': 0.05, 'Neutral': 0.04, 'Mixed': 0.01}}
+            for i in range(25)
+        ],
+        'ErrorList': []
+    }
+    stub_responses('comprehend', 'batch_detect_sentiment', [batch] * (unique // 25))
+    records = [
+        {'eventSource': 'aws:sqs', 'messageId': f'msg-{i}',
+         'body': json.dumps({'review': f'Review number {i % unique}: works as described.'})}
+        for i in range(size)
+    ]
+    return {'LANGUAGE_CODE': 'en'}, {'Records': records}
+
+
+@scenario('assignment-9', 1000, 'objects older than the archive age')
+def setup_archiver(size):
+    fill_bucket(boto3_client('s3'), 'bench-archive', size)
+    return {'BUCKET_NAME': 'bench-archive', 'AGE_DAY': '-1'}, {}
+
+
+@scenario('assignment-10', 100, 'application load balancers, every tenth one spiking (CloudWatch stubbed)')
+def setup_elb_5xx(size):
+    ec2 = boto3_client('ec2')
+    elbv2 = boto3_client('elbv2')
+    vpc_id = ec2.create_vpc(CidrBlock='10.0.0.0/16')['Vpc']['VpcId']
+    subnets = [
+        ec2.create_subnet(VpcId=vpc_id, CidrBlock=f'10.0.{i}.0/24', AvailabilityZone=f'us-east-1{zone}')['Subnet']['SubnetId']
+        for i, zone in enumerate('ab')
+    ]
+    for i in range(size):
+        elbv2.create_load_balancer(Name=f'bench-lb-{i}', Subnets=subnets, Type='application')
+
+    # One get_metric_data call per 500 queries; each load balancer takes 6 (3 metrics, 3 expressions)
+    per_call = 500 // 6
+    now = datetime.datetime.now(datetime.timezone.utc)
+    responses = []
+    for first in range(0, size, per_call):
+        results = []
+        for index in range(first, min(size, first + per_call)):
+            errors, requests = (50.0, 200.0) if index % 10 == 0 else (1.0, 1000.0)
+            for suffix, value in (('e', errors), ('n', requests), ('p', 100 * errors / requests)):
+                results.append({'Id': f'q{index}{suffix}', 'StatusCode': 'Complete', 'Timestamps': [now], 'Values': [value]})
+        responses.append({'MetricDataResults': results})
+    stub_responses('cloudwatch', 'get_metric_data', responses)
+    return {'SNS_TOPIC_ARN': sns_topic(), 'INCLUDE_TARGET_GROUPS': 'false'}, {}
+
+
+@scenario('assignment-13', 100, 'buckets, every tenth one with a public read policy')
+def setup_public_audit(size):
+    s3 = boto3_client('s3')
+    for i in range(size):
+        name = f'bench-audit-{i:06d}'
+        s3.create_bucket(Bucket=name)
+        if i % 10 == 0:
+            s3.put_bucket_policy(Bucket=name, Policy=json.dumps({
+                'Version': '2012-10-17',
+                'Statement': [{'Effect': 'Allow', 'Principal': '*', 'Action': 's3:GetObject',
+                               'Resource': f'arn:aws:s3:::{name}/*'}]
+            }))
+    return {'SNS_TOPIC_ARN': sns_topic()}, {}
+
+
+@scenario('assignment-15', 1000, 'expired log objects under logs/')
+def setup_log_cleaner(size):
+    fill_bucket(boto3_client('s3'), 'bench-logs', size, prefix='logs/')
+    return {'BUCKET_NAME': 'bench-logs', 'DAYS_THRESHOLD': '-1'}, {}
+
+
+@scenario('assignment-17', 20, 'source volumes with three tagged snapshots each (fleet restore)')
+def setup_restore(size):
+    ec2 = boto3_client('ec2')
+    vpc_id = ec2.create_vpc(CidrBlock='10.0.0.0/16')['Vpc']['VpcId']
+    subnet_id = ec2.create_subnet(VpcId=vpc_id, CidrBlock='10.0.0.0/24')['Subnet']['SubnetId']
+    ec2.create_key_pair(KeyName='sagar-key')
+    tags = [{'Key': 'Backup', 'Value': 'True'}, {'Key': 'USER', 'Value': 'Sagar'}]
+    for _ in range(size):
+        volume_id = ec2.create_volume(Size=8, AvailabilityZone='us-east-1a')['VolumeId']
+        for _ in range(3):
+            ec2.create_snapshot(VolumeId=volume_id, TagSpecifications=[{'ResourceType': 'snapshot', 'Tags': tags}])
+    boto3_client('s3').create_bucket(Bucket='bench-restore-state')
+    env = {
+        'SUBNET_ID': subnet_id,
+        'IMAGE_ID': ec2.describe_images()['Images'][0]['ImageId'],
+        'STATE_BUCKET': 'bench-restore-state',
+        'POLL_SECONDS': '0',
+    }
+    return env, {'mode': 'fleet'}
+
+
+@scenario('assignment-19', 200, 'target groups')
+def setup_target_health(size):
+    ec2 = boto3_client('ec2')
+    elbv2 = boto3_client('elbv2')
+    vpc_id = ec2.create_vpc(CidrBlock='10.0.0.0/16')['Vpc']['VpcId']
+    for i in range(size):
+        elbv2.create_target_group(Name=f'bench-tg-{i}', Protocol='HTTP', Port=80, VpcId=vpc_id)
+    boto3_client('s3').create_bucket(Bucket='bench-health-state')
+    return {'SNS_TOPIC_ARN': sns_topic(), 'STATE_BUCKET': 'bench-health-state'}, {}
+
+
+class FakeContext:
+    """The parts of the Lambda context object the handlers use."""
+
+    def __init__(self, handler, timeout_seconds=900):
+        self.function_name = f'bench-{handler}'
+        self.invoked_function_arn = f'arn:aws:lambda:us-east-1:123456789012:function:bench-{handler}'
+        self.aws_request_id = 'bench-request'
+        self.memory_limit_in_mb = 1024
+        self._deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+class ApiCallCounter:
+    """Counts AWS API calls by service.Operation while enabled, for every client in the process."""
+
+    def __init__(self):
+        self.counts = {}
+        self.enabled = False
+        self._lock = threading.Lock()
+
+    def install(self):
+        from botocore.client import BaseClient
+        original = BaseClient._make_api_call
+        counter = self
+
+        def counted(client, operation_name, api_params):
+            if counter.enabled:
+                name = f"{client.meta.service_model.service_name}.{operation_name}"
+                with counter._lock:
+                    counter.counts[name] = counter.counts.get(name, 0) + 1
+            return original(client, operation_name, api_params)
+        BaseClient._make_api_call = counted
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak RSS counter (Linux); returns False where that is not possible."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb(resettable):
+    if resettable:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    # Peak for the whole process, including setup
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_child(root, handler, size):
+    """Run one scenario in this process and print its result as JSON."""
+    from moto import mock_aws
+
+    os.environ.update(BASE_ENV)
+    sys.path[:0] = [str(root / handler), str(root)]
+    counter = ApiCallCounter()
+    counter.install()
+
+    with mock_aws():
+        started = time.perf_counter()
+        env, event = SCENARIOS[handler]['setup'](size)
+        setup_seconds = time.perf_counter() - started
+        os.environ.update(env)
+
+        spec = importlib.util.spec_from_file_location('app', root / handler / 'app.py')
+        app = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(app)
+        app.print = lambda *args, **kwargs: None  # Per-item logging would dominate the timing
+
+        resettable = reset_peak_rss()
+        counter.enabled = True
+        error = None
+        started = time.perf_counter()
+        try:
+            app.lambda_handler(event, FakeContext(handler))
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        wall_seconds = time.perf_counter() - started
+        counter.enabled = False
+
+    print(json.dumps({
+        'handler': handler,
+        'scenario': SCENARIOS[handler]['description'],
+        'size': size,
+        'wall_seconds': round(wall_seconds, 4),
+        'setup_seconds': round(setup_seconds, 2),
+        'peak_rss_mb': round(peak_rss_mb(resettable), 1),
+        'peak_rss_includes_setup': not resettable,
+        'api_calls_total': sum(counter.counts.values()),
+        'api_calls': dict(sorted(counter.counts.items())),
+        'error': error,
+    }))
+
+
+def git_revision(root):
+    try:
+        return subprocess.run(['git', '-C', str(root), 'rev-parse', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    baseline = {(r['handler'], r['size']): r for r in json.loads(baseline_path.read_text())['results']}
+    print(f"\nCompared with {baseline_path}:")
+    print(f"{'handler':<15} {'size':>8} {'wall s':>18} {'API calls':>16} {'peak RSS MB':>18}")
+    for r in results:
+        old = baseline.get((r['handler'], r['size']))
+        if old is None:
+            continue
+        print(f"{r['handler']:<15} {r['size']:>8} "
+              f"{old['wall_seconds']:>8.2f} -> {r['wall_seconds']:<6.2f} "
+              f"{old['api_calls_total']:>6} -> {r['api_calls_total']:<6} "
+              f"{old['peak_rss_mb']:>7.1f} -> {r['peak_rss_mb']:<7.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--root', type=pathlib.Path, default=ROOT, help='Repository checkout to measure')
+    parser.add_argument('--only', nargs='*', help='Handlers to run, e.g. assignment-2 assignment-19')
+    parser.add_argument('--sizes', nargs='*', type=int, help="Sizes to run (default: each scenario's own size)")
+    parser.add_argument('--output', type=pathlib.Path, default=pathlib.Path('benchmark-report.json'))
+    parser.add_argument('--compare', type=pathlib.Path, help='Earlier report to compare against')
+    parser.add_argument('--timeout', type=int, default=3600, help='Seconds allowed per scenario')
+    parser.add_argument('--child', nargs=2, metavar=('HANDLER', 'SIZE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    root = args.root.resolve()
+
+    if args.child:
+        run_child(root, args.child[0], int(args.child[1]))
+        return
+
+    handlers = [h for h in SCENARIOS if not args.only or h in args.only]
+    results = []
+    print(f"{'handler':<15} {'size':>8} {'wall s':>9} {'API calls':>10} {'peak RSS MB':>12}  error")
+    for handler in handlers:
+        for size in args.sizes or [SCENARIOS[handler]['default_size']]:
+            try:
+                child = subprocess.run(
+                    [sys.executable, __file__, '--root', str(root), '--child', handler, str(size)],
+                    capture_output=True, text=True, timeout=args.timeout
+                )
+            except subprocess.TimeoutExpired:
+                print(f"{handler:<15} {size:>8} timed out after {args.timeout} s")
+                continue
+            if child.returncode != 0:
+                last = child.stderr.strip().splitlines()[-1] if child.stderr.strip() else 'failed'
+                print(f"{handler:<15} {size:>8} failed: {last}")
+                continue
+            r = json.loads(child.stdout.strip().splitlines()[-1])
+            results.append(r)
+            print(f"{handler:<15} {size:>8} {r['wall_seconds']:>9.2f} {r['api_calls_total']:>10} "
+                  f"{r['peak_rss_mb']:>12.1f}  {r['error'] or ''}")
+
+    report = {
+        'generated_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'git_revision': git_revision(root),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    args.output.write_text(json.dumps(report, indent=2))
+    print(f"\nReport written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
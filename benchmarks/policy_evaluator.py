@@ -0,0 +1,141 @@
+"""
+Micro-benchmark for the compiled bucket policy evaluator in assignment-13/app.py.
+
+Builds a synthetic corpus of bucket policies from a handful of templates (as an organization
+would: same statements, different bucket names in Resource), as the JSON text
+get_bucket_policy returns, and times the original parse-and-check against the compiled,
+cached evaluator at its default POLICY_CACHE_SIZE: once for a first audit and once for a
+re-audit of the same buckets. It then repeats the first audit on a corpus where every
+policy is distinct (a per-bucket Sid), the worst case for the cache: every bucket is parsed
+and compiled, which is slower than the original check.
+
+The two evaluators disagree on purpose, so their public counts differ. The original ignores
+Conditions (org- and VPC-endpoint-only policies count as public), exact-matches actions
+(s3:Get* is missed) and does not look at NotPrincipal. The per-template verdicts are printed.
+
+    pip install boto3
+    python benchmarks/policy_evaluator.py --policies 50000
+"""
+import argparse
+import importlib.util
+import json
+import pathlib
+import random
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))  # Handlers import the shared package from the repository root
+
+TEMPLATES = [
+    # Public website bucket
+    [{'Effect': 'Allow', 'Principal': '*', 'Action': 's3:GetObject', 'Resource': 'arn:aws:s3:::{bucket}/*'}],
+    # Wildcard read for everyone
+    [{'Effect': 'Allow', 'Principal': {'AWS': '*'}, 'Action': ['s3:Get*', 's3:List*'],
+      'Resource': ['arn:aws:s3:::{bucket}', 'arn:aws:s3:::{bucket}/*']}],
+    # Organization-only access
+    [{'Effect': 'Allow', 'Principal': '*', 'Action': 's3:*', 'Resource': 'arn:aws:s3:::{bucket}/*',
+      'Condition': {'StringEquals': {'aws:PrincipalOrgID': 'o-abc123'}}}],
+    # VPC endpoint only
+    [{'Effect': 'Allow', 'Principal': '*', 'Action': ['s3:GetObject', 's3:PutObject'],
+      'Resource': 'arn:aws:s3:::{bucket}/*', 'Condition': {'StringEquals': {'aws:SourceVpce': 'vpce-1a2b3c'}}}],
+    # Enforce TLS only
+    [{'Effect': 'Deny', 'Principal': '*', 'Action': 's3:*', 'Resource': 'arn:aws:s3:::{bucket}/*',
+      'Condition': {'Bool': {'aws:SecureTransport': 'false'}}}],
+    # Everyone but one role, via NotPrincipal
+    [{'Effect': 'Allow', 'NotPrincipal': {'AWS': 'arn:aws:iam::123456789012:role/admin'},
+      'Action': 's3:GetObject', 'Resource': 'arn:aws:s3:::{bucket}/*'}],
+    # Cross-account replication role
+    [{'Effect': 'Allow', 'Principal': {'AWS': 'arn:aws:iam::210987654321:role/replication'},
+      'Action': ['s3:ReplicateObject', 's3:ReplicateDelete'], 'Resource': 'arn:aws:s3:::{bucket}/*'}],
+    # CloudFront origin access
+    [{'Sid': 'cf', 'Effect': 'Allow', 'Principal': {'Service': 'cloudfront.amazonaws.com'}, 'Action': 's3:GetObject',
+      'Resource': 'arn:aws:s3:::{bucket}/*',
+      'Condition': {'StringEquals': {'AWS:SourceArn': 'arn:aws:cloudfront::123456789012:distribution/E1'}}}],
+]
+
+
+def legacy_is_public_policy(policy):
+    """The evaluator before compilation, kept here as the baseline."""
+    if not policy:
+        return False
+    for stmt in policy.get('Statement', []):
+        effect = stmt.get('Effect', '')
+        principal = stmt.get('Principal')
+        if effect == 'Allow' and (principal == "*" or principal == {"AWS": "*"}) and \
+           any(perm in stmt.get('Action', []) for perm in ["s3:GetObject", "s3:PutObject", "s3:*"]):
+            return True
+    return False
+
+
+def build_corpus(count, distinct=False, seed=7):
+    """(template index, bucket name, policy text) triples; distinct gives every policy its own Sid."""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(count):
+        template = rng.choice(TEMPLATES)
+        bucket = f'org-bucket-{i:06d}'
+        statements = [
+            {k: (v.replace('{bucket}', bucket) if isinstance(v, str) else
+                 [x.replace('{bucket}', bucket) for x in v] if k == 'Resource' and isinstance(v, list) else v)
+             for k, v in stmt.items()}
+            for stmt in template
+        ]
+        if distinct:
+            statements = [{'Sid': f'stmt{i}', **stmt} for stmt in statements]
+        policy = json.dumps({'Version': '2012-10-17', 'Statement': statements})
+        corpus.append((TEMPLATES.index(template), bucket, policy))
+    return corpus
+
+
+def load_app():
+    spec = importlib.util.spec_from_file_location('audit_app', ROOT / 'assignment-13' / 'app.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def timed(fn, corpus):
+    start = time.perf_counter()
+    public = sum(1 for _, bucket, policy_str in corpus if fn(policy_str, bucket))
+    return time.perf_counter() - start, public
+
+
+def per_policy(seconds, corpus):
+    return f"{seconds * 1000:8.1f} ms  ({seconds / len(corpus) * 1e6:5.2f} us per policy)"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--policies', type=int, default=50000)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.policies)
+    app = load_app()
+
+    legacy_time, legacy_public = timed(lambda text, _: legacy_is_public_policy(json.loads(text)), corpus)
+    uncached_time, _ = timed(lambda text, _: bool(app.CompiledPolicy(json.loads(text)).public_actions), corpus)
+    first_time, compiled_public = timed(app.is_public_policy, corpus)
+    repeat_time, _ = timed(app.is_public_policy, corpus)
+    stats = dict(app.policy_cache_stats)
+
+    distinct = build_corpus(args.policies, distinct=True)
+    distinct_legacy_time, _ = timed(lambda text, _: legacy_is_public_policy(json.loads(text)), distinct)
+    distinct_first_time, _ = timed(app.is_public_policy, distinct)
+
+    print(f"policies:            {len(corpus)} from {len(TEMPLATES)} templates, POLICY_CACHE_SIZE {app.POLICY_CACHE_SIZE}")
+    print(f"legacy evaluator:    {per_policy(legacy_time, corpus)}  {legacy_public} public")
+    print(f"compile every time:  {per_policy(uncached_time, corpus)}")
+    print(f"cached, first audit: {per_policy(first_time, corpus)}  {compiled_public} public")
+    print(f"cached, re-audit:    {per_policy(repeat_time, corpus)}")
+    print(f"cache:               {stats['hits']} hits, {stats['misses']} compiled")
+    print(f"distinct policies:   legacy {per_policy(distinct_legacy_time, distinct)}")
+    print(f"                     first audit {per_policy(distinct_first_time, distinct)}"
+          f"  ({distinct_first_time / distinct_legacy_time:.1f}x the legacy time)")
+    for index, template in enumerate(TEMPLATES):
+        text = next(policy_str for i, _, policy_str in corpus if i == index)
+        print(f"  template {index}: legacy {'public' if legacy_is_public_policy(json.loads(text)) else 'private':7}"
+              f" compiled {'public' if app.is_public_policy(text) else 'private'}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark for the assignment-2 S3 cleanup Lambda against a local S3 stand-in (moto).
+
+Compares the old one-DeleteObject-per-key loop with the batched DeleteObjects engine
+in assignment-2/app.py and prints deletes per second for both.
+
+    pip install boto3 "moto[s3]"
+    python benchmarks/s3_cleanup.py --objects 20000
+"""
+import argparse
+import importlib.util
+import os
+import pathlib
+import sys
+import time
+
+import boto3
+from moto import mock_aws
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))  # Handlers import the shared package from the repository root
+BUCKET = 'bench-cleanup-bucket'
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+os.environ['BUCKET_NAME'] = BUCKET
+os.environ['DAYS_TO_KEEP'] = '-1'  # Every object counts as expired
+
+
+def load_handler():
+    spec = importlib.util.spec_from_file_location('cleanup_app', ROOT / 'assignment-2' / 'app.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def populate(s3, count):
+    s3.create_bucket(Bucket=BUCKET)
+    for i in range(count):
+        s3.put_object(Bucket=BUCKET, Key=f'data/{i:08d}.txt', Body=b'x')
+
+
+def serial_cleanup(s3):
+    """The pre-batching behaviour: one DeleteObject round trip per key."""
+    deleted = 0
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=BUCKET):
+        for obj in page.get('Contents', []):
+            s3.delete_object(Bucket=BUCKET, Key=obj['Key'])
+            deleted += 1
+    return deleted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--objects', type=int, default=5000)
+    args = parser.parse_args()
+
+    with mock_aws():
+        s3 = boto3.client('s3')
+
+        populate(s3, args.objects)
+        start = time.perf_counter()
+        deleted = serial_cleanup(s3)
+        serial_rate = deleted / (time.perf_counter() - start)
+
+        populate(s3, args.objects)
+        app = load_handler()
+        start = time.perf_counter()
+        result = app.lambda_handler({}, None)
+        batched_rate = result['body']['deleted_count'] / (time.perf_counter() - start)
+
+    print(f"objects:            {args.objects}")
+    print(f"serial deletes/s:   {serial_rate:,.0f}")
+    print(f"batched deletes/s:  {batched_rate:,.0f}  (status {result['statusCode']})")
+    print(f"speedup:            {batched_rate / serial_rate:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
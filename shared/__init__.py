@@ -0,0 +1,27 @@
+"""Helpers shared by the assignment handlers. Deploy this package next to a handler's app.py."""
+import importlib
+
+from .clients import client, lazy_import, on_client_created, reset, resource
+from .metrics import instrumented, phase
+from .throttle import limits
+
+# Imported on first use, so a handler only loads what it needs (the pipeline pulls in asyncio)
+_LAZY = {
+    'MultipartWriter': 'reports', 'Notifier': 'notify', 'ResultSink': 'reports', 'list_and_mutate': 's3_pipeline'
+}
+
+__all__ = [
+    'MultipartWriter', 'Notifier', 'ResultSink', 'client', 'instrumented', 'lazy_import', 'limits', 'list_and_mutate',
+    'on_client_created', 'phase', 'reset', 'resource'
+]
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{module}', __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
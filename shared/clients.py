@@ -0,0 +1,115 @@
+"""
+Cached boto3 clients shared by the handlers.
+
+Clients are created on first use and kept for the life of the execution environment, so
+warm invocations skip client construction and endpoint resolution. They are keyed by
+service, region and pool size. boto3 itself is only imported when the first client is
+requested.
+
+Tuning (environment variables):
+    CLIENT_MAX_POOL_CONNECTIONS  connections per client (default 50)
+    CLIENT_RETRY_MODE            botocore retry mode: legacy, standard or adaptive (default standard)
+    CLIENT_MAX_ATTEMPTS          attempts per call including the first (default 5)
+"""
+import importlib.util
+import os
+import sys
+import threading
+
+MAX_POOL_CONNECTIONS = int(os.environ.get('CLIENT_MAX_POOL_CONNECTIONS', 50))
+RETRY_MODE = os.environ.get('CLIENT_RETRY_MODE', 'standard')
+MAX_ATTEMPTS = int(os.environ.get('CLIENT_MAX_ATTEMPTS', 5))
+
+_session = None
+_clients = {}
+_resources = {}
+_client_hooks = []
+# boto3 sessions are not thread-safe while creating clients; handlers create them from worker threads
+_lock = threading.Lock()
+
+def _get_session():
+    global _session
+    if _session is None:
+        import boto3
+        _session = boto3.session.Session()
+    return _session
+
+def _config(max_pool_connections):
+    from botocore.config import Config
+    return Config(
+        max_pool_connections=max_pool_connections or MAX_POOL_CONNECTIONS,
+        retries={'mode': RETRY_MODE, 'max_attempts': MAX_ATTEMPTS}
+    )
+
+def client(service_name, region_name=None, max_pool_connections=None):
+    """
+    Return the cached client for a service and region (default: the function's region).
+    Pass max_pool_connections when a handler runs more concurrent calls than the default pool.
+    """
+    key = (service_name, region_name, max_pool_connections)
+    cached = _clients.get(key)
+    if cached is not None:
+        return cached
+    with _lock:
+        if key not in _clients:
+            _clients[key] = _get_session().client(
+                service_name, region_name=region_name, config=_config(max_pool_connections)
+            )
+            for hook in _client_hooks:
+                hook(_clients[key])
+        return _clients[key]
+
+def resource(service_name, region_name=None):
+    """Cached boto3 resource, for the handlers that use the resource API (e.g. DynamoDB tables)."""
+    key = (service_name, region_name)
+    cached = _resources.get(key)
+    if cached is not None:
+        return cached
+    with _lock:
+        if key not in _resources:
+            _resources[key] = _get_session().resource(
+                service_name, region_name=region_name, config=_config(None)
+            )
+            for hook in _client_hooks:
+                hook(_resources[key].meta.client)
+        return _resources[key]
+
+def on_client_created(hook):
+    """
+    Call hook(client) for every cached client, including the client behind each resource,
+    both the ones that already exist and the ones created later. Used to register botocore
+    event handlers without importing boto3 up front.
+    """
+    with _lock:
+        if hook in _client_hooks:
+            return
+        _client_hooks.append(hook)
+        for existing in _clients.values():
+            hook(existing)
+        for existing in _resources.values():
+            hook(existing.meta.client)
+
+def lazy_import(name):
+    """
+    Import a module on first attribute access instead of at import time, for heavy optional
+    dependencies such as numpy or pyarrow. A missing module still fails immediately.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+def reset():
+    """Drop every cached client, e.g. between benchmark runs or after changing credentials."""
+    global _session
+    with _lock:
+        _clients.clear()
+        _resources.clear()
+        _session = None
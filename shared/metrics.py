@@ -0,0 +1,232 @@
+"""
+Per-invocation AWS API metrics, written as one CloudWatch Embedded Metric Format (EMF) log line.
+
+Decorate a handler with @instrumented to record, for every operation it calls through the
+shared clients: calls, errors, latency, retries, throttled attempts, bytes sent and received,
+and the in-flight limit shared.throttle currently allows it. Steps inside the handler can be
+timed with `with phase('name'):`. When the invocation ends everything is printed as a single JSON line that CloudWatch Logs turns into
+metrics, so no put_metric_data calls are made.
+
+Metric names are "<service>.<Operation>.<stat>" (e.g. "s3.ListObjectsV2.Latency"),
+"Phase.<name>", "HandlerDuration" and "HandlerErrors", all with a FunctionName dimension.
+Latency is emitted as raw samples, so CloudWatch percentiles work; the per-operation
+latency histogram is included in the same line as the LatencyHistogram property.
+
+Settings (environment variables):
+    METRICS_ENABLED    set to false to make @instrumented a no-op (default true)
+    METRICS_NAMESPACE  CloudWatch namespace (default ServerlessAssignments)
+"""
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+from .clients import on_client_created
+from .throttle import is_throttle, limits
+
+ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'ServerlessAssignments')
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# EMF limits: values per metric and metric definitions per directive
+MAX_SAMPLES = 100
+MAX_METRICS = 100
+
+class _Operation:
+    __slots__ = ('calls', 'errors', 'retries', 'throttles', 'bytes_sent', 'bytes_received', 'latencies')
+
+    def __init__(self):
+        self.calls = self.errors = self.retries = self.throttles = 0
+        self.bytes_sent = self.bytes_received = 0
+        self.latencies = []
+
+class _Invocation:
+    """Totals for one handler invocation; updated from worker threads, hence the lock."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.phases = {}
+
+    def operation(self, name):
+        if name not in self.operations:
+            self.operations[name] = _Operation()
+        return self.operations[name]
+
+    def record_call(self, name, latency_ms, error, retries, sent, received):
+        with self.lock:
+            op = self.operation(name)
+            op.calls += 1
+            op.errors += int(error)
+            op.retries += retries
+            op.bytes_sent += sent
+            op.bytes_received += received
+            op.latencies.append(latency_ms)
+
+    def record_throttle(self, name):
+        with self.lock:
+            self.operation(name).throttles += 1
+
+    def record_phase(self, name, elapsed_ms):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0) + elapsed_ms
+
+    def emf(self, function_name, duration_ms, failed):
+        """The EMF document for this invocation."""
+        metrics = []
+        values = {}
+
+        def put(name, value, unit):
+            metrics.append({'Name': name, 'Unit': unit})
+            values[name] = value
+
+        histograms = {}
+        concurrency = limits()
+        for name, op in sorted(self.operations.items()):
+            put(f"{name}.Calls", op.calls, 'Count')
+            put(f"{name}.Errors", op.errors, 'Count')
+            put(f"{name}.Retries", op.retries, 'Count')
+            put(f"{name}.Throttles", op.throttles, 'Count')
+            put(f"{name}.BytesSent", op.bytes_sent, 'Bytes')
+            put(f"{name}.BytesReceived", op.bytes_received, 'Bytes')
+            put(f"{name}.Latency", _samples(op.latencies), 'Milliseconds')
+            if name in concurrency:
+                put(f"{name}.ConcurrencyLimit", concurrency[name]['limit'], 'Count')
+            histograms[name] = _histogram(op.latencies)
+        for name, elapsed in sorted(self.phases.items()):
+            put(f"Phase.{name}", round(elapsed, 3), 'Milliseconds')
+        put('HandlerDuration', round(duration_ms, 3), 'Milliseconds')
+        put('HandlerErrors', int(failed), 'Count')
+
+        directives = [
+            {'Namespace': NAMESPACE, 'Dimensions': [['FunctionName']], 'Metrics': metrics[i:i + MAX_METRICS]}
+            for i in range(0, len(metrics), MAX_METRICS)
+        ]
+        return {
+            '_aws': {'Timestamp': int(time.time() * 1000), 'CloudWatchMetrics': directives},
+            'FunctionName': function_name,
+            **values,
+            'LatencyHistogram': histograms
+        }
+
+def _samples(latencies):
+    """Latencies rounded to microseconds; above the EMF limit, evenly spaced quantiles stand in for them."""
+    ordered = sorted(latencies)
+    if len(ordered) > MAX_SAMPLES:
+        step = (len(ordered) - 1) / (MAX_SAMPLES - 1)
+        ordered = [ordered[round(i * step)] for i in range(MAX_SAMPLES)]
+    return [round(latency, 3) for latency in ordered]
+
+def _histogram(latencies):
+    """Call counts per bucket, keyed by upper bound ('le_50' = at most 50 ms); empty buckets are left out."""
+    counts = {}
+    for latency in latencies:
+        bucket = next((f"le_{bound}" for bound in LATENCY_BUCKETS_MS if latency <= bound), 'le_inf')
+        counts[bucket] = counts.get(bucket, 0) + 1
+    return counts
+
+_current = None  # The invocation being recorded; worker threads started by the handler see it too
+
+def _operation_name(model):
+    return f"{model.service_model.service_name}.{model.name}"
+
+def _request_bytes(request):
+    """Payload size of one HTTP attempt; streamed uploads only carry their size in a header."""
+    for header in ('Content-Length', 'X-Amz-Decoded-Content-Length'):
+        if request.headers.get(header):
+            return int(request.headers[header])
+    if isinstance(request.body, (bytes, str)):
+        return len(request.body)
+    return 0
+
+def _before_call(model, context, **kwargs):
+    if _current is not None:
+        context['metrics'] = {'operation': _operation_name(model), 'start': time.perf_counter(), 'sent': 0}
+
+def _request_created(request, **kwargs):
+    call = getattr(request, 'context', {}).get('metrics')
+    if call is not None:
+        call['sent'] += _request_bytes(request)
+
+def _needs_retry(response, operation, **kwargs):
+    # Runs after every attempt; must return None so the retry decision is left to botocore
+    invocation = _current
+    if invocation is None or response is None:
+        return
+    if is_throttle(*response):
+        invocation.record_throttle(_operation_name(operation))
+
+def _after_call(http_response, parsed, model, context, **kwargs):
+    call = context.get('metrics')
+    invocation = _current
+    if call is None or invocation is None:
+        return
+    received = http_response.headers.get('content-length')
+    if received is None and not model.has_streaming_output:
+        received = len(http_response.content or b'')
+    invocation.record_call(
+        call['operation'],
+        (time.perf_counter() - call['start']) * 1000,
+        http_response.status_code >= 300,
+        parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+        call['sent'],
+        int(received or 0)
+    )
+
+def _after_call_error(context, **kwargs):
+    # Connection errors and timeouts that never produced a response
+    call = context.get('metrics')
+    invocation = _current
+    if call is not None and invocation is not None:
+        invocation.record_call(call['operation'], (time.perf_counter() - call['start']) * 1000, True, 0, call['sent'], 0)
+
+def _register(client):
+    events = client.meta.events
+    events.register('before-call', _before_call, unique_id='shared.metrics.before-call')
+    events.register('request-created', _request_created, unique_id='shared.metrics.request-created')
+    events.register('needs-retry', _needs_retry, unique_id='shared.metrics.needs-retry')
+    events.register('after-call', _after_call, unique_id='shared.metrics.after-call')
+    events.register('after-call-error', _after_call_error, unique_id='shared.metrics.after-call-error')
+
+@contextlib.contextmanager
+def phase(name):
+    """Time a step of the handler; repeated phases with the same name are added together."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        invocation = _current
+        if invocation is not None:
+            invocation.record_phase(name, (time.perf_counter() - start) * 1000)
+
+def instrumented(handler):
+    """
+    Record AWS API metrics for each invocation of a Lambda handler and print them as one EMF
+    line when it returns or raises. Only calls made through shared.client/resource are seen.
+    """
+    if not ENABLED:
+        return handler
+    on_client_created(_register)
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global _current
+        if _current is not None:
+            return handler(event, context)  # Already recorded by an outer instrumented call
+        invocation = _current = _Invocation()
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = handler(event, context)
+            failed = False
+            return result
+        finally:
+            _current = None
+            function_name = getattr(context, 'function_name', None) or os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+            duration_ms = (time.perf_counter() - start) * 1000
+            print(json.dumps(invocation.emf(function_name, duration_ms, failed), separators=(',', ':')))
+
+    return wrapper
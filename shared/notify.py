@@ -0,0 +1,176 @@
+"""
+Buffered SNS notifications for the alerting handlers.
+
+A handler adds alerts to a Notifier while it runs and flushes once at the end, instead of
+calling sns.publish inline for each one:
+
+* identical alerts (same subject and message) are sent once, with a count of how many times
+  they came up;
+* with dedup=True, an alert already sent from this execution environment within the dedup
+  window is not sent again. Only handlers whose alerts repeat (a retried stream batch) should
+  opt in: a handler that alerts on state transitions must not, or a target that fails, recovers
+  and fails again within the window would have its second failure dropped;
+* the rest go out with publish_batch, up to 10 per call;
+* past the per-invocation cap, the remaining alerts are folded into one digest message, so a
+  bulk change produces a handful of emails instead of thousands.
+
+Settings (environment variables):
+    NOTIFY_MAX_MESSAGES    alerts sent individually per invocation before the digest (default 20)
+    NOTIFY_DEDUP_SECONDS   with dedup=True, how long a sent alert suppresses identical ones (default 300)
+"""
+import hashlib
+import os
+import time
+
+from .clients import client
+
+MAX_MESSAGES = int(os.environ.get('NOTIFY_MAX_MESSAGES', 20))
+DEDUP_SECONDS = int(os.environ.get('NOTIFY_DEDUP_SECONDS', 300))
+
+BATCH_SIZE = 10                    # Entries per PublishBatch call
+MAX_PAYLOAD_BYTES = 256 * 1024     # Per PublishBatch call, all entries together
+MAX_MESSAGE_BYTES = MAX_PAYLOAD_BYTES - 1024  # One message, leaving room for its subject
+MAX_SUBJECT_LENGTH = 100
+
+_sent = {}  # Content hash -> time its dedup window ends, kept across warm invocations
+
+def _utf8_truncate(text, limit):
+    data = text.encode('utf-8')
+    if len(data) <= limit:
+        return text
+    return data[:limit].decode('utf-8', 'ignore')
+
+class _Alert:
+    __slots__ = ('subject', 'message', 'refs', 'count')
+
+    def __init__(self, subject, message):
+        self.subject = subject
+        self.message = message
+        self.refs = []
+        self.count = 0
+
+    def body(self):
+        if self.count > 1:
+            return f"{self.message}\n\n(This alert was raised {self.count} times.)"
+        return self.message
+
+class Notifier:
+    """
+    Alerts for one invocation, published to topic_arn by flush(). Not thread-safe; add alerts
+    from the handler's thread, e.g. after a thread pool's results are collected.
+    """
+
+    def __init__(self, topic_arn, max_messages=None, dedup=False, dedup_seconds=None):
+        self.topic_arn = topic_arn
+        self.max_messages = MAX_MESSAGES if max_messages is None else max_messages
+        self.dedup_seconds = (DEDUP_SECONDS if dedup_seconds is None else dedup_seconds) if dedup else 0
+        self.alerts = {}
+        self.counts = {'added': 0, 'duplicates': 0, 'suppressed': 0, 'published': 0, 'digested': 0, 'failed': 0}
+
+    def add(self, subject, message, ref=None):
+        """
+        Queue an alert. ref identifies what raised it (e.g. a stream sequence number); flush()
+        returns the refs of alerts that could not be published.
+        """
+        digest = hashlib.sha256(f"{subject}\0{message}".encode('utf-8')).hexdigest()
+        alert = self.alerts.get(digest)
+        if alert is None:
+            alert = self.alerts[digest] = _Alert(subject, message)
+        else:
+            self.counts['duplicates'] += 1
+        alert.count += 1
+        if ref is not None:
+            alert.refs.append(ref)
+        self.counts['added'] += 1
+
+    def flush(self):
+        """
+        Publish the queued alerts and return the refs of the ones that failed (their subjects
+        for alerts added without a ref), so an empty list means everything was sent. Failures
+        are printed, not raised.
+        """
+        now = time.monotonic()
+        for digest, expires in list(_sent.items()):
+            if expires <= now:
+                del _sent[digest]
+        pending = []
+        for digest, alert in self.alerts.items():
+            if digest in _sent:
+                self.counts['suppressed'] += alert.count
+            else:
+                pending.append((digest, alert))
+        self.alerts = {}
+
+        cap = max(self.max_messages, 1)
+        entries = [
+            ([digest], alert.subject, _utf8_truncate(alert.body(), MAX_MESSAGE_BYTES), alert.refs or [alert.subject])
+            for digest, alert in pending[:cap]
+        ]
+        if len(pending) > cap:
+            # The digest takes the last slot, so no more than cap messages go out
+            rest = pending[cap - 1:]
+            self.counts['digested'] += sum(alert.count for _, alert in rest)
+            entries = entries[:cap - 1] + [self._digest(rest)]
+
+        failed = []
+        for batch in self._batches(entries):
+            failed += self._publish(batch, now)
+
+        print(f"Notifications: {', '.join(f'{name} {count}' for name, count in self.counts.items())}")
+        return failed
+
+    def _digest(self, alerts):
+        """One entry standing in for many alerts, grouped by subject."""
+        total = sum(alert.count for _, alert in alerts)
+        by_subject = {}
+        for _, alert in alerts:
+            by_subject.setdefault(alert.subject, []).append(alert)
+        lines = [f"{total} more alert(s) were raised in this run; they are summarised here.", ""]
+        for subject, grouped in by_subject.items():
+            lines += [f"== {subject} ({sum(a.count for a in grouped)}) ==", ""]
+            lines += [alert.body() + "\n" for alert in grouped]
+        message = "\n".join(lines)
+        if len(message.encode('utf-8')) > MAX_MESSAGE_BYTES:
+            message = _utf8_truncate(message, MAX_MESSAGE_BYTES - 100) + "\n\n[Digest truncated]"
+        subject = f"Digest: {total} alert(s), {next(iter(by_subject))}"[:MAX_SUBJECT_LENGTH]
+        refs = [ref for _, alert in alerts for ref in alert.refs or [alert.subject]]
+        return [digest for digest, _ in alerts], subject, message, refs
+
+    @staticmethod
+    def _batches(entries):
+        """Groups of at most BATCH_SIZE entries whose messages fit in one PublishBatch request."""
+        batch, size = [], 0
+        for entry in entries:
+            entry_size = len(entry[1].encode('utf-8')) + len(entry[2].encode('utf-8'))
+            if batch and (len(batch) == BATCH_SIZE or size + entry_size > MAX_PAYLOAD_BYTES):
+                yield batch
+                batch, size = [], 0
+            batch.append(entry)
+            size += entry_size
+        if batch:
+            yield batch
+
+    def _publish(self, batch, now):
+        request = [
+            {'Id': str(i), 'Subject': subject[:MAX_SUBJECT_LENGTH], 'Message': message}
+            for i, (_, subject, message, _) in enumerate(batch)
+        ]
+        try:
+            response = client('sns').publish_batch(TopicArn=self.topic_arn, PublishBatchRequestEntries=request)
+            errors = {f['Id']: f"{f.get('Code')}: {f.get('Message', '')}" for f in response.get('Failed', [])}
+        except Exception as e:
+            errors = {entry['Id']: str(e) for entry in request}
+
+        failed = []
+        for i, (digests, subject, _, refs) in enumerate(batch):
+            error = errors.get(str(i))
+            if error:
+                print(f"Failed to publish alert {subject!r}: {error}")
+                self.counts['failed'] += 1
+                failed += refs
+            else:
+                self.counts['published'] += 1
+                if self.dedup_seconds > 0:
+                    for digest in digests:
+                        _sent[digest] = now + self.dedup_seconds
+        return failed
@@ -0,0 +1,139 @@
+"""
+Streaming writers for results too large to hold in memory or return from a Lambda.
+
+MultipartWriter streams bytes to one S3 object: a single PutObject when the data fits in one
+part, a multipart upload once it grows past that. ResultSink builds on it to record
+per-object outcomes (deleted, archived, error, ...) as gzip-compressed NDJSON, keeping only
+counters, and optionally a few sample records, for the handler's response.
+
+Settings (environment variables):
+    REPORT_SAMPLE_SIZE   records kept inline per status in the response (default 0)
+    REPORT_ERROR_SAMPLE_SIZE  without a report bucket, errors logged and returned (default 100)
+    REPORT_PART_SIZE_MB  size of each uploaded part, at least 5 (default 8)
+"""
+import io
+import json
+import os
+import uuid
+import zlib
+from datetime import datetime, timezone
+
+from .clients import client
+
+SAMPLE_SIZE = int(os.environ.get('REPORT_SAMPLE_SIZE', 0))
+ERROR_SAMPLE_SIZE = int(os.environ.get('REPORT_ERROR_SAMPLE_SIZE', 100))
+PART_SIZE = max(int(os.environ.get('REPORT_PART_SIZE_MB', 8)), 5) * 1024 * 1024  # S3 minimum part size is 5 MB
+
+class MultipartWriter:
+    """Stream bytes to an S3 object without holding more than one part in memory."""
+
+    def __init__(self, s3, bucket, key, part_size=PART_SIZE, **object_args):
+        self.s3, self.bucket, self.key = s3, bucket, key
+        self.part_size = part_size
+        self.object_args = object_args  # e.g. ContentType, passed to PutObject/CreateMultipartUpload
+        self.upload_id = None
+        self.buffer = io.BytesIO()
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        self.buffer.write(data)
+        self.size += len(data)
+        if self.buffer.tell() >= self.part_size:
+            self._flush()
+
+    def _flush(self):
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, **self.object_args
+            )['UploadId']
+        number = len(self.parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=number, Body=self.buffer.getvalue()
+        )
+        self.parts.append({'PartNumber': number, 'ETag': response['ETag']})
+        self.buffer = io.BytesIO()
+
+    def close(self):
+        """Finish the object and return its ETag, or None (and no object) when nothing was written."""
+        if not self.size:
+            self.abort()
+            return None
+        if self.upload_id is None:
+            response = self.s3.put_object(
+                Bucket=self.bucket, Key=self.key, Body=self.buffer.getvalue(), **self.object_args
+            )
+            return response['ETag'].strip('"')
+        if self.buffer.tell():
+            self._flush()
+        response = self.s3.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts}
+        )
+        return response['ETag'].strip('"')
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+
+class ResultSink:
+    """
+    Per-object outcomes of one run, written to s3://bucket/prefix<timestamp>-<id>.ndjson.gz
+    as one JSON object per line: {"key": ..., "status": ..., plus any extra fields}.
+    With no bucket nothing is written: the counters and samples are kept, and the first
+    ERROR_SAMPLE_SIZE 'error' records are logged and returned, so failures are never reduced
+    to a count.
+    Not thread-safe; call add() from one thread (the pipeline's on_result callbacks qualify).
+    """
+
+    def __init__(self, bucket, prefix, sample_size=None):
+        self.key = f"{prefix}{datetime.now(timezone.utc):%Y-%m-%dT%H-%M-%SZ}-{uuid.uuid4().hex[:8]}.ndjson.gz"
+        self.location = f"s3://{bucket}/{self.key}" if bucket else None
+        self.writer = bucket and MultipartWriter(client('s3'), bucket, self.key, ContentType='application/x-ndjson')
+        self.compressor = zlib.compressobj(wbits=31)  # wbits=31 writes a gzip container
+        self.sample_size = SAMPLE_SIZE if sample_size is None else sample_size
+        self.counts = {}
+        self.samples = {}
+        self.errors = []
+
+    def add(self, status, key, **fields):
+        record = {'key': key, 'status': status, **fields}
+        self.counts[status] = self.counts.get(status, 0) + 1
+        sample = self.samples.setdefault(status, [])
+        if len(sample) < self.sample_size:
+            sample.append(record)
+        if not self.writer:
+            if status == 'error' and len(self.errors) < ERROR_SAMPLE_SIZE:
+                print(f"Error: {json.dumps(record, default=str)}")
+                self.errors.append(record)
+            return
+        line = json.dumps(record, default=str, separators=(',', ':')).encode('utf-8') + b'\n'
+        data = self.compressor.compress(line)
+        if data:
+            self.writer.write(data)
+
+    def close(self):
+        """
+        Finish the report and return {'report': location} (None when nothing was recorded or
+        there is no bucket), plus {'sample': {status: [records]}} when REPORT_SAMPLE_SIZE is set
+        and, without a bucket, {'errors': [records]} when any errors were recorded.
+        """
+        if self.writer and self.counts:
+            self.writer.write(self.compressor.flush())
+            self.writer.close()
+        elif self.writer:
+            self.writer.abort()
+        summary = {'report': self.location if self.counts else None}
+        if self.sample_size:
+            summary['sample'] = self.samples
+        if not self.writer and self.counts.get('error'):
+            summary['errors'] = self.errors
+            if self.counts['error'] > len(self.errors):
+                print(f"{self.counts['error'] - len(self.errors)} more error(s) not shown; set a report bucket to keep them all")
+        return summary
+
+    def abort(self):
+        if self.writer:
+            self.writer.abort()
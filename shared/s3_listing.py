@@ -0,0 +1,250 @@
+"""
+Prefix-partitioned parallel listing for large buckets.
+
+A single list_objects_v2 continuation chain lists about 1000 keys per round trip no matter
+how many workers wait on it. This engine splits the keyspace into ranges and lists them
+concurrently:
+
+1. Discovery lists one page with a delimiter ('/'). Objects at that level are emitted as-is,
+   every common prefix becomes a partition, and anything past a truncated page becomes a
+   StartAfter range. A level with a single prefix is probed one level deeper.
+2. `concurrency` workers list partitions. A partition still truncated after HOT_PAGES pages is
+   hot: when a worker is idle its remaining range is split at probed boundary keys, it stops at
+   the first boundary, and the other ranges are queued for the idle workers.
+3. Pages are merged into one async generator. With ordered=True they come out in key order,
+   so the last key seen is a valid StartAfter for resuming. A partition ahead of the one being
+   emitted buffers at most PAGES_AHEAD pages, then its worker waits for its turn, so memory
+   stays bounded by about concurrency * PAGES_AHEAD pages in either mode.
+
+Settings (environment variables):
+    LIST_CONCURRENCY  partitions listed at once; 1 keeps a single continuation chain (default 8)
+"""
+import asyncio
+import bisect
+import itertools
+import os
+
+CONCURRENCY = int(os.environ.get('LIST_CONCURRENCY', 8))
+
+DELIMITER = '/'
+HOT_PAGES = 2            # pages a partition lists before it may be split
+MAX_PROBE_DEPTH = 3      # delimiter levels discovery descends through a lone prefix
+MAX_SPLIT_POSITIONS = 8  # key positions probed when looking for split points
+PAGES_AHEAD = 2          # pages a partition may buffer in ordered mode before its worker waits
+# Characters tried as split points; sorted, and biased towards the ones common in keys
+SPLIT_ALPHABET = '-0123456789ACEGIKMOQSUWY_acegikmoqsuwy'
+# Sorts after any character that can follow a prefix, so StartAfter=prefix + LAST_CHAR skips the whole prefix
+LAST_CHAR = '\U0010ffff'
+
+class _Partition:
+    """Keys under prefix that sort after start_after and no later than stop_at (None: no bound)."""
+
+    def __init__(self, prefix, start_after=None, stop_at=None, objects=None):
+        self.prefix = prefix
+        self.start_after = start_after
+        self.stop_at = stop_at
+        self.objects = objects  # Set for the objects found during discovery, which need no listing
+        self.pages = asyncio.Queue(maxsize=PAGES_AHEAD)  # Used in ordered mode only
+        self.lower = objects[0]['Key'] if objects else max(prefix, start_after or '')
+
+def _spread(items, count):
+    """Up to count items spaced evenly through items, keeping their order."""
+    if len(items) <= count:
+        return items
+    step = len(items) / count
+    return [items[int(i * step)] for i in range(count)]
+
+async def _first_key_after(s3, bucket, prefix, key):
+    page = await s3.list_objects_v2(Bucket=bucket, Prefix=prefix, StartAfter=key, MaxKeys=1)
+    contents = page.get('Contents', [])
+    return contents[0]['Key'] if contents else None
+
+async def split_points(s3, bucket, prefix, last_key, stop_at, count):
+    """
+    Up to count keys between last_key and stop_at that each start a non-empty range of the
+    remaining keyspace, found with two rounds of concurrent one-key probes. The first finds the
+    leftmost position of last_key at which later keys differ from it (the widest split); the
+    second tries SPLIT_ALPHABET characters at that position.
+    """
+    def below_stop(key):
+        return key is not None and (stop_at is None or key <= stop_at)
+
+    positions = [
+        p for p in range(len(prefix), len(last_key))
+        if last_key[p] != LAST_CHAR and below_stop(last_key[:p] + chr(ord(last_key[p]) + 1))
+    ][:MAX_SPLIT_POSITIONS]
+    successors = [last_key[:p] + chr(ord(last_key[p]) + 1) for p in positions]
+    firsts = await asyncio.gather(*(_first_key_after(s3, bucket, prefix, key) for key in successors))
+    found = [(p, key) for p, key, first in zip(positions, successors, firsts) if below_stop(first)]
+    if not found:
+        return []
+    position, successor = found[0]
+
+    candidates = [last_key[:position] + c for c in SPLIT_ALPHABET if c > last_key[position]]
+    candidates = _spread([c for c in candidates if stop_at is None or c < stop_at], count * 2)
+    firsts = await asyncio.gather(*(_first_key_after(s3, bucket, prefix, c) for c in candidates))
+    # A candidate is useful when the first key after it comes before the next candidate
+    bounds = candidates[1:] + [stop_at]
+    points = [
+        candidate for candidate, first, bound in zip(candidates, firsts, bounds)
+        if first is not None and (bound is None or first <= bound)
+    ]
+    # The successor is known to start a non-empty range when no alphabet character does
+    return _spread(points, count) if points else [successor]
+
+async def _discover(s3, bucket, prefix, start_after, depth=0):
+    """Partitions covering every key under prefix after start_after, in key order."""
+    head = []
+    rest = start_after[len(prefix):] if start_after and start_after.startswith(prefix) else ''
+    if DELIMITER in rest:
+        # The prefix holding start_after is partly listed already: discover its remainder on
+        # its own and skip past it here, since S3 may leave it out of CommonPrefixes
+        inner = prefix + rest.split(DELIMITER, 1)[0] + DELIMITER
+        head = (await _discover(s3, bucket, inner, start_after, depth + 1) if depth < MAX_PROBE_DEPTH
+                else [_Partition(inner, start_after=start_after)])
+        start_after = inner + LAST_CHAR
+
+    params = {'Bucket': bucket, 'Prefix': prefix, 'Delimiter': DELIMITER}
+    if start_after:
+        params['StartAfter'] = start_after
+    page = await s3.list_objects_v2(**params)
+    objects = page.get('Contents', [])
+    prefixes = [p['Prefix'] for p in page.get('CommonPrefixes', [])]
+
+    if len(prefixes) == 1 and not objects and not head and not page.get('IsTruncated') and depth < MAX_PROBE_DEPTH:
+        return await _discover(s3, bucket, prefixes[0], start_after, depth + 1)
+
+    # Objects between two prefixes become one partition, so key order survives the merge
+    partitions = head
+    loose = []
+    entries = sorted([(o['Key'], o) for o in objects] + [(p, None) for p in prefixes], key=lambda e: e[0])
+    for key, obj in entries:
+        if obj is not None:
+            loose.append(obj)
+            continue
+        if loose:
+            partitions.append(_Partition(prefix, objects=loose))
+            loose = []
+        after = start_after if start_after and start_after > key else None
+        partitions.append(_Partition(key, start_after=after))
+    if loose:
+        partitions.append(_Partition(prefix, objects=loose))
+
+    if page.get('IsTruncated') and entries:
+        last, obj = entries[-1]
+        partitions.append(_Partition(prefix, start_after=last if obj is not None else last + LAST_CHAR))
+    return partitions
+
+async def iter_pages(s3, bucket, prefix='', start_after=None, concurrency=None, ordered=False):
+    """
+    Async generator of object lists (list_objects_v2 'Contents' entries) covering every key
+    under prefix after start_after. s3 is an async client (see shared.s3_pipeline.async_client).
+    With concurrency 1 this is a plain continuation chain, which is always in key order.
+    """
+    concurrency = concurrency or CONCURRENCY
+    if concurrency <= 1:
+        params = {'Bucket': bucket, 'Prefix': prefix}
+        if start_after:
+            params['StartAfter'] = start_after
+        while True:
+            page = await s3.list_objects_v2(**params)
+            if page.get('Contents'):
+                yield page['Contents']
+            if not page.get('IsTruncated'):
+                return
+            params['ContinuationToken'] = page['NextContinuationToken']
+
+    partitions = await _discover(s3, bucket, prefix, start_after)
+    order = list(partitions)              # Every partition by lower bound, for ordered output
+    work = asyncio.PriorityQueue()        # Earliest ranges first, so ordered output is not starved
+    output = asyncio.Queue(maxsize=concurrency * 2)
+    sequence = itertools.count()
+    busy = 0
+
+    async def emit(partition, objects):
+        if ordered:
+            await partition.pages.put(objects)
+        else:
+            await output.put(objects)
+
+    def add(partition):
+        work.put_nowait((partition.lower, next(sequence), partition))
+
+    async def list_partition(partition):
+        if partition.objects is not None:
+            await emit(partition, partition.objects)
+            return
+        params = {'Bucket': bucket, 'Prefix': partition.prefix}
+        if partition.start_after:
+            params['StartAfter'] = partition.start_after
+        pages = 0
+        while True:
+            page = await s3.list_objects_v2(**params)
+            objects = page.get('Contents', [])
+            done = not page.get('IsTruncated')
+            if partition.stop_at is not None and objects and objects[-1]['Key'] > partition.stop_at:
+                objects = [o for o in objects if o['Key'] <= partition.stop_at]
+                done = True
+            if objects:
+                await emit(partition, objects)
+            if done:
+                return
+            params['ContinuationToken'] = page['NextContinuationToken']
+            pages += 1
+            idle = concurrency - busy - work.qsize()
+            if pages % HOT_PAGES == 0 and idle > 0:
+                points = await split_points(s3, bucket, partition.prefix, objects[-1]['Key'], partition.stop_at, idle)
+                if points:
+                    for start, stop in zip(points, points[1:] + [partition.stop_at]):
+                        child = _Partition(partition.prefix, start_after=start, stop_at=stop)
+                        bisect.insort(order, child, key=lambda p: p.lower)
+                        add(child)
+                    partition.stop_at = points[0]
+
+    async def worker():
+        nonlocal busy
+        while True:
+            _, _, partition = await work.get()
+            busy += 1
+            try:
+                await list_partition(partition)
+                if ordered:
+                    await partition.pages.put(None)
+            finally:
+                busy -= 1
+                work.task_done()
+
+    async def finish():
+        await work.join()
+        if not ordered:
+            await output.put(None)
+
+    for partition in partitions:
+        add(partition)
+    tasks = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    tasks.append(asyncio.create_task(finish()))
+
+    async def next_page():
+        # Surface a failed worker instead of waiting forever for its pages
+        getter = asyncio.ensure_future(order[index].pages.get() if ordered else output.get())
+        done, _ = await asyncio.wait([getter] + tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task is not getter and not task.cancelled() and task.exception():
+                getter.cancel()
+                raise task.exception()
+        return await getter
+
+    index = 0
+    try:
+        while not ordered or index < len(order):
+            objects = await next_page()
+            if objects is None:
+                if not ordered:
+                    return
+                index += 1
+                continue
+            yield objects
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
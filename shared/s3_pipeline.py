@@ -0,0 +1,111 @@
+"""
+Asyncio pipeline that lists a bucket and mutates the listed objects at the same time.
+
+One producer lists the bucket (with shared.s3_listing, in parallel partitions unless
+LIST_CONCURRENCY is 1) and puts batches of selected objects on a bounded queue; `workers`
+consumers take batches off it and run the handler's mutation (delete, batch delete,
+storage-class copy). Listing never waits for a page's mutations and
+mutations never wait for the next page, so throughput is set by the S3 request rate, and
+memory is bounded by the queue depth.
+
+S3 calls go through the shared (blocking) client on a thread pool sized to the listers and
+consumers, so they are retried, throttled and counted in shared.metrics like every other call.
+"""
+import asyncio
+import contextlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from .clients import client
+from .s3_listing import CONCURRENCY, iter_pages
+
+class _ThreadClient:
+    """Async view of a shared client: every call runs on the given thread pool."""
+
+    def __init__(self, sync_client, executor):
+        self._client = sync_client
+        self._executor = executor
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        async def call(**kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(method, **kwargs))
+        return call
+
+@contextlib.asynccontextmanager
+async def async_client(service_name, max_pool_connections):
+    """An async client for one pipeline run: the shared client, called on its own thread pool."""
+    with ThreadPoolExecutor(max_workers=max_pool_connections) as executor:
+        yield _ThreadClient(client(service_name, max_pool_connections=max_pool_connections), executor)
+
+async def _pipeline(bucket, mutate, select, prefix, start_after, batch_size, workers,
+                    queue_depth, should_stop, on_result, list_concurrency):
+    queue = asyncio.Queue(maxsize=queue_depth)
+    totals = {'scanned': 0, 'selected': 0, 'start_after': None}
+
+    async with async_client('s3', workers + list_concurrency) as s3:
+        async def produce():
+            # Resuming needs every key before the resume point handled, so stoppable runs list in key order
+            pages = iter_pages(s3, bucket, prefix, start_after, list_concurrency, ordered=should_stop is not None)
+            try:
+                async for objects in pages:
+                    batch = []
+                    for obj in objects:
+                        totals['scanned'] += 1
+                        if select is None or select(obj):
+                            batch.append(obj)
+                            if len(batch) == batch_size:
+                                await queue.put(batch)  # Blocks while the queue is full: the backpressure
+                                batch = []
+                    if batch:
+                        await queue.put(batch)
+                    if should_stop is not None and should_stop():
+                        totals['start_after'] = objects[-1]['Key']
+                        break
+            finally:
+                await pages.aclose()
+            for _ in range(workers):
+                await queue.put(None)
+
+        async def consume():
+            while True:
+                objects = await queue.get()
+                if objects is None:
+                    return
+                totals['selected'] += len(objects)
+                result = await mutate(s3, objects)
+                if on_result is not None:
+                    on_result(objects, result)
+
+        tasks = [asyncio.create_task(produce())] + [asyncio.create_task(consume()) for _ in range(workers)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+    return totals
+
+def list_and_mutate(bucket, mutate, select=None, prefix='', start_after=None, batch_size=1,
+                    workers=8, queue_depth=None, should_stop=None, on_result=None, list_concurrency=None):
+    """
+    List `bucket` under `prefix` and run `await mutate(s3, objects)` on every batch of up to
+    batch_size selected objects, with `workers` batches in flight.
+
+    select(obj) filters the list_objects_v2 entries (default: every object). on_result(objects,
+    result) is called with each batch and the value mutate returned; it runs on the event loop,
+    so it needs no locking. mutate should handle its own per-object errors: an exception stops
+    the whole run and is raised here.
+
+    should_stop() is checked after each page. When it returns true, listing stops, the batches
+    already queued are finished, and the returned start_after is the last key listed, to pass
+    back in to resume (None once the listing is complete). Pages then arrive in key order.
+    list_concurrency defaults to LIST_CONCURRENCY. Returns {'scanned', 'selected', 'start_after'}.
+    """
+    return asyncio.run(_pipeline(
+        bucket, mutate, select, prefix, start_after, batch_size, workers,
+        queue_depth or workers * 2, should_stop, on_result, list_concurrency or CONCURRENCY
+    ))
@@ -0,0 +1,195 @@
+"""
+Adaptive, throttle-aware concurrency control for every call made through the shared clients.
+
+Each service operation (e.g. "ec2.DeleteSnapshot") gets a limiter with two gates that a call
+passes before it is sent:
+
+* an in-flight limit adjusted with AIMD: it grows by about one call per round of calls that
+  ran at the limit without being throttled, and is halved when a throttling error
+  (SlowDown, RequestLimitExceeded, ThrottlingException, HTTP 429, ...) comes back;
+* a token bucket, for operations with a known request-rate quota (THROTTLE_RATES).
+
+Handlers keep their thread pools and pipelines as they are. A worker whose call would exceed
+the current limit waits when its request is created instead of adding to a retry storm.
+limits() shows the current limit and the throttle count of every operation seen so far.
+They are kept for the life of the execution environment, so warm invocations start from
+what earlier ones learned.
+
+Settings (environment variables):
+    THROTTLE_CONTROL        set to false to send calls without waiting (default true)
+    THROTTLE_INITIAL_LIMIT  in-flight calls per operation before any throttling (default 16)
+    THROTTLE_MIN_LIMIT      lowest in-flight limit (default 1)
+    THROTTLE_MAX_LIMIT      highest in-flight limit (default 64)
+    THROTTLE_RATES          token buckets as "service.Operation=rate[:burst],..." in calls per
+                            second, e.g. "ec2.CreateTags=10:100" (default none)
+"""
+import os
+import threading
+import time
+
+from .clients import on_client_created
+
+ENABLED = os.environ.get('THROTTLE_CONTROL', 'true').lower() == 'true'
+INITIAL_LIMIT = int(os.environ.get('THROTTLE_INITIAL_LIMIT', 16))
+MIN_LIMIT = int(os.environ.get('THROTTLE_MIN_LIMIT', 1))
+MAX_LIMIT = int(os.environ.get('THROTTLE_MAX_LIMIT', 64))
+DECREASE_FACTOR = 0.5
+
+# Error codes AWS services use for throttling (the same set botocore's standard retry mode treats as throttles)
+THROTTLE_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'ProvisionedThroughputExceededException', 'TransactionInProgressException',
+    'RequestLimitExceeded', 'BandwidthLimitExceeded', 'LimitExceededException', 'RequestThrottled',
+    'SlowDown', 'PriorRequestNotComplete', 'EC2ThrottledException'
+}
+
+def _parse_rates(value):
+    """{'ec2.CreateTags': (10.0, 100.0)} from "ec2.CreateTags=10:100"; the burst defaults to one second's worth."""
+    rates = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        name, _, spec = item.partition('=')
+        rate, _, burst = spec.partition(':')
+        rates[name.strip()] = (float(rate), float(burst or rate))
+    return rates
+
+RATES = _parse_rates(os.environ.get('THROTTLE_RATES', ''))
+
+def is_throttle(http_response, parsed):
+    """True when a response is a throttling error."""
+    return http_response.status_code == 429 or parsed.get('Error', {}).get('Code') in THROTTLE_CODES
+
+class _Limiter:
+    """In-flight limit and optional token bucket for one operation; shared by every thread calling it."""
+
+    def __init__(self, rate=None, burst=None):
+        self.condition = threading.Condition()
+        self.limit = float(INITIAL_LIMIT)
+        self.in_flight = 0
+        self.calls = 0
+        self.throttles = 0
+        self.last_decrease = 0.0
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.refilled = time.monotonic()
+
+    def _take_token(self):
+        """Seconds to wait for a token, or 0 once one was taken."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Wait for a free slot (and a token); returns whether the call runs at the limit."""
+        with self.condition:
+            while True:
+                if self.in_flight >= int(self.limit):
+                    self.condition.wait()
+                    continue
+                wait = self._take_token() if self.rate else 0
+                if not wait:
+                    break
+                self.condition.wait(wait)
+            self.in_flight += 1
+            self.calls += 1
+            return self.in_flight >= int(self.limit)
+
+    def release(self, saturated, succeeded):
+        with self.condition:
+            self.in_flight -= 1
+            if succeeded and saturated:
+                # Additive increase: about one more slot per limit's worth of calls that ran at the limit
+                self.limit = min(MAX_LIMIT, self.limit + 1 / self.limit)
+            self.condition.notify()
+
+    def throttled(self, started):
+        with self.condition:
+            self.throttles += 1
+            # Calls sent before the last decrease saw the old limit; one decrease covers all of them
+            if started > self.last_decrease:
+                self.limit = max(MIN_LIMIT, self.limit * DECREASE_FACTOR)
+                self.last_decrease = time.monotonic()
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def limiter(name):
+    """The limiter for an operation named "service.Operation"."""
+    found = _limiters.get(name)
+    if found is not None:
+        return found
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = _Limiter(*RATES.get(name, (None, None)))
+        return _limiters[name]
+
+def limits():
+    """
+    {operation: {'limit', 'in_flight', 'calls', 'throttles', 'rate'}} for every operation called
+    so far in this execution environment. limit is the in-flight calls currently allowed.
+    """
+    with _limiters_lock:
+        items = sorted(_limiters.items())
+    return {
+        name: {
+            'limit': int(found.limit),
+            'in_flight': found.in_flight,
+            'calls': found.calls,
+            'throttles': found.throttles,
+            'rate': found.rate
+        }
+        for name, found in items
+    }
+
+def _operation_name(model):
+    return f"{model.service_model.service_name}.{model.name}"
+
+def _before_call(model, context, **kwargs):
+    # Only names the call: request preparation (compression, checksums) still runs after before-call,
+    # and a slot taken here would leak if it raised, since neither after-call event would follow
+    context['throttle'] = {'operation': _operation_name(model), 'acquired': False, 'throttled': False}
+
+def _request_created(request, **kwargs):
+    # Fires inside the client's request try block, so after-call or after-call-error always follows;
+    # the slot is taken on the first attempt and held across retries
+    call = getattr(request, 'context', {}).get('throttle')
+    if call is None or call['acquired']:
+        return
+    call['saturated'] = limiter(call['operation']).acquire()
+    call['started'] = time.monotonic()
+    call['acquired'] = True
+
+def _needs_retry(response, request_dict, **kwargs):
+    # Runs after every attempt; must return None so the retry decision is left to botocore
+    call = request_dict.get('context', {}).get('throttle')
+    if call is None or not call['acquired'] or response is None or not is_throttle(*response):
+        return
+    call['throttled'] = True
+    limiter(call['operation']).throttled(call['started'])
+
+def _after_call(http_response, context, **kwargs):
+    call = context.pop('throttle', None)
+    if call is not None and call['acquired']:
+        limiter(call['operation']).release(call['saturated'], http_response.status_code < 300 and not call['throttled'])
+
+def _after_call_error(context, **kwargs):
+    call = context.pop('throttle', None)
+    if call is not None and call['acquired']:
+        limiter(call['operation']).release(call['saturated'], False)
+
+def _register(client):
+    events = client.meta.events
+    events.register('before-call', _before_call, unique_id='shared.throttle.before-call')
+    events.register('request-created', _request_created, unique_id='shared.throttle.request-created')
+    events.register('needs-retry', _needs_retry, unique_id='shared.throttle.needs-retry')
+    events.register('after-call', _after_call, unique_id='shared.throttle.after-call')
+    events.register('after-call-error', _after_call_error, unique_id='shared.throttle.after-call-error')
+
+if ENABLED:
+    on_client_created(_register)